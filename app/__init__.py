@@ -4,7 +4,14 @@ from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 
 from config import get_config
-from app.extensions import db, jwt
+from app.extensions import db, jwt, cache
+from app.cli import register_commands
+from app.services.notification_stream import notification_hub
+from app.services.outbox import outbox_worker
+from app.services.passwords import password_hasher
+from app.services.search import student_search
+from app.services.tokens import token_versions
+from app.utils.request_stats import request_stats
 
 
 def create_app(config_name=None):
@@ -18,6 +25,7 @@ def create_app(config_name=None):
     init_extensions(app)
     register_blueprints(app)
     register_error_handlers(app)
+    register_commands(app)
     
     return app
 
@@ -25,6 +33,13 @@ def create_app(config_name=None):
 def init_extensions(app):
     db.init_app(app)
     jwt.init_app(app)
+    cache.init_app(app)
+    token_versions.init_app(app)
+    password_hasher.init_app(app)
+    student_search.init_app(app)
+    request_stats.init_app(app)
+    outbox_worker.init_app(app)
+    notification_hub.init_app(app)
     Migrate(app, db)
     CORS(app, origins=app.config['CORS_ORIGINS'])
 
@@ -1,15 +1,22 @@
 from datetime import datetime, date, timedelta
-from flask import request, jsonify, make_response
+from flask import current_app, request, jsonify, make_response
 from flask_jwt_extended import get_jwt_identity
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 from app.api import admin_bp
-from app.extensions import db
+from app.extensions import db, cache
 from app.utils.decorators import admin_required
+from app.services.menu import invalidate_menu, invalidate_catalog
+from app.services.roster import detect_roster_format, import_roster
+from app.services.tokens import token_versions
+from app.services.notifications import BROADCAST_ROLES
+from app.services.outbox import outbox_metrics
+from app.services.unit_of_work import unit_of_work
 from app.models import (
     User, Dish, Menu, MenuItem, Payment, Subscription,
-    MealRecord, Inventory, Ingredient, PurchaseRequest,
-    PurchaseItem, Review, Notification
+    MealRecord, Inventory, Ingredient, DishIngredient, PurchaseRequest,
+    PurchaseItem
 )
+from app.models.allergen import allergen_codes, mask_from_codes
 
 
 @admin_bp.route('/statistics/payments', methods=['GET'])
@@ -185,6 +192,21 @@ def get_dashboard_statistics():
     }), 200
 
 
+@admin_bp.route('/cache/stats', methods=['GET'])
+@admin_required
+def get_cache_statistics():
+    return jsonify({'cache': cache.get_stats()}), 200
+
+
+@admin_bp.route('/outbox/stats', methods=['GET'])
+@admin_required
+def get_outbox_statistics():
+    """Notification outbox backlog, delivery lag and this worker's throughput"""
+    return jsonify({
+        'outbox': outbox_metrics(current_app.config.get('OUTBOX_MAX_ATTEMPTS', 5))
+    }), 200
+
+
 @admin_bp.route('/purchase-requests', methods=['GET'])
 @admin_required
 def get_all_purchase_requests():
@@ -232,7 +254,7 @@ def get_all_purchase_requests():
 @admin_bp.route('/purchase-requests/<int:request_id>', methods=['PUT'])
 @admin_required
 def update_purchase_request(request_id):
-    admin_id = get_jwt_identity()
+    admin_id = int(get_jwt_identity())
     data = request.get_json()
     
     if not data:
@@ -263,19 +285,14 @@ def update_purchase_request(request_id):
                 inventory.quantity += item.quantity
                 inventory.last_updated = datetime.utcnow()
     
-    db.session.commit()
-    
-    notification = Notification(
-        user_id=purchase_request.created_by,
-        title=f'Заявка {status}',
-        message=f'Ваша заявка на закупку была {status}.'
-    )
-    db.session.add(notification)
-    db.session.commit()
+    with unit_of_work() as uow:
+        uow.publish('purchase_request_reviewed', user_id=purchase_request.created_by, status=status)
+        uow.flush()
+        purchase_request_data = purchase_request.to_dict()
     
     return jsonify({
         'message': f'Заявка {status}',
-        'purchase_request': purchase_request.to_dict()
+        'purchase_request': purchase_request_data
     }), 200
 
 
@@ -494,6 +511,34 @@ def get_users():
     return jsonify({'users': users_data}), 200
 
 
+@admin_bp.route('/users/import', methods=['POST'])
+@admin_required
+def import_users():
+    """Bulk-import students from a CSV or JSONL roster (multipart 'file' or raw body)"""
+    upload = request.files.get('file')
+    
+    fmt = detect_roster_format(
+        request.args.get('format'),
+        upload.filename if upload else None,
+        upload.mimetype if upload else request.mimetype
+    )
+    if not fmt:
+        return jsonify({'error': 'Формат файла должен быть csv или jsonl'}), 400
+    
+    raw = upload.stream if upload else request.stream
+    stream = TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    
+    try:
+        report = import_roster(stream, fmt)
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Файл должен быть в кодировке UTF-8'}), 400
+    
+    return jsonify({
+        'message': f'Импортировано пользователей: {report["created"]}',
+        'report': report
+    }), 200
+
+
 @admin_bp.route('/users/<int:user_id>', methods=['PUT'])
 @admin_required
 def update_user(user_id):
@@ -506,18 +551,26 @@ def update_user(user_id):
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
     
+    if 'role' in data and data['role'] not in ['student', 'cook', 'admin']:
+        return jsonify({'error': 'Неверная роль'}), 400
+    
+    access_changed = (
+        ('is_active' in data and data['is_active'] != user.is_active) or
+        ('role' in data and data['role'] != user.role)
+    )
+    
     if 'is_active' in data:
         user.is_active = data['is_active']
     
     if 'role' in data:
-        if data['role'] in ['student', 'cook', 'admin']:
-            user.role = data['role']
-        else:
-            return jsonify({'error': 'Неверная роль'}), 400
+        user.role = data['role']
     
     if 'full_name' in data:
         user.full_name = data['full_name']
     
+    if access_changed:
+        token_versions.revoke(user)
+    
     db.session.commit()
     
     return jsonify({
@@ -538,9 +591,16 @@ def delete_user(user_id):
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
     
+    has_reviews = bool(user.reviews)
+    for review in user.reviews:
+        review.dish.record_rating(review.rating, -1)
+    
     db.session.delete(user)
     db.session.commit()
     
+    if has_reviews:
+        invalidate_catalog()
+    
     return jsonify({'message': 'Пользователь удален'}), 200
 
 
@@ -588,6 +648,7 @@ def create_menu():
             db.session.add(menu_item)
     
     db.session.commit()
+    invalidate_menu(menu.menu_date, menu.meal_type)
     
     return jsonify({
         'message': 'Меню создано',
@@ -602,8 +663,10 @@ def delete_menu(menu_id):
     if not menu:
         return jsonify({'error': 'Меню не найдено'}), 404
     
+    menu_date, meal_type = menu.menu_date, menu.meal_type
     db.session.delete(menu)
     db.session.commit()
+    invalidate_menu(menu_date, meal_type)
     
     return jsonify({'message': 'Меню удалено'}), 200
 
@@ -627,15 +690,7 @@ def get_dishes():
     dishes_data = []
     for dish in dishes:
         dish_dict = dish.to_dict()
-        
-        reviews = Review.query.filter_by(dish_id=dish.id).all()
-        if reviews:
-            dish_dict['average_rating'] = sum(r.rating for r in reviews) / len(reviews)
-            dish_dict['reviews_count'] = len(reviews)
-        else:
-            dish_dict['average_rating'] = None
-            dish_dict['reviews_count'] = 0
-        
+        dish_dict.update(dish.rating_dict())
         dishes_data.append(dish_dict)
     
     return jsonify({'dishes': dishes_data}), 200
@@ -667,6 +722,7 @@ def create_dish():
     
     db.session.add(dish)
     db.session.commit()
+    invalidate_catalog()
     
     return jsonify({
         'message': 'Блюдо создано',
@@ -700,6 +756,7 @@ def update_dish(dish_id):
         dish.is_available = data['is_available']
     
     db.session.commit()
+    invalidate_catalog()
     
     return jsonify({
         'message': 'Блюдо обновлено',
@@ -740,6 +797,13 @@ def create_ingredient():
         min_stock_level=data.get('min_stock_level', 10.0)
     )
     
+    # Without an explicit list the allergens are guessed from the name
+    if 'allergens' in data:
+        mask = mask_from_codes(data['allergens'] or [])
+        if mask is None:
+            return jsonify({'error': 'Неизвестный код аллергена'}), 400
+        ingredient.allergen_mask = mask
+    
     db.session.add(ingredient)
     db.session.flush()
     
@@ -756,9 +820,90 @@ def create_ingredient():
     }), 201
 
 
+@admin_bp.route('/ingredients/<int:ingredient_id>/allergens', methods=['PUT'])
+@admin_required
+def update_ingredient_allergens(ingredient_id):
+    """Replace an ingredient's allergens; masks of dishes using it follow"""
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('allergens'), list):
+        return jsonify({'error': 'allergens должен быть списком кодов'}), 400
+    
+    ingredient = db.session.get(Ingredient, ingredient_id)
+    if not ingredient:
+        return jsonify({'error': 'Ингредиент не найден'}), 404
+    
+    mask = mask_from_codes(data['allergens'])
+    if mask is None:
+        return jsonify({'error': 'Неизвестный код аллергена'}), 400
+    
+    ingredient.allergen_mask = mask
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Аллергены ингредиента обновлены',
+        'ingredient': ingredient.to_dict()
+    }), 200
+
+
+@admin_bp.route('/dishes/<int:dish_id>/ingredients', methods=['PUT'])
+@admin_required
+def update_dish_ingredients(dish_id):
+    """Replace a dish's recipe: [{ingredient_id, quantity_required}, ...]"""
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('ingredients'), list):
+        return jsonify({'error': 'ingredients должен быть списком'}), 400
+    
+    dish = db.session.get(Dish, dish_id)
+    if not dish:
+        return jsonify({'error': 'Блюдо не найдено'}), 404
+    
+    recipe = {}
+    for item in data['ingredients']:
+        try:
+            ingredient_id = int(item['ingredient_id'])
+            quantity = float(item.get('quantity_required', 0))
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Некорректная строка рецепта'}), 400
+        if quantity < 0:
+            return jsonify({'error': 'Количество не может быть отрицательным'}), 400
+        recipe[ingredient_id] = quantity
+    
+    known = {
+        ingredient_id for (ingredient_id,) in
+        db.session.query(Ingredient.id).filter(Ingredient.id.in_(recipe))
+    } if recipe else set()
+    if known != set(recipe):
+        return jsonify({'error': 'Ингредиент не найден'}), 404
+    
+    current = {item.ingredient_id: item for item in dish.dish_ingredients}
+    for ingredient_id, item in current.items():
+        if ingredient_id not in recipe:
+            db.session.delete(item)
+    for ingredient_id, quantity in recipe.items():
+        if ingredient_id in current:
+            current[ingredient_id].quantity_required = quantity
+        else:
+            db.session.add(DishIngredient(
+                dish_id=dish.id,
+                ingredient_id=ingredient_id,
+                quantity_required=quantity
+            ))
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Рецепт обновлён',
+        'dish_id': dish.id,
+        'ingredients': [item.to_dict() for item in dish.dish_ingredients],
+        'allergens': allergen_codes(dish.allergen_mask)
+    }), 200
+
+
 @admin_bp.route('/send-notification', methods=['POST'])
 @admin_required
 def send_notification():
+    """Notify a role (one broadcast row; role 'all' reaches everyone) or a list of users"""
     data = request.get_json()
     
     if not data:
@@ -772,26 +917,18 @@ def send_notification():
     if not title or not message:
         return jsonify({'error': 'title и message обязательны'}), 400
     
-    if role:
-        users = User.query.filter_by(role=role).all()
-        for user in users:
-            notification = Notification(
-                user_id=user.id,
-                title=title,
-                message=message
-            )
-            db.session.add(notification)
-    elif user_ids:
-        for user_id in user_ids:
-            notification = Notification(
-                user_id=user_id,
-                title=title,
-                message=message
-            )
-            db.session.add(notification)
-    else:
+    if role and role != 'all' and role not in BROADCAST_ROLES:
+        return jsonify({'error': 'Неверная роль'}), 400
+    
+    if not role and not user_ids:
         return jsonify({'error': 'Укажите role или user_ids'}), 400
     
-    db.session.commit()
+    with unit_of_work() as uow:
+        if role:
+            uow.notify_role(None if role == 'all' else role, title, message,
+                            created_by=int(get_jwt_identity()))
+        else:
+            for user_id in user_ids:
+                uow.notify(user_id, title, message)
     
     return jsonify({'message': 'Уведомление отправлено'}), 201
@@ -1,8 +1,11 @@
 from flask import request, jsonify
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, set_access_cookies, set_refresh_cookies, unset_jwt_cookies
+from flask_jwt_extended import jwt_required, get_jwt, set_access_cookies, set_refresh_cookies, unset_jwt_cookies
 from app.api import auth_bp
 from app.extensions import db
 from app.models import User
+from app.services.passwords import password_hasher
+from app.services.tokens import issue_access_token, issue_refresh_token
+from app.utils.current_user import load_current_user
 
 
 @auth_bp.route('/register', methods=['POST'])
@@ -22,7 +25,7 @@ def register():
         full_name=data['full_name'],
         role='student'
     )
-    user.set_password(data['password'])
+    user.password_hash = password_hasher.hash(data['password'])
     
     db.session.add(user)
     db.session.commit()
@@ -42,14 +45,19 @@ def login():
     
     user = User.query.filter_by(email=data['email']).first()
     
-    if not user or not user.check_password(data['password']):
+    if not user or not password_hasher.verify(data['password'], user.password_hash):
         return jsonify({'error': 'Неверный email или пароль'}), 401
     
     if not user.is_active:
         return jsonify({'error': 'Аккаунт неактивен'}), 403
     
-    access_token = create_access_token(identity=str(user.id))
-    refresh_token = create_refresh_token(identity=str(user.id))
+    # Upgrade hashes created with a different BCRYPT_ROUNDS
+    if password_hasher.needs_rehash(user.password_hash):
+        user.password_hash = password_hasher.hash(data['password'])
+        db.session.commit()
+    
+    access_token = issue_access_token(user)
+    refresh_token = issue_refresh_token(user)
     
     response = jsonify({
         'message': 'Вход выполнен успешно',
@@ -75,24 +83,29 @@ def logout():
 @auth_bp.route('/refresh', methods=['POST'])
 @jwt_required(refresh=True)
 def refresh():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(int(current_user_id))
+    user = load_current_user()
     
     if not user or not user.is_active:
         return jsonify({'error': 'Пользователь не найден или неактивен'}), 404
     
-    new_access_token = create_access_token(identity=current_user_id)
+    if get_jwt().get('ver', 0) < (user.token_version or 0):
+        return jsonify({'error': 'Токен отозван, войдите снова'}), 401
     
-    return jsonify({
+    new_access_token = issue_access_token(user)
+    
+    response = jsonify({
         'access_token': new_access_token
-    }), 200
+    })
+    # Cookies win over headers, so a stale access cookie must be replaced too
+    set_access_cookies(response, new_access_token)
+    
+    return response, 200
 
 
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(int(current_user_id))
+    user = load_current_user()
     
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
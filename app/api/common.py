@@ -1,16 +1,26 @@
 from datetime import date
-from flask import request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import request, jsonify, Response, stream_with_context
+from flask_jwt_extended import jwt_required
+from sqlalchemy.orm import joinedload
 from app.api import common_bp
 from app.extensions import db
-from app.models import User, Dish, Menu, MenuItem, Review, MealRecord, Subscription, Inventory, Notification
+from app.models import User, Dish, Menu, MenuItem, Review, MealRecord, Subscription, Inventory
+from app.services.allergens import taxonomy
+from app.services.menu import load_menu, load_available_dishes
+from app.services.notifications import (
+    FEED_SIZE, feed_state, load_feed, feed_cursor, fetch_since, format_cursor, parse_cursor,
+    mark_read, mark_broadcast_read, mark_all_read, unread_count
+)
+from app.services.notification_stream import stream_notifications
+from app.services.passwords import password_hasher
+from app.utils.current_user import load_current_user, load_active_subscription
+from app.utils.http_cache import make_etag, conditional_json
 
 
 @common_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = load_current_user(with_subscription=True)
     
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
@@ -18,21 +28,21 @@ def get_profile():
     profile_data = user.to_dict()
     
     if user.role == 'student':
-        subscription = user.subscriptions.filter_by(is_active=True).first()
+        subscription = load_active_subscription()
         if subscription:
             profile_data['subscription'] = subscription.to_dict()
         
         allergies = [a.to_dict() for a in user.allergies]
         profile_data['allergies'] = allergies
     
-    return jsonify({'profile': profile_data}), 200
+    etag = make_etag('profile', profile_data)
+    return conditional_json(etag, lambda: {'profile': profile_data})
 
 
 @common_bp.route('/profile', methods=['PUT'])
 @jwt_required()
 def update_profile():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = load_current_user()
     
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
@@ -49,10 +59,10 @@ def update_profile():
         if not current_password:
             return jsonify({'error': 'Текущий пароль обязателен'}), 400
         
-        if not user.check_password(current_password):
+        if not password_hasher.verify(current_password, user.password_hash):
             return jsonify({'error': 'Неверный текущий пароль'}), 401
         
-        user.set_password(data['new_password'])
+        user.password_hash = password_hasher.hash(data['new_password'])
     
     db.session.commit()
     
@@ -62,28 +72,19 @@ def update_profile():
     }), 200
 
 
+@common_bp.route('/allergens', methods=['GET'])
+@jwt_required()
+def get_allergens():
+    """Allergen codes used by allergy, ingredient and conflict responses"""
+    return jsonify({'allergens': taxonomy()}), 200
+
+
 @common_bp.route('/dishes', methods=['GET'])
 @jwt_required()
 def get_available_dishes():
-    dishes = Dish.query.filter_by(is_available=True).order_by(Dish.name).all()
-    
-    dishes_data = []
-    for dish in dishes:
-        dish_dict = dish.to_dict()
-        
-        reviews = Review.query.filter_by(dish_id=dish.id).all()
-        if reviews:
-            dish_dict['average_rating'] = round(
-                sum(r.rating for r in reviews) / len(reviews), 1
-            )
-            dish_dict['reviews_count'] = len(reviews)
-        else:
-            dish_dict['average_rating'] = None
-            dish_dict['reviews_count'] = 0
-        
-        dishes_data.append(dish_dict)
+    dishes_data, etag = load_available_dishes()
     
-    return jsonify({'dishes': dishes_data}), 200
+    return conditional_json(etag, lambda: {'dishes': dishes_data})
 
 
 @common_bp.route('/dishes/<int:dish_id>', methods=['GET'])
@@ -94,30 +95,34 @@ def get_dish_details(dish_id):
     if not dish:
         return jsonify({'error': 'Блюдо не найдено'}), 404
     
-    dish_data = dish.to_dict()
-    
-    reviews = Review.query.filter_by(dish_id=dish_id).order_by(
-        Review.created_at.desc()
-    ).all()
-    
-    reviews_data = []
-    for review in reviews:
-        review_dict = review.to_dict()
-        user = User.query.get(review.user_id)
-        if user:
-            review_dict['user_name'] = user.full_name
-        reviews_data.append(review_dict)
-    
-    dish_data['reviews'] = reviews_data
+    # Reviews are only ever added or deleted, so the aggregates plus the
+    # newest review id identify the review list without loading it
+    latest_review_id = db.session.query(
+        db.func.max(Review.id)
+    ).filter(Review.dish_id == dish_id).scalar()
+    etag = make_etag('dish', dish.to_dict(), dish.rating_dict(), latest_review_id)
     
-    if reviews:
-        dish_data['average_rating'] = round(
-            sum(r.rating for r in reviews) / len(reviews), 1
-        )
-    else:
-        dish_data['average_rating'] = None
+    def build_body():
+        dish_data = dish.to_dict()
+        dish_data.update(dish.rating_dict())
+        
+        reviews = Review.query.options(
+            joinedload(Review.user)
+        ).filter_by(dish_id=dish_id).order_by(
+            Review.created_at.desc()
+        ).all()
+        
+        reviews_data = []
+        for review in reviews:
+            review_dict = review.to_dict()
+            if review.user:
+                review_dict['user_name'] = review.user.full_name
+            reviews_data.append(review_dict)
+        
+        dish_data['reviews'] = reviews_data
+        return {'dish': dish_data}
     
-    return jsonify({'dish': dish_data}), 200
+    return conditional_json(etag, build_body)
 
 
 @common_bp.route('/menu/today', methods=['GET'])
@@ -126,50 +131,25 @@ def get_today_menu():
     today = date.today()
     meal_type = request.args.get('meal_type', 'lunch')
     
-    menu = Menu.query.filter_by(
-        menu_date=today,
-        meal_type=meal_type,
-        is_active=True
-    ).first()
+    menu_data, dishes, etag = load_menu(today, meal_type)
     
-    if not menu:
-        return jsonify({
+    if not menu_data:
+        return conditional_json(etag, lambda: {
             'menu': None,
             'dishes': [],
             'message': 'На сегодня меню недоступно'
-        }), 200
-    
-    menu_items = MenuItem.query.filter_by(menu_id=menu.id).all()
-    dishes = []
-    
-    for item in menu_items:
-        dish = Dish.query.get(item.dish_id)
-        if dish and dish.is_available:
-            dish_data = dish.to_dict()
-            
-            reviews = Review.query.filter_by(dish_id=dish.id).all()
-            if reviews:
-                dish_data['average_rating'] = round(
-                    sum(r.rating for r in reviews) / len(reviews), 1
-                )
-                dish_data['reviews_count'] = len(reviews)
-            else:
-                dish_data['average_rating'] = None
-                dish_data['reviews_count'] = 0
-            
-            dishes.append(dish_data)
+        })
     
-    return jsonify({
-        'menu': menu.to_dict(),
+    return conditional_json(etag, lambda: {
+        'menu': menu_data,
         'dishes': dishes
-    }), 200
+    })
 
 
 @common_bp.route('/dashboard', methods=['GET'])
 @jwt_required()
 def get_dashboard():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = load_current_user(with_subscription=True)
     
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
@@ -180,13 +160,14 @@ def get_dashboard():
     }
     
     if user.role == 'student':
-        subscription = user.subscriptions.filter_by(is_active=True).first()
+        subscription = load_active_subscription()
         dashboard_data['subscription'] = subscription.to_dict() if subscription else None
         
-        unread_count = len([n for n in user.notifications if not n.is_read])
-        dashboard_data['unread_notifications'] = unread_count
+        dashboard_data['unread_notifications'] = unread_count(user)
         
-        recent_meals = user.meal_records.order_by(
+        recent_meals = MealRecord.query.filter_by(
+            user_id=user.id
+        ).order_by(
             MealRecord.received_at.desc()
         ).limit(5).all()
         
@@ -248,43 +229,85 @@ def get_dashboard():
 @common_bp.route('/notifications', methods=['GET'])
 @jwt_required()
 def get_notifications():
-    """Get notifications for the current user - available to all authenticated users"""
-    user_id = get_jwt_identity()
+    """Get notifications for the current user - available to all authenticated users.
     
-    unread = Notification.query.filter_by(
-        user_id=user_id,
-        is_read=False
-    ).order_by(Notification.created_at.desc()).all()
+    Personal notifications and role broadcasts come back merged, unread first.
+    """
+    user = load_current_user()
+    if not user:
+        return jsonify({'error': 'Пользователь не найден'}), 404
     
-    read_limit = max(0, 20 - len(unread))
-    read = Notification.query.filter_by(
-        user_id=user_id,
-        is_read=True
-    ).order_by(Notification.created_at.desc()).limit(read_limit).all()
+    version, unread = feed_state(user)
+    etag = make_etag('notifications', user.id, *version)
     
-    notifications = unread + read
+    def build_body():
+        # Taken before the feed is read, so the stream resumes without gaps
+        cursor = format_cursor(*feed_cursor(user))
+        return {
+            'notifications': load_feed(user, max(FEED_SIZE, unread)),
+            'unread_count': unread,
+            'cursor': cursor
+        }
     
-    return jsonify({
-        'notifications': [n.to_dict() for n in notifications],
-        'unread_count': len(unread)
-    }), 200
+    return conditional_json(etag, build_body)
+
+
+@common_bp.route('/notifications/stream', methods=['GET'])
+@jwt_required()
+def stream_notification_feed():
+    """New feed items after a cursor, as SSE or as one JSON answer.
+    
+    The cursor (``<seq>.<broadcast id>``) comes from Last-Event-ID, ``after``
+    or, when neither is given, the newest item.
+    """
+    user = load_current_user()
+    if not user:
+        return jsonify({'error': 'Пользователь не найден'}), 404
+    
+    value = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        cursor = parse_cursor(value) if value else feed_cursor(user)
+    except ValueError:
+        return jsonify({'error': 'Неверный курсор'}), 400
+    
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        # Detached, so the stream's per-read rollbacks do not reload it
+        db.session.expunge(user)
+        db.session.rollback()
+        return Response(
+            stream_with_context(stream_notifications(user, cursor)),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+    
+    items, cursor, _ = fetch_since(user, cursor)
+    return jsonify({'notifications': items, 'cursor': format_cursor(*cursor)}), 200
 
 
 @common_bp.route('/notifications/<int:notification_id>/read', methods=['PUT', 'POST'])
 @jwt_required()
 def mark_notification_read(notification_id):
     """Mark a notification as read - available to all authenticated users"""
-    user_id = get_jwt_identity()
+    user = load_current_user()
+    if not user or not mark_read(user, notification_id):
+        return jsonify({'error': 'Уведомление не найдено'}), 404
     
-    notification = Notification.query.filter_by(
-        id=notification_id,
-        user_id=user_id
-    ).first()
+    db.session.commit()
     
-    if not notification:
+    return jsonify({'message': 'Уведомление отмечено как прочитанное'}), 200
+
+
+@common_bp.route('/notifications/broadcasts/<int:broadcast_id>/read', methods=['PUT', 'POST'])
+@jwt_required()
+def mark_broadcast_notification_read(broadcast_id):
+    """Mark a broadcast as read for the current user"""
+    user = load_current_user()
+    if not user or not mark_broadcast_read(user, broadcast_id):
         return jsonify({'error': 'Уведомление не найдено'}), 404
     
-    notification.mark_as_read()
     db.session.commit()
     
     return jsonify({'message': 'Уведомление отмечено как прочитанное'}), 200
@@ -294,13 +317,11 @@ def mark_notification_read(notification_id):
 @jwt_required()
 def mark_all_notifications_read():
     """Mark all notifications as read - available to all authenticated users"""
-    user_id = get_jwt_identity()
-    
-    Notification.query.filter_by(
-        user_id=user_id,
-        is_read=False
-    ).update({'is_read': True})
+    user = load_current_user()
+    if not user:
+        return jsonify({'error': 'Пользователь не найден'}), 404
     
+    mark_all_read(user)
     db.session.commit()
     
     return jsonify({'message': 'Все уведомления отмечены как прочитанные'}), 200
@@ -1,28 +1,45 @@
-from datetime import datetime, date
-from flask import request, jsonify
+import uuid
+from datetime import datetime, date, time, timedelta
+from flask import current_app, request, jsonify, Response, stream_with_context
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import joinedload
 from flask_jwt_extended import get_jwt_identity
 from app.api import cook_bp
 from app.extensions import db
 from app.utils.decorators import cook_required
+from app.utils.http_cache import make_etag, conditional_json
+from app.services import kitchen_feed, serving
+from app.services.allergens import build_conflict_matrix, conflicts
+from app.services.menu import load_menu
+from app.services.serving import ServeError
+from app.services.unit_of_work import unit_of_work
+from app.services.search import student_search
+from app.models.allergen import allergen_codes
 from app.models import (
-    User, Dish, Menu, MenuItem, Inventory, Ingredient,
-    MealRecord, PurchaseRequest, PurchaseItem, Notification, Allergy, Review, DishPurchase
+    User, Dish, Menu, Inventory, Ingredient,
+    MealRecord, PurchaseRequest, PurchaseItem, Allergy, Review, DishPurchase,
+    Subscription, ServeEvent
 )
 
+MAX_SERVE_BATCH = 100
+MAX_LONG_POLL_SECONDS = 25
+
 
 @cook_bp.route('/meals/today', methods=['GET'])
 @cook_required
 def get_today_meals():
+    """Kitchen view of today's menu: per-dish and per-menu counts plus the roster.
+    
+    Counts come from two aggregate queries; the roster query only runs when
+    the client's ETag is stale. ``event_cursor`` is where a client should
+    start reading /meals/events to keep this snapshot current.
+    """
     today = date.today()
     meal_type = request.args.get('meal_type', 'lunch')
     
-    menu = Menu.query.filter_by(
-        menu_date=today,
-        meal_type=meal_type,
-        is_active=True
-    ).first()
+    menu_data, dishes, _ = load_menu(today, meal_type)
     
-    if not menu:
+    if not menu_data:
         return jsonify({
             'menu': None,
             'dishes': [],
@@ -30,45 +47,73 @@ def get_today_meals():
             'message': 'На сегодня меню недоступно'
         }), 200
     
-    menu_items = MenuItem.query.filter_by(menu_id=menu.id).all()
-    dishes = []
-    total_served = 0
+    menu_id = menu_data['id']
+    today_start = datetime.combine(today, time.min)
+    today_end = datetime.combine(today, time.max)
+    
+    total_meals, total_served, latest_meal_id = db.session.query(
+        db.func.count(MealRecord.id),
+        db.func.coalesce(db.func.sum(db.case((MealRecord.is_confirmed == True, 1), else_=0)), 0),
+        db.func.max(MealRecord.id)
+    ).filter(MealRecord.menu_id == menu_id).one()
+    
+    purchase_meal_type = DishPurchase.meal_type == meal_type
+    if meal_type == 'lunch':
+        purchase_meal_type = db.or_(purchase_meal_type, DishPurchase.meal_type.is_(None))
+    
+    purchase_counts = {
+        dish_id: (purchased, served)
+        for dish_id, purchased, served in db.session.query(
+            DishPurchase.dish_id,
+            db.func.count(DishPurchase.id),
+            db.func.coalesce(db.func.sum(db.case((DishPurchase.is_used == True, 1), else_=0)), 0)
+        ).filter(
+            DishPurchase.purchase_date.between(today_start, today_end),
+            purchase_meal_type
+        ).group_by(DishPurchase.dish_id)
+    }
     
-    for item in menu_items:
-        dish = Dish.query.get(item.dish_id)
-        if dish:
-            served_count = MealRecord.query.filter_by(
-                menu_id=menu.id,
-                is_confirmed=True
-            ).count()
-            
-            dish_data = dish.to_dict()
-            dish_data['meals_served'] = served_count
-            dishes.append(dish_data)
-            total_served += served_count
-    
-    meal_records = MealRecord.query.filter_by(menu_id=menu.id).all()
-    
-    # Build meals data with user info
-    meals_data = []
-    for mr in meal_records:
-        meal_dict = mr.to_dict()
-        # Add user info
-        user = User.query.get(mr.user_id)
-        if user:
+    event_cursor = kitchen_feed.current_cursor()
+    etag = make_etag(
+        'meals_today', menu_data, total_meals, total_served, latest_meal_id,
+        sorted(purchase_counts.items()), event_cursor
+    )
+    
+    def build_body():
+        dishes_data = []
+        for dish in dishes:
+            purchased, served = purchase_counts.get(dish['id'], (0, 0))
+            dish_data = dict(dish)
+            dish_data['purchased'] = int(purchased)
+            dish_data['meals_served'] = int(served)
+            dishes_data.append(dish_data)
+        
+        roster = db.session.query(MealRecord, User.full_name, User.email).join(
+            User, User.id == MealRecord.user_id
+        ).filter(
+            MealRecord.menu_id == menu_id
+        ).order_by(MealRecord.received_at.desc()).all()
+        
+        meals_data = []
+        for meal_record, full_name, email in roster:
+            meal_dict = meal_record.to_dict()
             meal_dict['user'] = {
-                'id': user.id,
-                'full_name': user.full_name,
-                'email': user.email
+                'id': meal_record.user_id,
+                'full_name': full_name,
+                'email': email
             }
-        meals_data.append(meal_dict)
-    
-    return jsonify({
-        'menu': menu.to_dict(),
-        'dishes': dishes,
-        'total_served': total_served,
-        'meals': meals_data
-    }), 200
+            meals_data.append(meal_dict)
+        
+        return {
+            'menu': {key: value for key, value in menu_data.items() if key != 'items'},
+            'dishes': dishes_data,
+            'total_served': int(total_served),
+            'total_meals': total_meals,
+            'meals': meals_data,
+            'event_cursor': event_cursor
+        }
+    
+    return conditional_json(etag, build_body)
 
 
 @cook_bp.route('/meals/serve', methods=['POST'])
@@ -79,133 +124,226 @@ def serve_meal():
     if not data:
         return jsonify({'error': 'Данные не предоставлены'}), 400
     
-    meal_id = data.get('meal_id')
-    user_id = data.get('user_id')
-    meal_type = data.get('meal_type', 'lunch')
-    menu_id = data.get('menu_id')
+    try:
+        # If meal_id provided, mark existing record as served
+        if data.get('meal_id'):
+            payload, status = serving.confirm_meal_record(data['meal_id'])
+        elif data.get('user_id'):
+            payload, status = serving.serve_user_meal(
+                data['user_id'],
+                data.get('meal_type', 'lunch'),
+                data.get('menu_id')
+            )
+        else:
+            return jsonify({'error': 'user_id или meal_id обязательны'}), 400
+    except ServeError as e:
+        db.session.rollback()
+        return jsonify({'error': e.message}), e.status
     
-    # If meal_id provided, mark existing record as served
-    if meal_id:
-        meal_record = MealRecord.query.get(meal_id)
-        if not meal_record:
-            return jsonify({'error': 'Запись о питании не найдена'}), 404
-        
-        if meal_record.is_confirmed:
-            return jsonify({'error': 'Питание уже выдано'}), 409
-        
-        meal_record.is_confirmed = True
-        meal_record.received_at = datetime.utcnow()
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Питание отмечено как выданное',
-            'meal_record': meal_record.to_dict()
-        }), 200
+    db.session.commit()
+    return jsonify(payload), status
+
+
+@cook_bp.route('/serve/scan', methods=['POST'])
+@cook_required
+def serve_scan():
+    """Resolve a student's entitlement and serve a meal in one transaction"""
+    data = request.get_json()
     
-    # Otherwise, need user_id and either menu_id or meal_type
-    if not user_id:
-        return jsonify({'error': 'user_id или meal_id обязательны'}), 400
+    if not data:
+        return jsonify({'error': 'Данные не предоставлены'}), 400
     
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'Пользователь не найден'}), 404
+    student = data.get('student') or data.get('user_id') or data.get('email')
     
-    # Find or create menu for today
-    today = date.today()
-    if not menu_id:
-        menu = Menu.query.filter_by(
-            menu_date=today,
-            meal_type=meal_type,
-            is_active=True
-        ).first()
-        if not menu:
-            # Create a basic menu if none exists
-            menu = Menu(
-                menu_date=today,
-                meal_type=meal_type,
-                is_active=True
-            )
-            db.session.add(menu)
-            db.session.flush()
-        menu_id = menu.id
-    else:
-        menu = Menu.query.get(menu_id)
-        if not menu:
-            return jsonify({'error': 'Меню не найдено'}), 404
-        meal_type = menu.meal_type
-    
-    # NOTE: Allow multiple subscription meals per day
-    # Removed the check that prevents serving multiple meals to the same user per day
-    # Cooks can now serve multiple meals to users who have subscription meals remaining
-    
-    meal_record = MealRecord(
-        user_id=user_id,
-        menu_id=menu_id,
-        meal_type=meal_type,
-        is_confirmed=True,
-        received_at=datetime.utcnow()
-    )
+    try:
+        payload, status = serving.serve_scan(student, data.get('meal_type', 'lunch'))
+    except ServeError as e:
+        db.session.rollback()
+        return jsonify({'error': e.message}), e.status
     
-    db.session.add(meal_record)
     db.session.commit()
+    return jsonify(payload), status
+
+
+@cook_bp.route('/meals/serve/batch', methods=['POST'])
+@cook_required
+def serve_batch():
+    """Apply queued serve events in one transaction.
+    
+    Each event carries a client-generated UUID ``event_id``. Events whose id
+    was already applied are answered from the serve_events table instead of
+    being applied again, so a tablet can safely resend a whole batch.
+    """
+    data = request.get_json()
+    events = data.get('events') if isinstance(data, dict) else None
+    
+    if not isinstance(events, list) or not events:
+        return jsonify({'error': 'Список событий обязателен'}), 400
+    
+    if len(events) > MAX_SERVE_BATCH:
+        return jsonify({'error': f'Не более {MAX_SERVE_BATCH} событий за запрос'}), 400
+    
+    event_ids = []
+    for event_data in events:
+        event_id = _parse_event_id(event_data)
+        event_ids.append(event_id)
+    
+    stored = {
+        record.event_id: record for record in
+        ServeEvent.query.filter(ServeEvent.event_id.in_([e for e in event_ids if e]))
+    }
+    
+    cook_id = int(get_jwt_identity())
+    results = []
+    applied = {}
+    for event_data, event_id in zip(events, event_ids):
+        if not event_id:
+            results.append({
+                'event_id': event_data.get('event_id') if isinstance(event_data, dict) else None,
+                'status': 400,
+                'error': 'Некорректный event_id'
+            })
+            continue
+        
+        if event_id in stored:
+            results.append({**stored[event_id].to_result(), 'replayed': True})
+            continue
+        
+        if event_id in applied:
+            results.append({**applied[event_id], 'replayed': True})
+            continue
+        
+        savepoint = db.session.begin_nested()
+        try:
+            payload, status = serving.apply_serve_event(event_data)
+        except ServeError as e:
+            savepoint.rollback()
+            payload, status = {'error': e.message}, e.status
+        except (ValueError, TypeError):
+            savepoint.rollback()
+            payload, status = {'error': 'Некорректные данные события'}, 400
+        except SQLAlchemyError:
+            savepoint.rollback()
+            current_app.logger.exception('Serve event %s failed', event_id)
+            # Not recorded, so the client's next retry applies it again
+            results.append({'event_id': event_id, 'status': 500, 'error': 'Ошибка обработки события'})
+            continue
+        else:
+            savepoint.commit()
+        
+        db.session.add(ServeEvent(
+            event_id=event_id,
+            cook_id=cook_id,
+            event_type=str(event_data.get('type', 'scan'))[:20],
+            status_code=status,
+            result=payload
+        ))
+        applied[event_id] = {'event_id': event_id, 'status': status, **payload}
+        results.append(applied[event_id])
+    
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request applied one of these events concurrently
+        db.session.rollback()
+        return jsonify({'error': 'События уже обрабатываются, повторите запрос'}), 409
     
     return jsonify({
-        'message': 'Питание успешно выдано',
-        'meal_record': meal_record.to_dict()
-    }), 201
+        'results': results,
+        'applied': len(applied),
+        'replayed': sum(1 for r in results if r.get('replayed'))
+    }), 200
 
 
-@cook_bp.route('/meals/search-student', methods=['GET'])
+def _parse_event_id(event_data):
+    if not isinstance(event_data, dict):
+        return None
+    try:
+        return str(uuid.UUID(str(event_data.get('event_id'))))
+    except ValueError:
+        return None
+
+
+@cook_bp.route('/meals/events', methods=['GET'])
 @cook_required
-def search_student():
+def get_meal_events():
+    """Serving-line changes after a cursor, as SSE or as a long-poll JSON answer.
+    
+    The cursor comes from Last-Event-ID, ``after`` or, when neither is given,
+    the newest event. Long-poll requests wait up to ``wait`` seconds for
+    events newer than ``latest``, the newest event id the client has.
+    """
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('after')
+    cursor = int(cursor) if cursor and str(cursor).isdigit() else kitchen_feed.current_cursor()
+    
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return Response(
+            stream_with_context(kitchen_feed.stream_events(cursor)),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+    
     try:
-        query = request.args.get('q', '')
+        wait = min(max(int(request.args.get('wait', 25)), 0), MAX_LONG_POLL_SECONDS)
+        latest = int(request.args.get('latest', 0))
+    except ValueError:
+        return jsonify({'error': 'Параметры wait и latest должны быть числами'}), 400
+    
+    events, cursor = kitchen_feed.wait_for_events(cursor, wait, latest)
+    return jsonify({'events': events, 'cursor': cursor}), 200
 
-        if not query or len(query) < 2:
-            return jsonify({'error': 'Поисковый запрос должен быть не менее 2 символов'}), 400
 
-        # SQLite's LOWER() doesn't handle Cyrillic properly, so we fetch all students
-        # and filter in Python for proper case-insensitive Unicode search
-        query_lower = query.lower()
-        
-        all_students = User.query.filter_by(role='student').all()
-        
-        # Filter students by name or email (case-insensitive, Unicode-aware)
-        # Handle potential None values for full_name and email
-        students = []
-        for s in all_students:
-            full_name = (s.full_name or '').lower()
-            email = (s.email or '').lower()
-            if query_lower in full_name or query_lower in email:
-                students.append(s)
-            if len(students) >= 10:
-                break
-        
-        results = []
-        for student in students:
-            student_data = student.to_dict()
-            
-            # Filter subscriptions in Python (student.subscriptions is a list, not a query)
-            active_subscription = None
-            for sub in student.subscriptions:
-                if sub.is_active:
-                    active_subscription = sub
-                    break
-            
-            student_data['has_subscription'] = active_subscription is not None
-            if active_subscription:
-                student_data['meals_remaining'] = active_subscription.meals_remaining
-            
-            allergies = Allergy.query.filter_by(user_id=student.id).all()
-            student_data['allergies'] = [a.allergy_type for a in allergies]
-            
-            results.append(student_data)
+@cook_bp.route('/meals/search-student', methods=['GET'])
+@cook_required
+def search_student():
+    query = request.args.get('q', '').strip()
+    
+    if not query or len(query) < 2:
+        return jsonify({'error': 'Поисковый запрос должен быть не менее 2 символов'}), 400
+    
+    student_ids = student_search.search(query, limit=10)
+    if query.isdigit() and int(query) not in student_ids:
+        student_ids = [int(query)] + student_ids[:9]
+    
+    if not student_ids:
+        return jsonify({'students': []}), 200
+    
+    students = {
+        student.id: student for student in
+        User.query.filter(User.id.in_(student_ids), User.role == 'student')
+    }
+    
+    subscriptions = {}
+    for subscription in Subscription.query.filter(
+        Subscription.user_id.in_(student_ids),
+        Subscription.is_active == True
+    ):
+        subscriptions.setdefault(subscription.user_id, subscription)
+    
+    allergies = {}
+    for user_id, allergy_type in db.session.query(
+        Allergy.user_id, Allergy.allergy_type
+    ).filter(Allergy.user_id.in_(student_ids)):
+        allergies.setdefault(user_id, []).append(allergy_type)
+    
+    results = []
+    for student_id in student_ids:
+        student = students.get(student_id)
+        if not student:
+            continue
         
-        return jsonify({'students': results}), 200
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'Ошибка поиска: {str(e)}'}), 500
+        student_data = student.to_dict()
+        active_subscription = subscriptions.get(student_id)
+        student_data['has_subscription'] = active_subscription is not None
+        if active_subscription:
+            student_data['meals_remaining'] = active_subscription.meals_remaining
+        student_data['allergies'] = allergies.get(student_id, [])
+        results.append(student_data)
+    
+    return jsonify({'students': results}), 200
 
 
 @cook_bp.route('/inventory', methods=['GET'])
@@ -268,23 +406,15 @@ def update_inventory(inventory_id):
     inventory.quantity = new_quantity
     inventory.last_updated = datetime.utcnow()
     
-    db.session.commit()
-    
-    ingredient = Ingredient.query.get(inventory.ingredient_id)
-    if ingredient and inventory.is_low_stock():
-        admins = User.query.filter_by(role='admin').all()
-        for admin in admins:
-            notification = Notification(
-                user_id=admin.id,
-                title='Низкий запас',
-                message=f'{ingredient.name} заканчивается. Текущий запас: {new_quantity} {ingredient.unit}'
-            )
-            db.session.add(notification)
-        db.session.commit()
+    with unit_of_work() as uow:
+        if inventory.is_low_stock():
+            uow.publish('low_stock', ingredient_id=inventory.ingredient_id, quantity=new_quantity)
+        uow.flush()
+        inventory_data = inventory.to_dict()
     
     return jsonify({
         'message': 'Инвентарь обновлен',
-        'inventory': inventory.to_dict(),
+        'inventory': inventory_data,
         'old_quantity': float(old_quantity),
         'new_quantity': new_quantity
     }), 200
@@ -373,7 +503,7 @@ def get_purchase_requests():
 @cook_bp.route('/purchase-requests', methods=['POST'])
 @cook_required
 def create_purchase_request():
-    user_id = get_jwt_identity()
+    user_id = int(get_jwt_identity())
     data = request.get_json()
     
     if not data:
@@ -423,24 +553,16 @@ def create_purchase_request():
         db.session.add(purchase_item)
         total_cost += estimated_cost
     
-    db.session.commit()
-    
-    admins = User.query.filter_by(role='admin').all()
-    for admin in admins:
-        notification = Notification(
-            user_id=admin.id,
-            title='Новая заявка на закупку',
-            message=f'Создана новая заявка на закупку. Предполагаемая стоимость: {total_cost:.2f} ₽'
-        )
-        db.session.add(notification)
-    
-    db.session.commit()
+    with unit_of_work() as uow:
+        uow.publish('purchase_request_created', total_cost=float(total_cost))
+        uow.flush()
+        response = {
+            'message': 'Заявка на закупку создана',
+            'purchase_request': purchase_request.to_dict(),
+            'total_cost': total_cost
+        }
     
-    return jsonify({
-        'message': 'Заявка на закупку создана',
-        'purchase_request': purchase_request.to_dict(),
-        'total_cost': total_cost
-    }), 201
+    return jsonify(response), 201
 
 
 @cook_bp.route('/purchase-requests/<int:request_id>', methods=['DELETE'])
@@ -531,48 +653,58 @@ def get_all_reviews():
 @cook_bp.route('/meals/purchases', methods=['GET'])
 @cook_required
 def get_today_purchases():
-    """Get all dish purchases for today with user details - for cook to see what was purchased"""
-    from datetime import date
+    """Get all dish purchases for today with user details - for cook to see what was purchased
     
+    With ``since`` (a purchase id from a previous answer's ``cursor``) only
+    newer purchases are listed; the counters always cover the whole day.
+    """
     today = date.today()
     meal_type = request.args.get('meal_type', None)  # Optional filter by breakfast/lunch
+    since = request.args.get('since', 0, type=int)
     
-    # Get purchases from today
-    query = DishPurchase.query.filter(
-        db.func.date(DishPurchase.purchase_date) == today
-    )
-    
+    # Range over the indexed column instead of DATE(purchase_date)
+    day_filter = [
+        DishPurchase.purchase_date >= datetime.combine(today, time.min),
+        DishPurchase.purchase_date < datetime.combine(today + timedelta(days=1), time.min)
+    ]
     if meal_type:
-        query = query.filter_by(meal_type=meal_type)
-    
-    purchases = query.order_by(DishPurchase.purchase_date.desc()).all()
+        day_filter.append(DishPurchase.meal_type == meal_type)
+    
+    total_count, used_count, last_id = db.session.query(
+        db.func.count(DishPurchase.id),
+        db.func.coalesce(db.func.sum(db.case((DishPurchase.is_used == True, 1), else_=0)), 0),
+        db.func.max(DishPurchase.id)
+    ).filter(*day_filter).one()
+    
+    purchases = DishPurchase.query.options(
+        joinedload(DishPurchase.user).selectinload(User.allergies),
+        joinedload(DishPurchase.dish),
+        joinedload(DishPurchase.menu)
+    ).filter(
+        *day_filter,
+        DishPurchase.id > since
+    ).order_by(DishPurchase.purchase_date.desc()).all()
     
     purchases_data = []
     for purchase in purchases:
         purchase_dict = purchase.to_dict()
         
-        # Add user info
-        user = User.query.get(purchase.user_id)
-        if user:
+        if purchase.user:
             purchase_dict['user'] = {
-                'id': user.id,
-                'full_name': user.full_name,
-                'email': user.email
+                'id': purchase.user.id,
+                'full_name': purchase.user.full_name,
+                'email': purchase.user.email,
+                'allergies': [a.allergy_type for a in purchase.user.allergies],
+                'allergens': allergen_codes(purchase.user.allergen_mask)
             }
-            # Add allergies
-            allergies = Allergy.query.filter_by(user_id=user.id).all()
-            purchase_dict['user']['allergies'] = [a.allergy_type for a in allergies]
-        
-        # Add dish info
-        dish = Dish.query.get(purchase.dish_id)
-        if dish:
-            purchase_dict['dish'] = dish.to_dict()
-        
-        # Add menu info
-        if purchase.menu_id:
-            menu = Menu.query.get(purchase.menu_id)
-            if menu:
-                purchase_dict['menu'] = menu.to_dict()
+        if purchase.dish:
+            purchase_dict['dish'] = purchase.dish.to_dict()
+        if purchase.user and purchase.dish:
+            purchase_dict['allergen_conflicts'] = conflicts(
+                purchase.user.allergen_mask, purchase.dish.allergen_mask
+            )
+        if purchase.menu:
+            purchase_dict['menu'] = purchase.menu.to_dict()
         
         purchases_data.append(purchase_dict)
     
@@ -584,40 +716,57 @@ def get_today_purchases():
         'purchases': purchases_data,
         'breakfast': breakfast_purchases,
         'lunch': lunch_purchases,
-        'total_count': len(purchases_data),
-        'used_count': len([p for p in purchases_data if p.get('is_used')]),
-        'pending_count': len([p for p in purchases_data if not p.get('is_used')])
+        'total_count': total_count,
+        'used_count': int(used_count),
+        'pending_count': total_count - int(used_count),
+        'cursor': max(last_id or 0, since)
     }), 200
 
 
+@cook_bp.route('/meals/allergen-matrix', methods=['GET'])
+@cook_required
+def get_allergen_matrix():
+    """Conflicts between today's menu dishes and every student who bought from it"""
+    meal_type = request.args.get('meal_type', 'lunch')
+    if meal_type not in serving.MEAL_TYPES:
+        return jsonify({'error': 'Тип питания должен быть breakfast или lunch'}), 400
+    
+    matrix = build_conflict_matrix(date.today(), meal_type)
+    if matrix is None:
+        return jsonify({'error': 'На сегодня меню недоступно'}), 404
+    
+    return jsonify(matrix), 200
+
+
 @cook_bp.route('/meals/student-purchases/<int:user_id>', methods=['GET'])
 @cook_required
 def get_student_purchases(user_id):
     """Get all dish purchases for a specific student"""
-    from datetime import date
-    
     today = date.today()
     
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
     
     # Get today's purchases for this user
-    purchases = DishPurchase.query.filter(
+    purchases = DishPurchase.query.options(
+        joinedload(DishPurchase.dish)
+    ).filter(
         DishPurchase.user_id == user_id,
-        db.func.date(DishPurchase.purchase_date) == today
+        DishPurchase.purchase_date >= datetime.combine(today, time.min),
+        DishPurchase.purchase_date < datetime.combine(today + timedelta(days=1), time.min),
+        DishPurchase.id > request.args.get('since', 0, type=int)
     ).order_by(DishPurchase.purchase_date.desc()).all()
     
     purchases_data = []
     for purchase in purchases:
         purchase_dict = purchase.to_dict()
-        dish = Dish.query.get(purchase.dish_id)
-        if dish:
-            purchase_dict['dish'] = dish.to_dict()
+        if purchase.dish:
+            purchase_dict['dish'] = purchase.dish.to_dict()
         purchases_data.append(purchase_dict)
     
     # Also get subscription info
-    subscription = user.subscriptions.filter_by(is_active=True).first()
+    subscription = Subscription.query.filter_by(user_id=user.id, is_active=True).first()
     
     return jsonify({
         'user': {
@@ -640,60 +789,11 @@ def serve_purchase():
     if not data:
         return jsonify({'error': 'Данные не предоставлены'}), 400
     
-    purchase_id = data.get('purchase_id')
-    user_id = data.get('user_id')
-    
-    if purchase_id:
-        purchase = DishPurchase.query.get(purchase_id)
-        if not purchase:
-            return jsonify({'error': 'Покупка не найдена'}), 404
-        
-        if purchase.is_used:
-            return jsonify({'error': 'Это блюдо уже было выдано'}), 409
-        
-        purchase.mark_as_used()
-        user_id = purchase.user_id
-        
-    elif user_id:
-        # Find unused purchase for this user today
-        today = date.today()
-        purchase = DishPurchase.query.filter(
-            DishPurchase.user_id == user_id,
-            DishPurchase.is_used == False,
-            db.func.date(DishPurchase.purchase_date) == today
-        ).first()
-        
-        if not purchase:
-            return jsonify({'error': 'Нет неиспользованных покупок для этого пользователя'}), 404
-        
-        purchase.mark_as_used()
-    else:
-        return jsonify({'error': 'Необходим purchase_id или user_id'}), 400
-    
-    # Create meal record
-    meal_record = MealRecord(
-        user_id=user_id,
-        menu_id=purchase.menu_id,
-        meal_type=purchase.meal_type or 'lunch',
-        is_confirmed=True,
-        received_at=datetime.utcnow()
-    )
-    
-    db.session.add(meal_record)
-    db.session.commit()
+    try:
+        payload, status = serving.serve_purchase(data.get('purchase_id'), data.get('user_id'))
+    except ServeError as e:
+        db.session.rollback()
+        return jsonify({'error': e.message}), e.status
     
-    # Notify user
-    dish = Dish.query.get(purchase.dish_id)
-    notification = Notification(
-        user_id=user_id,
-        title='Питание выдано',
-        message=f'Повар выдал вам "{dish.name if dish else "блюдо"}"'
-    )
-    db.session.add(notification)
     db.session.commit()
-    
-    return jsonify({
-        'message': 'Блюдо успешно выдано',
-        'purchase': purchase.to_dict(),
-        'meal_record': meal_record.to_dict()
-    }), 200
+    return jsonify(payload), status
@@ -1,13 +1,25 @@
 from datetime import datetime, date, timedelta
+from decimal import Decimal, InvalidOperation
 from flask import request, jsonify
 from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.orm import joinedload
 from app.api import student_bp
 from app.extensions import db
 from app.utils.decorators import student_required
+from app.utils.current_user import load_current_user, load_active_subscription
+from app.utils.http_cache import conditional_json
+from app.utils.idempotency import idempotent
+from app.services.menu import load_menu, load_menu_range, invalidate_catalog
+from app.services.serving import get_or_create_today_menu
+from app.services.unit_of_work import unit_of_work
+from app.services.wallet import wallet_history, parse_cursor, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 from app.models import (
-    User, Dish, Menu, MenuItem, Payment, Subscription,
-    MealRecord, Allergy, Review, Notification, DishPurchase
+    Dish, Menu, MenuItem, Payment, Subscription,
+    MealRecord, Allergy, Review, DishPurchase
 )
+from app.models.user import to_money
+
+MAX_MENU_RANGE_DAYS = 31
 
 
 @student_bp.route('/menu', methods=['GET'])
@@ -16,45 +28,45 @@ def get_current_menu():
     today = date.today()
     meal_type = request.args.get('meal_type', 'lunch')
     
-    menu = Menu.query.filter_by(
-        menu_date=today,
-        meal_type=meal_type,
-        is_active=True
-    ).first()
+    menu_data, dishes, etag = load_menu(today, meal_type)
     
-    if not menu:
-        return jsonify({'menu': None, 'message': 'На сегодня меню недоступно'}), 200
-    
-    menu_items = MenuItem.query.filter_by(menu_id=menu.id).all()
-    dishes = []
-    
-    for item in menu_items:
-        dish = Dish.query.get(item.dish_id)
-        if dish and dish.is_available:
-            dish_data = dish.to_dict()
-            reviews = Review.query.filter_by(dish_id=dish.id).all()
-            if reviews:
-                dish_data['average_rating'] = sum(r.rating for r in reviews) / len(reviews)
-                dish_data['reviews_count'] = len(reviews)
-            else:
-                dish_data['average_rating'] = None
-                dish_data['reviews_count'] = 0
-            dishes.append(dish_data)
-    
-    # Include items with dish data for template compatibility
-    menu_data = menu.to_dict()
-    menu_data['items'] = []
-    for item in menu_items:
-        dish = Dish.query.get(item.dish_id)
-        if dish and dish.is_available:
-            item_data = item.to_dict()
-            item_data['dish'] = dish.to_dict()
-            menu_data['items'].append(item_data)
+    if not menu_data:
+        return conditional_json(etag, lambda: {
+            'menu': None,
+            'message': 'На сегодня меню недоступно'
+        })
     
-    return jsonify({
+    return conditional_json(etag, lambda: {
         'menu': menu_data,
         'dishes': dishes
-    }), 200
+    })
+
+
+@student_bp.route('/menu/range', methods=['GET'])
+@student_required
+def get_menu_range():
+    start_str = request.args.get('start')
+    end_str = request.args.get('end')
+    meal_type = request.args.get('meal_type')
+    
+    try:
+        start = datetime.strptime(start_str, '%Y-%m-%d').date() if start_str else date.today()
+        end = datetime.strptime(end_str, '%Y-%m-%d').date() if end_str else start + timedelta(days=6)
+    except ValueError:
+        return jsonify({'error': 'Неверный формат даты. Используйте ГГГГ-ММ-ДД'}), 400
+    
+    if end < start:
+        return jsonify({'error': 'Дата окончания раньше даты начала'}), 400
+    
+    if (end - start).days >= MAX_MENU_RANGE_DAYS:
+        return jsonify({'error': f'Диапазон не может превышать {MAX_MENU_RANGE_DAYS} дней'}), 400
+    
+    if meal_type and meal_type not in ['breakfast', 'lunch']:
+        return jsonify({'error': 'Тип питания должен быть breakfast или lunch'}), 400
+    
+    payload, etag = load_menu_range(start, end, meal_type)
+    
+    return conditional_json(etag, lambda: payload)
 
 
 @student_bp.route('/menu/<string:menu_date>', methods=['GET'])
@@ -67,43 +79,25 @@ def get_menu_by_date(menu_date):
     
     meal_type = request.args.get('meal_type', 'lunch')
     
-    menu = Menu.query.filter_by(
-        menu_date=target_date,
-        meal_type=meal_type,
-        is_active=True
-    ).first()
-    
-    if not menu:
-        return jsonify({'menu': None, 'message': 'На эту дату меню недоступно'}), 200
-    
-    menu_items = MenuItem.query.filter_by(menu_id=menu.id).all()
-    dishes = []
+    menu_data, dishes, etag = load_menu(target_date, meal_type)
     
-    for item in menu_items:
-        dish = Dish.query.get(item.dish_id)
-        if dish and dish.is_available:
-            dishes.append(dish.to_dict())
-    
-    # Include items with dish data for template compatibility
-    menu_data = menu.to_dict()
-    menu_data['items'] = []
-    for item in menu_items:
-        dish = Dish.query.get(item.dish_id)
-        if dish and dish.is_available:
-            item_data = item.to_dict()
-            item_data['dish'] = dish.to_dict()
-            menu_data['items'].append(item_data)
+    if not menu_data:
+        return conditional_json(etag, lambda: {
+            'menu': None,
+            'message': 'На эту дату меню недоступно'
+        })
     
-    return jsonify({
+    return conditional_json(etag, lambda: {
         'menu': menu_data,
         'dishes': dishes
-    }), 200
+    })
 
 
 @student_bp.route('/payment', methods=['POST'])
 @student_required
+@idempotent
 def create_payment():
-    user_id = get_jwt_identity()
+    user_id = int(get_jwt_identity())
     data = request.get_json()
     
     if not data:
@@ -114,10 +108,10 @@ def create_payment():
         return jsonify({'error': 'Сумма обязательна'}), 400
     
     try:
-        amount = float(amount)
+        amount = to_money(amount)
         if amount <= 0:
             return jsonify({'error': 'Сумма должна быть положительной'}), 400
-    except ValueError:
+    except (InvalidOperation, ValueError):
         return jsonify({'error': 'Неверная сумма'}), 400
     
     payment = Payment(
@@ -128,32 +122,23 @@ def create_payment():
         transaction_id=f"TXN{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}{user_id}"
     )
     
-    db.session.add(payment)
-    db.session.commit()
+    with unit_of_work() as uow:
+        uow.add(payment)
+        uow.publish('payment_completed', user_id=user_id, amount=float(amount))
+        uow.flush()
+        response = {
+            'message': 'Оплата успешна',
+            'payment': payment.to_dict()
+        }
+        uow.remember(response, 201)
     
-    notification = Notification(
-        user_id=user_id,
-        title='Оплата успешна',
-        message=f'Ваш платеж на сумму {amount:.2f} ₽ успешно обработан.'
-    )
-    db.session.add(notification)
-    db.session.commit()
-    
-    return jsonify({
-        'message': 'Оплата успешна',
-        'payment': payment.to_dict()
-    }), 201
+    return jsonify(response), 201
 
 
 @student_bp.route('/subscription', methods=['GET'])
 @student_required
 def get_subscription():
-    user_id = get_jwt_identity()
-    
-    subscription = Subscription.query.filter_by(
-        user_id=user_id,
-        is_active=True
-    ).first()
+    subscription = load_active_subscription()
     
     if not subscription:
         return jsonify({'subscription': None}), 200
@@ -161,10 +146,23 @@ def get_subscription():
     return jsonify({'subscription': subscription.to_dict()}), 200
 
 
+def _insufficient_funds(user, amount):
+    """402 answer for a debit that found the balance short"""
+    current_balance = float(user.balance) if user.balance else 0.00
+    db.session.rollback()
+    return jsonify({
+        'error': 'Недостаточно средств на балансе',
+        'required': float(amount),
+        'current_balance': current_balance,
+        'shortage': float(amount) - current_balance
+    }), 402  # Payment Required
+
+
 @student_bp.route('/subscription', methods=['POST'])
 @student_required
+@idempotent
 def create_subscription():
-    user_id = get_jwt_identity()
+    user_id = int(get_jwt_identity())
     data = request.get_json()
     
     if not data:
@@ -174,32 +172,34 @@ def create_subscription():
     if subscription_type not in ['weekly', 'monthly']:
         return jsonify({'error': 'Тип абонемента должен быть weekly или monthly'}), 400
     
-    # Get user to check balance
-    user = User.query.get(user_id)
+    # Get user to check balance, with the subscription to extend
+    user = load_current_user(with_subscription=True)
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
     
     today = date.today()
     if subscription_type == 'weekly':
         days_to_add = 7
-        amount = 700.00
+        amount = Decimal('700.00')
         meals_to_add = 5
     else:
         days_to_add = 30
-        amount = 2500.00
+        amount = Decimal('2500.00')
         meals_to_add = 20
     
-    # Check if user has sufficient balance
-    current_balance = float(user.balance) if user.balance else 0.00
-    if current_balance < amount:
-        return jsonify({
-            'error': 'Недостаточно средств на балансе',
-            'required': amount,
-            'current_balance': current_balance,
-            'shortage': amount - current_balance
-        }), 402  # Payment Required
+    payment = Payment(
+        user_id=user_id,
+        amount=amount,
+        payment_type='subscription',
+        status='completed',
+        transaction_id=f"SUB{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}{user_id}"
+    )
+    
+    # The conditional debit is the balance check, so concurrent purchases cannot overdraw
+    if not user.deduct_balance(amount, 'subscription', description='Покупка абонемента', payment=payment):
+        return _insufficient_funds(user, amount)
     
-    existing = Subscription.query.filter_by(user_id=user_id, is_active=True).first()
+    existing = load_active_subscription()
     
     if existing:
         # Extend existing subscription
@@ -207,7 +207,6 @@ def create_subscription():
         existing.meals_remaining = existing.meals_remaining + meals_to_add
         existing.subscription_type = subscription_type
         subscription = existing
-        message = f'Абонемент продлён до {existing.end_date}. Всего обедов: {existing.meals_remaining}'
     else:
         # Create new subscription
         end_date = today + timedelta(days=days_to_add)
@@ -220,36 +219,29 @@ def create_subscription():
             meals_remaining=meals_to_add
         )
         db.session.add(subscription)
-        message = f'Ваш {subscription_type} абонемент активен до {end_date}.'
-    
-    # Deduct balance from user wallet
-    if not user.deduct_balance(amount):
-        return jsonify({'error': 'Ошибка при списании средств'}), 500
-    
-    payment = Payment(
-        user_id=user_id,
-        amount=amount,
-        payment_type='subscription',
-        status='completed',
-        transaction_id=f"SUB{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}{user_id}"
-    )
-    db.session.add(payment)
-    db.session.commit()
     
-    notification = Notification(
-        user_id=user_id,
-        title='Абонемент активирован',
-        message=f'{message} Списано с кошелька: {amount:.2f} ₽. Текущий баланс: {float(user.balance):.2f} ₽'
-    )
-    db.session.add(notification)
-    db.session.commit()
+    with unit_of_work() as uow:
+        uow.add(payment)
+        uow.publish(
+            'subscription_activated',
+            user_id=user_id,
+            subscription_type=subscription_type,
+            extended=bool(existing),
+            end_date=subscription.end_date.isoformat(),
+            meals_remaining=subscription.meals_remaining,
+            amount=float(amount),
+            balance=float(user.balance)
+        )
+        uow.flush()
+        response = {
+            'message': 'Абонемент успешно создан',
+            'subscription': subscription.to_dict(),
+            'payment': payment.to_dict(),
+            'remaining_balance': float(user.balance)
+        }
+        uow.remember(response, 201)
     
-    return jsonify({
-        'message': 'Абонемент успешно создан',
-        'subscription': subscription.to_dict(),
-        'payment': payment.to_dict(),
-        'remaining_balance': float(user.balance)
-    }), 201
+    return jsonify(response), 201
 
 
 @student_bp.route('/meal/confirm', methods=['POST'])
@@ -305,10 +297,7 @@ def confirm_meal():
             'error': f'Вы уже получили {meal_type_ru} сегодня. Разрешается только 1 {meal_type_ru} в день.'
         }), 409
     
-    subscription = Subscription.query.filter_by(
-        user_id=user_id,
-        is_active=True
-    ).first()
+    subscription = load_active_subscription()
     
     has_valid_subscription = subscription and subscription.is_valid() and subscription.meals_remaining > 0
     
@@ -473,7 +462,9 @@ def add_review():
     )
     
     db.session.add(review)
+    dish.record_rating(rating)
     db.session.commit()
+    invalidate_catalog()
     
     return jsonify({
         'message': 'Отзыв добавлен',
@@ -494,8 +485,10 @@ def delete_review(review_id):
     if not review:
         return jsonify({'error': 'Отзыв не найден'}), 404
     
+    review.dish.record_rating(review.rating, -1)
     db.session.delete(review)
     db.session.commit()
+    invalidate_catalog()
     
     return jsonify({'message': 'Отзыв удалён'}), 200
 
@@ -533,58 +526,52 @@ def get_my_meals():
 @student_bp.route('/wallet', methods=['GET'])
 @student_required
 def get_wallet():
-    """Get user's wallet balance and recent transactions"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    """Get user's wallet balance and the first page of wallet history"""
+    user = load_current_user()
     
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
     
-    # Get recent transactions (payments and purchases)
-    payments = Payment.query.filter_by(user_id=user_id).order_by(Payment.created_at.desc()).limit(10).all()
-    purchases = DishPurchase.query.filter_by(user_id=user_id).order_by(DishPurchase.purchase_date.desc()).limit(10).all()
-    
-    transactions = []
-    
-    for payment in payments:
-        transactions.append({
-            'id': f'pay_{payment.id}',
-            'type': 'topup' if payment.payment_type == 'topup' else payment.payment_type,
-            'amount': float(payment.amount),
-            'status': payment.status,
-            'date': payment.created_at.isoformat() if payment.created_at else None,
-            'description': 'Пополнение кошелька' if payment.payment_type == 'topup' else 
-                          'Покупка абонемента' if payment.payment_type == 'subscription' else 'Оплата'
-        })
-    
-    for purchase in purchases:
-        dish = Dish.query.get(purchase.dish_id)
-        transactions.append({
-            'id': f'purchase_{purchase.id}',
-            'type': 'dish_purchase',
-            'amount': -float(purchase.price_paid),
-            'status': 'completed',
-            'date': purchase.purchase_date.isoformat() if purchase.purchase_date else None,
-            'description': f'Покупка: {dish.name if dish else "Блюдо"}'
-        })
-    
-    # Sort by date descending
-    transactions.sort(key=lambda x: x['date'] if x['date'] else '', reverse=True)
+    entries, next_cursor = wallet_history(user.id)
     
     return jsonify({
         'wallet': {
             'balance': float(user.balance) if user.balance else 0.00,
+            'version': user.balance_version,
             'user_id': user.id
         },
-        'transactions': transactions[:20]  # Last 20 transactions
+        'transactions': [entry.to_dict() for entry in entries],
+        'next_cursor': next_cursor
+    }), 200
+
+
+@student_bp.route('/wallet/history', methods=['GET'])
+@student_required
+def get_wallet_history():
+    """Wallet ledger, newest first, paged by the ``before`` cursor of the previous page"""
+    user_id = int(get_jwt_identity())
+    
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        before = request.args.get('before')
+        before = parse_cursor(before) if before else None
+    except ValueError:
+        return jsonify({'error': 'Неверные параметры страницы'}), 400
+    
+    entries, next_cursor = wallet_history(user_id, limit, before)
+    
+    return jsonify({
+        'transactions': [entry.to_dict() for entry in entries],
+        'next_cursor': next_cursor
     }), 200
 
 
 @student_bp.route('/wallet/topup', methods=['POST'])
 @student_required
+@idempotent
 def topup_wallet():
     """Top up user's wallet balance"""
-    user_id = get_jwt_identity()
+    user_id = int(get_jwt_identity())
     data = request.get_json()
     
     if not data:
@@ -595,23 +582,20 @@ def topup_wallet():
         return jsonify({'error': 'Сумма обязательна'}), 400
     
     try:
-        amount = float(amount)
+        amount = to_money(amount)
         if amount <= 0:
             return jsonify({'error': 'Сумма должна быть положительной'}), 400
         if amount < 100:
             return jsonify({'error': 'Минимальная сумма пополнения 100 ₽'}), 400
         if amount > 50000:
             return jsonify({'error': 'Максимальная сумма пополнения 50000 ₽'}), 400
-    except ValueError:
+    except (InvalidOperation, ValueError):
         return jsonify({'error': 'Неверная сумма'}), 400
     
-    user = User.query.get(user_id)
+    user = load_current_user()
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
     
-    # Add balance to user
-    user.add_balance(amount)
-    
     # Create payment record for topup
     payment = Payment(
         user_id=user_id,
@@ -621,23 +605,21 @@ def topup_wallet():
         transaction_id=f"TOPUP{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}{user_id}"
     )
     
-    db.session.add(payment)
-    db.session.commit()
+    # Add balance to user
+    user.add_balance(amount, description='Пополнение кошелька', payment=payment)
     
-    # Create notification
-    notification = Notification(
-        user_id=user_id,
-        title='Кошелек пополнен',
-        message=f'Ваш кошелек успешно пополнен на {amount:.2f} ₽. Текущий баланс: {float(user.balance):.2f} ₽'
-    )
-    db.session.add(notification)
-    db.session.commit()
+    with unit_of_work() as uow:
+        uow.add(payment)
+        uow.publish('wallet_topped_up', user_id=user_id, amount=float(amount), balance=float(user.balance))
+        uow.flush()
+        response = {
+            'message': 'Кошелек успешно пополнен',
+            'payment': payment.to_dict(),
+            'new_balance': float(user.balance)
+        }
+        uow.remember(response, 201)
     
-    return jsonify({
-        'message': 'Кошелек успешно пополнен',
-        'payment': payment.to_dict(),
-        'new_balance': float(user.balance)
-    }), 201
+    return jsonify(response), 201
 
 
 # ============ DISH PURCHASE ENDPOINTS ============
@@ -650,35 +632,33 @@ def get_dish_reviews(dish_id):
     if not dish:
         return jsonify({'error': 'Блюдо не найдено'}), 404
     
-    reviews = Review.query.filter_by(dish_id=dish_id).order_by(Review.created_at.desc()).all()
+    reviews = Review.query.options(
+        joinedload(Review.user)
+    ).filter_by(dish_id=dish_id).order_by(Review.created_at.desc()).all()
     
     reviews_data = []
     for review in reviews:
         review_dict = review.to_dict()
-        user = User.query.get(review.user_id)
-        if user:
-            review_dict['user_name'] = user.full_name
+        if review.user:
+            review_dict['user_name'] = review.user.full_name
         reviews_data.append(review_dict)
     
-    # Calculate average rating
-    avg_rating = sum(r.rating for r in reviews) / len(reviews) if reviews else None
-    
     return jsonify({
         'dish': dish.to_dict(),
         'reviews': reviews_data,
-        'average_rating': avg_rating,
-        'reviews_count': len(reviews_data)
+        **dish.rating_dict()
     }), 200
 
 
 @student_bp.route('/dishes/<int:dish_id>/purchase', methods=['POST'])
 @student_required
+@idempotent
 def purchase_dish(dish_id):
     """Purchase a specific dish using wallet balance"""
-    user_id = get_jwt_identity()
+    user_id = int(get_jwt_identity())
     data = request.get_json() or {}
     
-    user = User.query.get(user_id)
+    user = load_current_user()
     if not user:
         return jsonify({'error': 'Пользователь не найден'}), 404
     
@@ -689,20 +669,10 @@ def purchase_dish(dish_id):
     if not dish.is_available:
         return jsonify({'error': 'Блюдо временно недоступно'}), 400
     
-    price = float(dish.price) if dish.price else 0
+    price = to_money(dish.price)
     if price <= 0:
         return jsonify({'error': 'Блюдо не продается'}), 400
     
-    # Check if user has sufficient balance
-    current_balance = float(user.balance) if user.balance else 0.00
-    if current_balance < price:
-        return jsonify({
-            'error': 'Недостаточно средств на балансе',
-            'required': price,
-            'current_balance': current_balance,
-            'shortage': price - current_balance
-        }), 402  # Payment Required
-    
     # Get optional menu association
     menu_id = data.get('menu_id')
     meal_type = data.get('meal_type', 'lunch')
@@ -716,10 +686,6 @@ def purchase_dish(dish_id):
     # NOTE: Allow multiple purchases of the same dish - no restriction!
     # Users can buy as many dishes as they want per day
     
-    # Deduct balance
-    if not user.deduct_balance(price):
-        return jsonify({'error': 'Ошибка при списании средств'}), 500
-    
     # Create dish purchase record
     purchase = DishPurchase(
         user_id=user_id,
@@ -730,24 +696,29 @@ def purchase_dish(dish_id):
         is_used=False
     )
     
-    db.session.add(purchase)
-    db.session.commit()
+    # Deduct balance; the conditional UPDATE doubles as the balance check
+    if not user.deduct_balance(price, description=f'Покупка: {dish.name}', dish_purchase=purchase):
+        return _insufficient_funds(user, price)
     
-    # Create notification
-    notification = Notification(
-        user_id=user_id,
-        title='Блюдо приобретено',
-        message=f'Вы приобрели "{dish.name}" за {price:.2f} ₽. Текущий баланс: {float(user.balance):.2f} ₽'
-    )
-    db.session.add(notification)
-    db.session.commit()
+    with unit_of_work() as uow:
+        uow.add(purchase)
+        uow.publish(
+            'dish_purchased',
+            user_id=user_id,
+            dish_id=dish.id,
+            price=float(price),
+            balance=float(user.balance)
+        )
+        uow.flush()
+        response = {
+            'message': 'Блюдо успешно приобретено',
+            'purchase': purchase.to_dict(),
+            'dish': dish.to_dict(),
+            'remaining_balance': float(user.balance)
+        }
+        uow.remember(response, 201)
     
-    return jsonify({
-        'message': 'Блюдо успешно приобретено',
-        'purchase': purchase.to_dict(),
-        'dish': dish.to_dict(),
-        'remaining_balance': float(user.balance)
-    }), 201
+    return jsonify(response), 201
 
 
 @student_bp.route('/purchases', methods=['GET'])
@@ -773,7 +744,7 @@ def get_my_purchases():
 @student_required
 def use_purchase(purchase_id):
     """Mark a dish purchase as used (when receiving the meal)"""
-    user_id = get_jwt_identity()
+    user_id = int(get_jwt_identity())
     
     purchase = DishPurchase.query.filter_by(id=purchase_id, user_id=user_id).first()
     if not purchase:
@@ -808,30 +779,23 @@ def use_purchase(purchase_id):
     # Create meal record
     meal_record = MealRecord(
         user_id=user_id,
-        menu_id=purchase.menu_id,
+        menu_id=purchase.menu_id or get_or_create_today_menu(meal_type).id,
         meal_type=meal_type,
         is_confirmed=True,
         received_at=datetime.utcnow()
     )
     
-    db.session.add(meal_record)
-    db.session.commit()
-    
-    # Create notification
-    dish = Dish.query.get(purchase.dish_id)
-    notification = Notification(
-        user_id=user_id,
-        title='Питание получено',
-        message=f'Вы получили "{dish.name if dish else "блюдо"}"'
-    )
-    db.session.add(notification)
-    db.session.commit()
+    with unit_of_work() as uow:
+        uow.add(meal_record)
+        uow.publish('meal_received', user_id=user_id, dish_id=purchase.dish_id)
+        uow.flush()
+        response = {
+            'message': 'Блюдо отмечено как полученное',
+            'purchase': purchase.to_dict(),
+            'meal_record': meal_record.to_dict()
+        }
     
-    return jsonify({
-        'message': 'Блюдо отмечено как полученное',
-        'purchase': purchase.to_dict(),
-        'meal_record': meal_record.to_dict()
-    }), 200
+    return jsonify(response), 200
 
 
 @student_bp.route('/meals/today-status', methods=['GET'])
@@ -856,10 +820,7 @@ def get_today_meal_status():
     lunch_claimed = any(m.meal_type == 'lunch' for m in today_meals)
     
     # Get subscription status
-    subscription = Subscription.query.filter_by(
-        user_id=user_id,
-        is_active=True
-    ).first()
+    subscription = load_active_subscription()
     
     has_subscription = subscription and subscription.is_valid() and subscription.meals_remaining > 0
     meals_remaining = subscription.meals_remaining if has_subscription else 0
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionedCache:
+    """Thread-safe in-process LRU cache with TTL expiry and a catalog version.
+
+    Keys are tuples whose first element is a namespace (``'menu'``,
+    ``'dishes'``). Entries built from dish data include ``catalog_version``
+    in their key, so ``bump_catalog_version()`` orphans all of them at once;
+    orphaned entries age out through LRU/TTL eviction.
+
+    A value is stored only if no invalidation happened while it was being
+    built, so a fill that read the old data cannot outlive the invalidation.
+
+    The cache is per worker process: explicit invalidation only reaches the
+    worker that handled the write, and ``CACHE_TTL`` bounds how long other
+    workers may serve the previous version.
+    """
+
+    def __init__(self, max_entries=512, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = True
+        self.catalog_version = 0
+        # Bumped by every invalidation; fills started before one are not stored
+        self._generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('CACHE_MAX_ENTRIES', self.max_entries)
+        self.ttl = app.config.get('CACHE_TTL', self.ttl)
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        app.extensions['versioned_cache'] = self
+
+    def _count(self, namespace, counter, amount=1):
+        stats = self._stats.setdefault(namespace, {
+            'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0
+        })
+        stats[counter] += amount
+
+    def get_or_set(self, key, factory):
+        """Return the cached value for key, building it with factory() on a miss"""
+        if not self.enabled:
+            return factory()
+
+        namespace = key[0]
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._count(namespace, 'hits')
+                return entry[1]
+            self._count(namespace, 'misses')
+            generation = self._generation
+
+        value = factory()
+
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._count(evicted_key[0], 'evictions')
+
+        return value
+
+    def invalidate(self, *prefix):
+        """Drop every entry whose key starts with prefix"""
+        size = len(prefix)
+        with self._lock:
+            self._generation += 1
+            stale = [key for key in self._entries if key[:size] == prefix]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._count(prefix[0], 'invalidations', len(stale))
+
+    def bump_catalog_version(self):
+        with self._lock:
+            self._generation += 1
+            self.catalog_version += 1
+            return self.catalog_version
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._stats.clear()
+
+    def get_stats(self):
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._stats.items()}
+            for counters in namespaces.values():
+                lookups = counters['hits'] + counters['misses']
+                counters['hit_ratio'] = round(counters['hits'] / lookups, 3) if lookups else None
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'catalog_version': self.catalog_version,
+                'namespaces': namespaces
+            }
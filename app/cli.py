@@ -0,0 +1,286 @@
+import threading
+import time
+
+import click
+
+
+def register_commands(app):
+    @app.cli.command('rebuild-ratings')
+    def rebuild_ratings_command():
+        """Recompute dish rating aggregates from reviews."""
+        from app.services.ratings import rebuild_dish_ratings
+        
+        updated = rebuild_dish_ratings()
+        click.echo(f'Rating aggregates rebuilt for {updated} dishes')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Backfill casefolded name/email search columns for all users."""
+        from app.services.search import rebuild_search_columns
+        
+        updated = rebuild_search_columns()
+        click.echo(f'Search columns rebuilt for {updated} users')
+
+    @app.cli.command('rebuild-allergens')
+    @click.option('--reclassify-ingredients', is_flag=True, help='Re-derive ingredient allergens from their names')
+    def rebuild_allergens_command(reclassify_ingredients):
+        """Recompute allergen masks of allergies, students and dishes."""
+        from app.services.allergens import rebuild_allergen_masks
+        
+        counts = rebuild_allergen_masks(reclassify_ingredients)
+        click.echo(', '.join(f'{table}: {count}' for table, count in counts.items()))
+
+    @app.cli.command('prune-kitchen-events')
+    @click.option('--hours', type=int, help='Keep events newer than this (KITCHEN_EVENTS_RETENTION_HOURS)')
+    def prune_kitchen_events_command(hours):
+        """Delete old serving-line feed events."""
+        from app.services.kitchen_feed import prune_events
+        
+        deleted = prune_events(hours)
+        click.echo(f'Deleted {deleted} kitchen events')
+
+    @app.cli.command('prune-idempotency-keys')
+    @click.option('--hours', type=int, help='Keep keys newer than this (IDEMPOTENCY_KEY_TTL_HOURS)')
+    def prune_idempotency_keys_command(hours):
+        """Delete stored idempotent responses past their TTL."""
+        from app.utils.idempotency import prune_idempotency_keys
+        
+        deleted = prune_idempotency_keys(hours)
+        click.echo(f'Deleted {deleted} idempotency keys')
+
+    @app.cli.command('backfill-wallet-ledger')
+    @click.option('--batch-size', default=500, show_default=True, help='Users per transaction')
+    def backfill_wallet_ledger_command(batch_size):
+        """Post wallet ledger entries for payments and purchases made before the ledger."""
+        from app.services.wallet import backfill_ledger
+        
+        counts = backfill_ledger(batch_size)
+        click.echo(f"Posted {counts['entries']} ledger entries for {counts['users']} users")
+
+    @app.cli.command('prune-notifications')
+    @click.option('--batch-size', default=1000, show_default=True, help='Rows per transaction')
+    @click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches')
+    @click.option('--skip-digests', is_flag=True, help='Only delete expired notifications')
+    def prune_notifications_command(batch_size, pause, skip_digests):
+        """Fold finished days into digests and delete notifications past their retention."""
+        from app.services.notification_retention import compact_digests, purge_expired
+        
+        if not skip_digests:
+            folded = compact_digests(batch_size=max(batch_size // 10, 1), pause=pause)
+            click.echo(f'Folded {folded} notifications into daily digests')
+        deleted = purge_expired(batch_size, pause)
+        click.echo(f'Deleted {deleted} expired notifications')
+
+    @app.cli.command('reconcile-notification-counters')
+    @click.option('--batch-size', default=1000, show_default=True, help='Users per transaction')
+    def reconcile_notification_counters_command(batch_size):
+        """Recount unread notifications for users whose stored counter drifted."""
+        from app.services.notifications import reconcile_unread_counts
+        
+        fixed = reconcile_unread_counts(batch_size)
+        click.echo(f'Corrected unread counters of {fixed} users')
+
+    @app.cli.command('outbox-worker')
+    @click.option('--threads', type=int, help='Delivery threads (OUTBOX_WORKER_THREADS)')
+    @click.option('--once', is_flag=True, help='Deliver what is pending and exit')
+    def outbox_worker_command(threads, once):
+        """Deliver notification outbox events until interrupted."""
+        from app.services.outbox import outbox_worker
+        
+        if once:
+            total = 0
+            while True:
+                handled = outbox_worker.run_once()
+                if not handled:
+                    break
+                total += handled
+            click.echo(f'Handled {total} outbox events')
+            return
+        
+        outbox_worker.start(threads)
+        click.echo(f"Outbox worker running with {threads or app.config['OUTBOX_WORKER_THREADS']} threads")
+        try:
+            outbox_worker.join()
+        except KeyboardInterrupt:
+            outbox_worker.stop()
+        stats = outbox_worker.stats()
+        click.echo(f"Delivered {stats['delivered']} events, {stats['failed']} failed")
+
+    @app.cli.command('bench-login')
+    @click.option('--email', default='student@school.com', show_default=True)
+    @click.option('--password', default='student123', show_default=True)
+    @click.option('--threads', default=8, show_default=True, help='Concurrent clients')
+    @click.option('--seconds', default=10.0, show_default=True)
+    def bench_login_command(email, password, threads, seconds):
+        """Measure POST /api/auth/login throughput of a single worker."""
+        counts = [0] * threads
+        failures = [0] * threads
+        deadline = time.monotonic() + seconds
+        
+        def run(slot):
+            client = app.test_client(use_cookies=False)
+            while time.monotonic() < deadline:
+                response = client.post('/api/auth/login', json={
+                    'email': email,
+                    'password': password
+                })
+                if response.status_code == 200:
+                    counts[slot] += 1
+                else:
+                    failures[slot] += 1
+        
+        started = time.monotonic()
+        workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+        
+        click.echo(
+            f'bcrypt rounds={app.config["BCRYPT_ROUNDS"]} '
+            f'hash workers={app.config["PASSWORD_HASH_WORKERS"]} clients={threads}'
+        )
+        click.echo(
+            f'{sum(counts)} logins, {sum(failures)} failed in {elapsed:.1f}s: '
+            f'{sum(counts) / elapsed:.1f} logins/sec per worker'
+        )
+
+    @app.cli.command('stress-wallet')
+    @click.option('--students', default=20, show_default=True)
+    @click.option('--requests', 'total', default=2000, show_default=True, help='Wallet requests in total')
+    @click.option('--threads', default=32, show_default=True, help='Concurrent clients')
+    @click.option('--balance', default='1000.00', show_default=True, help='Starting balance per student')
+    @click.option('--price', default='37.35', show_default=True, help='Price of the test dish')
+    @click.option('--keep', is_flag=True, help='Keep the test students and dish afterwards')
+    def stress_wallet_command(students, total, threads, balance, price, keep):
+        """Fire parallel purchases and top-ups, then check every balance adds up.
+        
+        Run it against a file-backed SQLite or a MySQL database; one in ten
+        requests is a 100 ₽ top-up, the rest buy a test dish. Exits with
+        status 1 if any balance differs from its payments and purchases or
+        from the last balance in its wallet ledger.
+        """
+        from decimal import Decimal
+        from app.extensions import db
+        from app.models import User, Dish, Payment, DishPurchase, WalletEntry
+        from app.models.user import to_money
+        from app.services.tokens import issue_access_token
+        
+        if db.engine.url.get_backend_name() == 'sqlite' and db.engine.url.database in (None, '', ':memory:'):
+            raise click.UsageError('An in-memory database cannot be shared by threads, use a file or MySQL')
+        
+        db.create_all()
+        balance, price = to_money(balance), to_money(price)
+        run_id = f'{time.time_ns():x}'
+        dish = Dish(name=f'Stress test {run_id}', price=price, category='Тест', is_available=True)
+        db.session.add(dish)
+        users = [
+            User(
+                email=f'stress-{run_id}-{i}@stress.local',
+                full_name=f'Stress {i}',
+                password_hash='!',
+                role='student',
+                balance=balance
+            )
+            for i in range(students)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        dish_id = dish.id
+        tokens = [(user.id, issue_access_token(user)) for user in users]
+        
+        statuses = {}
+        counter = iter(range(total))
+        lock = threading.Lock()
+        
+        def run():
+            client = app.test_client(use_cookies=False)
+            while True:
+                with lock:
+                    job = next(counter, None)
+                if job is None:
+                    return
+                _, token = tokens[job % students]
+                headers = {'Authorization': f'Bearer {token}'}
+                if job // students % 10 == 9:
+                    response = client.post('/api/wallet/topup', json={'amount': 100}, headers=headers)
+                else:
+                    response = client.post(f'/api/dishes/{dish_id}/purchase', json={}, headers=headers)
+                with lock:
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        
+        started = time.monotonic()
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+        
+        db.session.expire_all()
+        mismatches = 0
+        for user_id, _ in tokens:
+            user = db.session.get(User, user_id)
+            credited = db.session.query(
+                db.func.coalesce(db.func.sum(Payment.amount), 0), db.func.count(Payment.id)
+            ).filter(Payment.user_id == user_id, Payment.payment_type == 'topup').one()
+            spent = db.session.query(
+                db.func.coalesce(db.func.sum(DishPurchase.price_paid), 0), db.func.count(DishPurchase.id)
+            ).filter(DishPurchase.user_id == user_id).one()
+            expected = balance + to_money(credited[0]) - to_money(spent[0])
+            writes = credited[1] + spent[1]
+            ledger = WalletEntry.query.filter_by(user_id=user_id).order_by(
+                WalletEntry.created_at.desc(), WalletEntry.id.desc()
+            ).all()
+            ledger_balance = ledger[0].balance_after if ledger else balance
+            if (to_money(user.balance) != expected or user.balance_version != writes
+                    or user.balance < Decimal('0') or len(ledger) != writes
+                    or to_money(ledger_balance) != expected):
+                mismatches += 1
+                click.echo(
+                    f'user {user_id}: balance {user.balance}, expected {expected}; '
+                    f'version {user.balance_version}, expected {writes}; '
+                    f'ledger {len(ledger)} entries ending at {ledger_balance}',
+                    err=True
+                )
+        
+        click.echo(f'{total} requests from {threads} clients in {elapsed:.1f}s ({total / elapsed:.0f}/sec)')
+        click.echo('status codes: ' + ', '.join(f'{code}: {count}' for code, count in sorted(statuses.items())))
+        click.echo(f'{students - mismatches}/{students} balances consistent')
+        
+        if not keep:
+            for user in User.query.filter(User.email.like(f'stress-{run_id}-%')):
+                db.session.delete(user)
+            db.session.delete(db.session.get(Dish, dish_id))
+            db.session.commit()
+        
+        if mismatches:
+            raise SystemExit(1)
+
+    @app.cli.command('import-roster')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+                  help='Defaults to the file extension')
+    @click.option('--chunk-size', type=int, help='Rows per transaction')
+    @click.option('--workers', type=int, help='bcrypt processes')
+    def import_roster_command(path, fmt, chunk_size, workers):
+        """Bulk-import students from a CSV or JSONL roster file."""
+        from app.services.roster import detect_roster_format, import_roster
+        
+        fmt = fmt or detect_roster_format(filename=path)
+        if not fmt:
+            raise click.UsageError('Cannot detect the roster format, pass --format')
+        
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = import_roster(stream, fmt, chunk_size=chunk_size, workers=workers)
+        
+        for error in report['errors']:
+            click.echo(f'line {error["line"]}: {error["email"] or "-"}: {error["error"]}', err=True)
+        if report['errors_truncated']:
+            click.echo(f'... {report["failed"] - len(report["errors"])} more errors', err=True)
+        
+        click.echo(
+            f'{report["rows"]} rows, {report["created"]} created, {report["failed"]} failed '
+            f'in {report["elapsed_seconds"]}s ({report["rows_per_second"]} rows/sec)'
+        )
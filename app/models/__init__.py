@@ -6,7 +6,12 @@ from app.models.inventory import Inventory
 from app.models.meal_record import MealRecord
 from app.models.review import Review
 from app.models.purchase_request import PurchaseRequest, PurchaseItem
-from app.models.notification import Notification
+from app.models.notification import Notification, Broadcast, BroadcastRead
+from app.models.serve_event import ServeEvent
+from app.models.kitchen_event import KitchenEvent
+from app.models.wallet import WalletEntry
+from app.models.idempotency_key import IdempotencyKey
+from app.models.outbox_event import OutboxEvent
 
 __all__ = [
     'User', 'Allergy',
@@ -17,5 +22,10 @@ __all__ = [
     'MealRecord',
     'Review',
     'PurchaseRequest', 'PurchaseItem',
-    'Notification'
+    'Notification', 'Broadcast', 'BroadcastRead',
+    'ServeEvent',
+    'KitchenEvent',
+    'WalletEntry',
+    'IdempotencyKey',
+    'OutboxEvent'
 ]
@@ -0,0 +1,77 @@
+"""Fixed allergen taxonomy; each allergen owns one bit of an integer mask.
+
+Bits are stored in the database, so new allergens may only be appended.
+"""
+import re
+
+from app.models.user import normalize_search_text
+
+# (code, label, word prefixes that name the allergen in free text)
+ALLERGENS = (
+    ('milk', 'Молоко и молочные продукты', (
+        'молок', 'молоч', 'лактоз', 'сыр', 'творог', 'сливк', 'сливочн',
+        'сметан', 'кефир', 'йогурт', 'ряженк'
+    )),
+    ('eggs', 'Яйца', ('яйц', 'яйк', 'яичн', 'омлет')),
+    ('gluten', 'Глютен', (
+        'глютен', 'пшени', 'мук', 'хлеб', 'макарон', 'овс', 'ячмен',
+        'ржан', 'манн', 'мюсли'
+    )),
+    ('fish', 'Рыба', ('рыб', 'лосос', 'треск', 'тунец', 'минта', 'сельд', 'горбуш')),
+    ('shellfish', 'Морепродукты', ('морепродукт', 'креветк', 'краб', 'кальмар', 'мидии')),
+    ('nuts', 'Орехи', ('орех', 'миндал', 'фундук', 'кешью', 'фисташ')),
+    ('peanuts', 'Арахис', ('арахис',)),
+    ('soy', 'Соя', ('соя', 'сои', 'соев')),
+    ('sesame', 'Кунжут', ('кунжут',)),
+    ('celery', 'Сельдерей', ('сельдере',)),
+    ('mustard', 'Горчица', ('горчиц',)),
+    ('citrus', 'Цитрусовые', ('цитрус', 'апельсин', 'лимон', 'мандарин', 'грейпфрут')),
+    ('honey', 'Мёд', ('мед', 'меда', 'медом', 'медов')),
+)
+
+ALLERGEN_BITS = {code: 1 << index for index, (code, _, _) in enumerate(ALLERGENS)}
+ALLERGEN_LABELS = {code: label for code, label, _ in ALLERGENS}
+
+# Whole words only where a prefix would catch unrelated words ("медленно")
+_EXACT_WORDS = {'мед', 'меда', 'медом'}
+
+
+def _match_length(word, code, prefixes):
+    """Length of the longest stem of an allergen that names word, 0 if none does"""
+    best = len(code) if word == code else 0
+    for prefix in prefixes:
+        if word == prefix if prefix in _EXACT_WORDS else word.startswith(prefix):
+            best = max(best, len(prefix))
+    return best
+
+
+def allergen_mask(text):
+    """Return the mask of every allergen named in free text or by code.
+    
+    A word counts for the allergen with the longest matching stem only, so
+    "сельдерей" is celery and not also fish by way of "сельд".
+    """
+    mask = 0
+    for word in re.findall(r'\w+', normalize_search_text(text)):
+        matches = [(_match_length(word, code, prefixes), code) for code, _, prefixes in ALLERGENS]
+        longest = max(length for length, _ in matches)
+        if longest:
+            for length, code in matches:
+                if length == longest:
+                    mask |= ALLERGEN_BITS[code]
+    return mask
+
+
+def mask_from_codes(codes):
+    """Return the mask for a list of allergen codes; None if any code is unknown"""
+    mask = 0
+    for code in codes:
+        if code not in ALLERGEN_BITS:
+            return None
+        mask |= ALLERGEN_BITS[code]
+    return mask
+
+
+def allergen_codes(mask):
+    """Return the allergen codes set in mask, in taxonomy order"""
+    return [code for code, _, _ in ALLERGENS if mask and mask & ALLERGEN_BITS[code]]
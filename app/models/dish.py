@@ -1,4 +1,7 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import validates
 from app.extensions import db
+from app.models.allergen import allergen_mask, allergen_codes
 
 
 class Dish(db.Model):
@@ -13,6 +16,17 @@ class Dish(db.Model):
     is_available = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # OR of the ingredient masks, maintained by app.services.allergens
+    allergen_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     menu_items = db.relationship('MenuItem', backref='dish', lazy=True, cascade='all, delete-orphan')
     dish_ingredients = db.relationship('DishIngredient', backref='dish', lazy=True, cascade='all, delete-orphan')
     reviews = db.relationship('Review', backref='dish', lazy=True, cascade='all, delete-orphan')
@@ -30,6 +44,33 @@ class Dish(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
     
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 1)
+    
+    def rating_dict(self):
+        return {
+            'average_rating': self.average_rating,
+            'reviews_count': self.rating_count or 0,
+            'rating_histogram': {
+                str(star): getattr(self, f'rating_{star}') or 0
+                for star in range(1, 6)
+            }
+        }
+    
+    def record_rating(self, rating, delta=1):
+        """Apply a review add (delta=1) or removal (delta=-1) to the aggregates.
+
+        Emitted as ``SET col = col + :delta`` on flush so concurrent reviews
+        don't overwrite each other's counts.
+        """
+        star_column = f'rating_{rating}'
+        self.rating_count = Dish.rating_count + delta
+        self.rating_sum = Dish.rating_sum + delta * rating
+        setattr(self, star_column, getattr(Dish, star_column) + delta)
+    
     def __repr__(self):
         return f'<Dish {self.name}>'
 
@@ -41,18 +82,28 @@ class Ingredient(db.Model):
     name = db.Column(db.String(100), nullable=False, unique=True)
     unit = db.Column(db.String(20), nullable=False)
     min_stock_level = db.Column(db.Numeric(10, 2), default=10.0)
+    allergen_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     
     dish_ingredients = db.relationship('DishIngredient', backref='ingredient', lazy=True, cascade='all, delete-orphan')
     inventory = db.relationship('Inventory', backref='ingredient', lazy=True, uselist=False, cascade='all, delete-orphan')
     purchase_items = db.relationship('PurchaseItem', backref='ingredient', lazy=True, cascade='all, delete-orphan')
     
+    @validates('name')
+    def _classify_name(self, key, value):
+        # Only a new ingredient is guessed from its name, and explicitly assigned
+        # allergens win; a rename must not bring back allergens an admin cleared
+        if not inspect(self).has_identity and not self.allergen_mask:
+            self.allergen_mask = allergen_mask(value)
+        return value
+    
     def to_dict(self):
         return {
             'id': self.id,
             'name': self.name,
             'unit': self.unit,
             'min_stock_level': float(self.min_stock_level) if self.min_stock_level else 0,
+            'allergens': allergen_codes(self.allergen_mask),
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
     
@@ -0,0 +1,23 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class IdempotencyKey(db.Model):
+    """Stored answer of a money-moving request, replayed for a repeated Idempotency-Key"""
+    __tablename__ = 'idempotency_keys'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    # SHA-1 of method, path and body; a reused key must come with the same request
+    fingerprint = db.Column(db.String(40), nullable=False)
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+    )
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.user_id}:{self.key} ({self.status_code})>'
@@ -0,0 +1,27 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class KitchenEvent(db.Model):
+    """Append-only log of serving-line changes; the id is the feed cursor"""
+    __tablename__ = 'kitchen_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(30), nullable=False)
+    meal_type = db.Column(db.String(20))
+    menu_id = db.Column(db.Integer)
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.event_type,
+            'meal_type': self.meal_type,
+            'menu_id': self.menu_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            **self.payload
+        }
+    
+    def __repr__(self):
+        return f'<KitchenEvent {self.id} {self.event_type}>'
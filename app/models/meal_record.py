@@ -12,7 +12,9 @@ class MealRecord(db.Model):
     meal_type = db.Column(db.String(20), nullable=False)
     is_confirmed = db.Column(db.Boolean, default=False)
     
-
+    __table_args__ = (
+        db.Index('ix_meal_records_user_type_received', 'user_id', 'meal_type', 'received_at'),
+    )
     
     def to_dict(self):
         return {
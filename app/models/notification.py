@@ -2,6 +2,15 @@ from datetime import datetime, timezone
 from app.extensions import db
 
 
+def utc_isoformat(value):
+    """ISO string with an explicit UTC offset; naive datetimes are taken as UTC"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
 class Notification(db.Model):
     __tablename__ = 'notifications'
     
@@ -11,25 +20,28 @@ class Notification(db.Model):
     message = db.Column(db.Text, nullable=False)
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Per-user position, taken from users.notification_seq when the row is inserted
+    seq = db.Column(db.Integer)
+    # Outbox event type the row was rendered from, 'manual', or '<type>_digest'; picks the retention
+    category = db.Column(db.String(40))
+    
+    __table_args__ = (
+        db.Index('ix_notifications_user_seq', 'user_id', 'seq'),
+        db.Index('ix_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notifications_category_created', 'category', 'created_at'),
+    )
     
     def to_dict(self):
-        # Ensure created_at is timezone-aware and return as ISO format with 'Z' suffix
-        created_at_str = None
-        if self.created_at:
-            # If datetime is naive, assume UTC
-            if self.created_at.tzinfo is None:
-                aware_dt = self.created_at.replace(tzinfo=timezone.utc)
-            else:
-                aware_dt = self.created_at
-            created_at_str = aware_dt.isoformat()
-        
         return {
             'id': self.id,
+            'kind': 'personal',
+            'seq': self.seq,
+            'category': self.category,
             'user_id': self.user_id,
             'title': self.title,
             'message': self.message,
             'is_read': self.is_read,
-            'created_at': created_at_str
+            'created_at': utc_isoformat(self.created_at)
         }
     
     def mark_as_read(self):
@@ -37,3 +49,48 @@ class Notification(db.Model):
     
     def __repr__(self):
         return f'<Notification {self.id} - {self.title}>'
+
+
+class Broadcast(db.Model):
+    """One announcement for every user of a role (or everyone when role is NULL).
+    
+    Read state lives on the reader: users.broadcast_read_id is a watermark
+    below which every broadcast counts as read, and BroadcastRead rows mark
+    single broadcasts above it.
+    """
+    __tablename__ = 'broadcasts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    role = db.Column(db.String(20), nullable=True)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_broadcasts_role_created', 'role', 'created_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': 'broadcast',
+            'role': self.role,
+            'title': self.title,
+            'message': self.message,
+            'created_at': utc_isoformat(self.created_at)
+        }
+    
+    def __repr__(self):
+        return f'<Broadcast {self.id} ({self.role or "all"}) - {self.title}>'
+
+
+class BroadcastRead(db.Model):
+    """A broadcast read on its own, above the reader's watermark"""
+    __tablename__ = 'broadcast_reads'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('broadcasts.id', ondelete='CASCADE'), primary_key=True)
+    
+    def __repr__(self):
+        return f'<BroadcastRead {self.user_id}:{self.broadcast_id}>'
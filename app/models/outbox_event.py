@@ -0,0 +1,24 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class OutboxEvent(db.Model):
+    """Side effect recorded in the business transaction, expanded later by the outbox worker"""
+    __tablename__ = 'outbox_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Lease taken by a worker; a lease older than OUTBOX_CLAIM_TIMEOUT may be taken over
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_error = db.Column(db.String(255))
+    
+    __table_args__ = (
+        db.Index('ix_outbox_events_pending', 'attempts', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<OutboxEvent {self.id} {self.event_type}>'
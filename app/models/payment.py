@@ -68,10 +68,14 @@ class DishPurchase(db.Model):
     dish_id = db.Column(db.Integer, db.ForeignKey('dishes.id'), nullable=False)
     menu_id = db.Column(db.Integer, db.ForeignKey('menus.id'), nullable=True)
     price_paid = db.Column(db.Numeric(10, 2), nullable=False)
-    purchase_date = db.Column(db.DateTime, default=datetime.utcnow)
+    purchase_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     is_used = db.Column(db.Boolean, default=False)  # Whether the meal was received
     meal_type = db.Column(db.String(20), nullable=True)  # 'breakfast' or 'lunch'
     
+    __table_args__ = (
+        db.Index('ix_dish_purchases_user_date', 'user_id', 'purchase_date'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
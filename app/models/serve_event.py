@@ -0,0 +1,25 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class ServeEvent(db.Model):
+    """Outcome of a client-generated serve event, kept so replays are not re-applied"""
+    __tablename__ = 'serve_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(36), unique=True, nullable=False, index=True)
+    cook_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    event_type = db.Column(db.String(20), nullable=False)
+    status_code = db.Column(db.Integer, nullable=False)
+    result = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def to_result(self):
+        return {
+            'event_id': self.event_id,
+            'status': self.status_code,
+            **self.result
+        }
+    
+    def __repr__(self):
+        return f'<ServeEvent {self.event_id} ({self.status_code})>'
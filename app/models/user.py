@@ -1,6 +1,22 @@
+import unicodedata
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
 from app.extensions import db
-import bcrypt
+from app.models.wallet import WalletEntry
+
+
+def normalize_search_text(value):
+    """NFKC-normalize and casefold text for search; ё is folded into е"""
+    if not value:
+        return ''
+    return unicodedata.normalize('NFKC', value).casefold().replace('ё', 'е').strip()
+
+
+def to_money(value):
+    """Exact two-place Decimal for a wallet amount (str/float/int/Decimal)"""
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
 
 class User(db.Model):
@@ -14,6 +30,24 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     balance = db.Column(db.Numeric(10, 2), default=0.00)
+    # Bumped by every wallet mutation; lets readers detect a concurrent change
+    balance_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    
+    # Casefolded copies of full_name/email; SQLite LOWER() does not fold Cyrillic
+    search_name = db.Column(db.String(100), index=True)
+    search_email = db.Column(db.String(120), index=True)
+    
+    # OR of the student's Allergy masks, maintained by app.services.allergens
+    allergen_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Every broadcast with an id up to this one counts as read
+    broadcast_read_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Last sequence number given to one of the user's personal notifications
+    notification_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Unread personal notifications, kept in step by app.services.notifications
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     payments = db.relationship('Payment', backref='user', lazy=True, cascade='all, delete-orphan')
     dish_purchases = db.relationship('DishPurchase', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -22,6 +56,8 @@ class User(db.Model):
     reviews = db.relationship('Review', backref='user', lazy=True, cascade='all, delete-orphan')
     allergies = db.relationship('Allergy', backref='user', lazy=True, cascade='all, delete-orphan')
     notifications = db.relationship('Notification', backref='user', lazy=True, cascade='all, delete-orphan')
+    wallet_entries = db.relationship('WalletEntry', backref='user', lazy=True, cascade='all, delete-orphan')
+    broadcast_reads = db.relationship('BroadcastRead', lazy=True, cascade='all, delete-orphan')
     created_purchase_requests = db.relationship(
         'PurchaseRequest',
         foreign_keys='PurchaseRequest.created_by',
@@ -35,12 +71,15 @@ class User(db.Model):
         lazy=True
     )
     
-    def set_password(self, password):
-        salt = bcrypt.gensalt()
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    @validates('full_name')
+    def _update_search_name(self, key, value):
+        self.search_name = normalize_search_text(value)
+        return value
     
-    def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+    @validates('email')
+    def _update_search_email(self, key, value):
+        self.search_email = normalize_search_text(value)
+        return value
     
     def has_role(self, role):
         return self.role == role
@@ -56,18 +95,49 @@ class User(db.Model):
             'balance': float(self.balance) if self.balance else 0.00
         }
     
-    def add_balance(self, amount):
-        """Add amount to user's balance"""
-        current = float(self.balance) if self.balance else 0.00
-        self.balance = current + amount
+    def _apply_balance(self, delta, *conditions, entry_type, description=None, payment=None, dish_purchase=None):
+        """Change the balance with one conditional UPDATE and post it to the ledger.
+        
+        Returns the pending WalletEntry, or None if no row matched. The
+        arithmetic happens in SQL, so concurrent wallet writes never
+        overwrite each other. The row stays locked until the caller commits,
+        which keeps the re-read balance, and so ``balance_after``, exact.
+        """
+        result = db.session.execute(
+            db.update(User).where(User.id == self.id, *conditions).values(
+                # ROUND keeps SQLite, which stores NUMERIC as REAL, from drifting
+                balance=db.func.round(db.func.coalesce(User.balance, 0) + delta, 2),
+                balance_version=User.balance_version + 1
+            ).execution_options(synchronize_session=False)
+        )
+        balance, version = db.session.execute(
+            db.select(User.balance, User.balance_version).where(User.id == self.id)
+        ).one()
+        set_committed_value(self, 'balance', balance)
+        set_committed_value(self, 'balance_version', version)
+        if result.rowcount != 1:
+            return None
+        
+        entry = WalletEntry(
+            user_id=self.id,
+            amount=delta,
+            balance_after=balance,
+            entry_type=entry_type,
+            description=description,
+            payment=payment,
+            dish_purchase=dish_purchase
+        )
+        db.session.add(entry)
+        return entry
     
-    def deduct_balance(self, amount):
-        """Deduct amount from user's balance if sufficient"""
-        current = float(self.balance) if self.balance else 0.00
-        if current < amount:
-            return False
-        self.balance = current - amount
-        return True
+    def add_balance(self, amount, entry_type='topup', **entry):
+        """Add amount to user's balance; returns the ledger entry"""
+        return self._apply_balance(to_money(amount), entry_type=entry_type, **entry)
+    
+    def deduct_balance(self, amount, entry_type='dish_purchase', **entry):
+        """Deduct amount from user's balance if sufficient; returns the ledger entry or None"""
+        amount = to_money(amount)
+        return self._apply_balance(-amount, User.balance >= amount, entry_type=entry_type, **entry)
     
     def __repr__(self):
         return f'<User {self.email} ({self.role})>'
@@ -79,14 +149,23 @@ class Allergy(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     allergy_type = db.Column(db.String(100), nullable=False)
+    allergen_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @validates('allergy_type')
+    def _update_allergen_mask(self, key, value):
+        from app.models.allergen import allergen_mask
+        self.allergen_mask = allergen_mask(value)
+        return value
+    
     def to_dict(self):
+        from app.models.allergen import allergen_codes
         return {
             'id': self.id,
             'user_id': self.user_id,
             'allergy_type': self.allergy_type,
+            'allergens': allergen_codes(self.allergen_mask),
             'notes': self.notes,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
@@ -0,0 +1,50 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class WalletEntry(db.Model):
+    """Append-only wallet ledger; one row per balance change.
+    
+    ``amount`` is signed (credits positive, debits negative) and
+    ``balance_after`` is the balance the change left behind, so a page of
+    history never needs the rows before it.
+    """
+    __tablename__ = 'wallet_entries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    balance_after = db.Column(db.Numeric(10, 2), nullable=False)
+    entry_type = db.Column(db.String(20), nullable=False)  # 'opening', 'topup', 'subscription', 'dish_purchase'
+    description = db.Column(db.String(255))
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id'), unique=True)
+    dish_purchase_id = db.Column(db.Integer, db.ForeignKey('dish_purchases.id'), unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    payment = db.relationship('Payment')
+    dish_purchase = db.relationship('DishPurchase')
+    
+    __table_args__ = (
+        db.Index('ix_wallet_entries_user_created', 'user_id', 'created_at', 'id'),
+    )
+    
+    @property
+    def cursor(self):
+        """Keyset position of this entry in its owner's history"""
+        return f'{self.created_at.isoformat()}_{self.id}'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'type': self.entry_type,
+            'amount': float(self.amount) if self.amount else 0,
+            'balance_after': float(self.balance_after) if self.balance_after else 0,
+            'description': self.description,
+            'payment_id': self.payment_id,
+            'dish_purchase_id': self.dish_purchase_id,
+            'date': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    def __repr__(self):
+        return f'<WalletEntry {self.id} {self.entry_type} {self.amount}>'
@@ -1,21 +1,18 @@
 from flask import render_template, Blueprint, g, redirect, url_for
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask_jwt_extended import verify_jwt_in_request
 
-from app.models import User
+from app.utils.current_user import load_current_user
 
 pages_bp = Blueprint('pages', __name__)
 
 
 @pages_bp.before_request
 def load_user():
-    g.current_user = None
     try:
         verify_jwt_in_request(optional=True, locations=['cookies', 'headers'])
-        user_id = get_jwt_identity()
-        if user_id:
-            g.current_user = User.query.get(int(user_id))
+        load_current_user()
     except Exception:
-        pass
+        g.current_user = None
 
 
 @pages_bp.route('/')
@@ -0,0 +1 @@
+"""Read and write services shared between API blueprints."""
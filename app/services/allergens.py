@@ -0,0 +1,228 @@
+"""Allergen masks for dishes and students, and serve-time conflict checks.
+
+Masks are derived data: a dish carries the OR of its ingredients' masks and
+a student the OR of their allergies' masks. Mapper events refresh only the
+dish or student a write touches, so a conflict check is one bitwise AND.
+"""
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history, set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from app.extensions import db
+from app.models import User, Allergy, Dish, Ingredient, DishIngredient, DishPurchase
+from app.models.allergen import ALLERGENS, allergen_mask, allergen_codes
+from app.services.menu import load_menu
+
+
+def conflicts(student_mask, dish_mask):
+    """Allergen codes a student must not get from a dish"""
+    return allergen_codes((student_mask or 0) & (dish_mask or 0))
+
+
+def taxonomy():
+    return [{'code': code, 'label': label} for code, label, _ in ALLERGENS]
+
+
+def _fold(masks):
+    mask = 0
+    for (value,) in masks:
+        mask |= value or 0
+    return mask
+
+
+def _store(connection, session, model, pk, mask):
+    connection.execute(update(model).where(model.id == pk).values(allergen_mask=mask))
+    # Keep an already loaded instance in step without marking it dirty
+    loaded = session.identity_map.get(identity_key(model, pk)) if session else None
+    if loaded is not None:
+        set_committed_value(loaded, 'allergen_mask', mask)
+
+
+def _refresh_user(connection, session, user_id):
+    mask = _fold(connection.execute(
+        select(Allergy.allergen_mask).where(Allergy.user_id == user_id)
+    ))
+    _store(connection, session, User, user_id, mask)
+
+
+def _refresh_dish(connection, session, dish_id):
+    mask = _fold(connection.execute(
+        select(Ingredient.allergen_mask).join(
+            DishIngredient, DishIngredient.ingredient_id == Ingredient.id
+        ).where(DishIngredient.dish_id == dish_id)
+    ))
+    _store(connection, session, Dish, dish_id, mask)
+
+
+def _previous(target, key):
+    history = get_history(target, key)
+    return history.deleted[0] if history.deleted else None
+
+
+@event.listens_for(Allergy, 'after_insert')
+@event.listens_for(Allergy, 'after_delete')
+def _allergy_written(mapper, connection, target):
+    _refresh_user(connection, object_session(target), target.user_id)
+
+
+@event.listens_for(Allergy, 'after_update')
+def _allergy_updated(mapper, connection, target):
+    session = object_session(target)
+    previous_user = _previous(target, 'user_id')
+    if previous_user is not None:
+        _refresh_user(connection, session, previous_user)
+    if previous_user is not None or get_history(target, 'allergen_mask').has_changes():
+        _refresh_user(connection, session, target.user_id)
+
+
+@event.listens_for(DishIngredient, 'after_insert')
+@event.listens_for(DishIngredient, 'after_delete')
+def _recipe_written(mapper, connection, target):
+    _refresh_dish(connection, object_session(target), target.dish_id)
+
+
+@event.listens_for(DishIngredient, 'after_update')
+def _recipe_updated(mapper, connection, target):
+    session = object_session(target)
+    previous_dish = _previous(target, 'dish_id')
+    if previous_dish is not None:
+        _refresh_dish(connection, session, previous_dish)
+    _refresh_dish(connection, session, target.dish_id)
+
+
+@event.listens_for(Ingredient, 'after_update')
+def _ingredient_updated(mapper, connection, target):
+    if not get_history(target, 'allergen_mask').has_changes():
+        return
+    session = object_session(target)
+    dish_ids = connection.execute(
+        select(DishIngredient.dish_id).where(
+            DishIngredient.ingredient_id == target.id
+        ).distinct()
+    ).scalars().all()
+    for dish_id in dish_ids:
+        _refresh_dish(connection, session, dish_id)
+
+
+def build_conflict_matrix(menu_date, meal_type):
+    """Today's menu dishes x students who bought from it, with conflicting allergens.
+
+    Returns None when there is no menu. Costs the cached menu lookup plus two
+    queries: dish masks and the distinct (student, dish) purchase pairs.
+    """
+    menu_data, dishes, _ = load_menu(menu_date, meal_type)
+    if not menu_data:
+        return None
+
+    dish_ids = [dish['id'] for dish in dishes]
+    dish_masks = dict(
+        db.session.query(Dish.id, Dish.allergen_mask).filter(Dish.id.in_(dish_ids))
+    ) if dish_ids else {}
+
+    purchase_meal_type = DishPurchase.meal_type == meal_type
+    if meal_type == 'lunch':
+        purchase_meal_type = db.or_(purchase_meal_type, DishPurchase.meal_type.is_(None))
+
+    pairs = db.session.query(
+        User.id, User.full_name, User.allergen_mask, DishPurchase.dish_id
+    ).join(
+        DishPurchase, DishPurchase.user_id == User.id
+    ).filter(
+        DishPurchase.purchase_date >= datetime.combine(menu_date, time.min),
+        DishPurchase.purchase_date < datetime.combine(menu_date + timedelta(days=1), time.min),
+        purchase_meal_type,
+        DishPurchase.dish_id.in_(dish_ids)
+    ).distinct().order_by(User.full_name).all() if dish_ids else []
+
+    students = {}
+    for user_id, full_name, student_mask, dish_id in pairs:
+        student = students.setdefault(user_id, {
+            'id': user_id,
+            'full_name': full_name,
+            'allergens': allergen_codes(student_mask),
+            'mask': student_mask or 0,
+            'purchased': []
+        })
+        student['purchased'].append(dish_id)
+
+    conflict_count = 0
+    for student in students.values():
+        student_mask = student.pop('mask')
+        student['conflicts'] = [
+            {'dish_id': dish_id, 'allergens': allergen_codes(student_mask & mask)}
+            for dish_id, mask in dish_masks.items() if student_mask & mask
+        ]
+        student['purchased_conflicts'] = [
+            entry['dish_id'] for entry in student['conflicts']
+            if entry['dish_id'] in student['purchased']
+        ]
+        conflict_count += len(student['purchased_conflicts'])
+
+    return {
+        'menu': menu_data,
+        'allergens': taxonomy(),
+        'dishes': [
+            {
+                'id': dish['id'],
+                'name': dish['name'],
+                'allergens': allergen_codes(dish_masks.get(dish['id']))
+            }
+            for dish in dishes
+        ],
+        'students': list(students.values()),
+        'conflict_count': conflict_count
+    }
+
+
+def rebuild_allergen_masks(reclassify_ingredients=False):
+    """Recompute every stored mask; returns counts of rows touched per table.
+
+    Ingredient masks are re-derived from names only when asked, since they
+    may have been set by hand.
+    """
+    counts = {}
+
+    allergies = db.session.query(Allergy.id, Allergy.allergy_type).all()
+    if allergies:
+        db.session.execute(db.update(Allergy), [
+            {'id': allergy_id, 'allergen_mask': allergen_mask(allergy_type)}
+            for allergy_id, allergy_type in allergies
+        ])
+    counts['allergies'] = len(allergies)
+
+    if reclassify_ingredients:
+        ingredients = db.session.query(Ingredient.id, Ingredient.name).all()
+        if ingredients:
+            db.session.execute(db.update(Ingredient), [
+                {'id': ingredient_id, 'allergen_mask': allergen_mask(name)}
+                for ingredient_id, name in ingredients
+            ])
+        counts['ingredients'] = len(ingredients)
+
+    user_masks = {}
+    for user_id, mask in db.session.query(Allergy.user_id, Allergy.allergen_mask):
+        user_masks[user_id] = user_masks.get(user_id, 0) | (mask or 0)
+    db.session.query(User).update({User.allergen_mask: 0}, synchronize_session=False)
+    if user_masks:
+        db.session.execute(db.update(User), [
+            {'id': user_id, 'allergen_mask': mask} for user_id, mask in user_masks.items()
+        ])
+    counts['users'] = len(user_masks)
+
+    dish_masks = {}
+    for dish_id, mask in db.session.query(DishIngredient.dish_id, Ingredient.allergen_mask).join(
+        Ingredient, Ingredient.id == DishIngredient.ingredient_id
+    ):
+        dish_masks[dish_id] = dish_masks.get(dish_id, 0) | (mask or 0)
+    db.session.query(Dish).update({Dish.allergen_mask: 0}, synchronize_session=False)
+    if dish_masks:
+        db.session.execute(db.update(Dish), [
+            {'id': dish_id, 'allergen_mask': mask} for dish_id, mask in dish_masks.items()
+        ])
+    counts['dishes'] = len(dish_masks)
+
+    db.session.commit()
+    return counts
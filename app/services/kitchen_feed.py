@@ -0,0 +1,185 @@
+"""Incremental serving-line feed for the cook meal-tracking screen.
+
+MealRecord and DishPurchase writes append a KitchenEvent row inside the same
+transaction, so the kitchen_events table doubles as a broker every worker can
+read: a client keeps a cursor and asks for newer events, either over SSE or
+by long-polling. The cursor never passes an id that may still be committing
+(see app.utils.feed_cursor), so events after such a gap can arrive twice and
+clients apply them by id.
+"""
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.orm.util import identity_key
+
+from app.extensions import db
+from app.models import User, Dish, MealRecord, DishPurchase, KitchenEvent
+from app.services.allergens import conflicts
+from app.utils.feed_cursor import commit_safe_cursor, starting_cursor
+
+FEED_BATCH_SIZE = 100
+
+
+def _lookup(connection, target, model, pk, columns):
+    """Read columns of a related row, from the session if it is already loaded.
+    
+    Runs inside flush, so it must not go through the ORM query path.
+    """
+    loaded = object_session(target).identity_map.get(identity_key(model, pk))
+    if loaded is not None and not inspect(loaded).unloaded.intersection(columns):
+        return {name: getattr(loaded, name) for name in columns}
+    row = connection.execute(
+        select(*[getattr(model, name) for name in columns]).where(model.id == pk)
+    ).first()
+    return dict(zip(columns, row)) if row else dict.fromkeys(columns)
+
+
+def _user_info(connection, target):
+    return {
+        'id': target.user_id,
+        **_lookup(connection, target, User, target.user_id, ('full_name', 'email'))
+    }
+
+
+def _append(connection, event_type, meal_type, menu_id, payload):
+    connection.execute(KitchenEvent.__table__.insert().values(
+        event_type=event_type,
+        meal_type=meal_type,
+        menu_id=menu_id,
+        payload=payload,
+        created_at=datetime.utcnow()
+    ))
+
+
+def _meal_payload(connection, meal_record):
+    meal_data = meal_record.to_dict()
+    meal_data['user'] = _user_info(connection, meal_record)
+    return {'meal_record': meal_data}
+
+
+def _purchase_payload(connection, purchase):
+    purchase_data = purchase.to_dict()
+    purchase_data['user'] = _user_info(connection, purchase)
+    dish = _lookup(connection, purchase, Dish, purchase.dish_id, ('name', 'category', 'allergen_mask'))
+    student = _lookup(connection, purchase, User, purchase.user_id, ('allergen_mask',))
+    purchase_data['allergen_conflicts'] = conflicts(
+        student['allergen_mask'], dish.pop('allergen_mask')
+    )
+    purchase_data['dish'] = {'id': purchase.dish_id, **dish}
+    return {'purchase': purchase_data}
+
+
+@event.listens_for(MealRecord, 'after_insert')
+def _meal_recorded(mapper, connection, target):
+    _append(connection, 'meal_recorded', target.meal_type, target.menu_id,
+            _meal_payload(connection, target))
+
+
+@event.listens_for(MealRecord, 'after_update')
+def _meal_updated(mapper, connection, target):
+    if target.is_confirmed and get_history(target, 'is_confirmed').has_changes():
+        _append(connection, 'meal_confirmed', target.meal_type, target.menu_id,
+                _meal_payload(connection, target))
+
+
+@event.listens_for(DishPurchase, 'after_insert')
+def _purchase_created(mapper, connection, target):
+    _append(connection, 'purchase_created', target.meal_type, target.menu_id,
+            _purchase_payload(connection, target))
+
+
+@event.listens_for(DishPurchase, 'after_update')
+def _purchase_updated(mapper, connection, target):
+    if target.is_used and get_history(target, 'is_used').has_changes():
+        _append(connection, 'purchase_used', target.meal_type, target.menu_id,
+                _purchase_payload(connection, target))
+
+
+def current_cursor():
+    return starting_cursor(KitchenEvent)
+
+
+def fetch_events(after):
+    """Return (events, cursor, held) for events with id > after.
+    
+    held is True when the cursor stopped before an id that may still be
+    committing; the events past it are returned again on the next read.
+    """
+    events = KitchenEvent.query.filter(
+        KitchenEvent.id > after
+    ).order_by(KitchenEvent.id).limit(FEED_BATCH_SIZE).all()
+    # End the read transaction so the next poll sees rows committed meanwhile
+    db.session.rollback()
+    
+    cursor, held = commit_safe_cursor(after, [(e.id, e.created_at) for e in events])
+    return [e.to_dict() for e in events], cursor, held
+
+
+def wait_for_events(after, timeout, latest=None):
+    """Long-poll: return as soon as there is something new or after timeout seconds.
+    
+    latest is the newest event id the client already has; events it got
+    before while the cursor was held back do not end the wait by themselves.
+    """
+    interval = current_app.config.get('KITCHEN_FEED_POLL_SECONDS', 1)
+    latest = max(after, latest or 0)
+    deadline = time.monotonic() + timeout
+    while True:
+        events, cursor, _ = fetch_events(after)
+        fresh = cursor > after or any(e['id'] > latest for e in events)
+        if fresh or time.monotonic() >= deadline:
+            return events, cursor
+        time.sleep(interval)
+
+
+def stream_events(after):
+    """Yield SSE frames for new events until the stream lifetime runs out.
+    
+    The stream ends on its own so it never pins a worker indefinitely;
+    EventSource reconnects with Last-Event-ID and resumes from the cursor
+    as of the last frame it got.
+    """
+    interval = current_app.config.get('KITCHEN_FEED_POLL_SECONDS', 1)
+    lifetime = current_app.config.get('KITCHEN_FEED_STREAM_SECONDS', 55)
+    heartbeat = 15
+    
+    deadline = time.monotonic() + lifetime
+    last_sent = time.monotonic()
+    yield 'retry: 2000\n\n'
+    
+    cursor = after
+    # Ids above the cursor this stream has already sent
+    sent = set()
+    while time.monotonic() < deadline:
+        events, cursor, held = fetch_events(cursor)
+        fresh = [e for e in events if e['id'] not in sent]
+        sent = {e['id'] for e in events if e['id'] > cursor}
+        for feed_event in fresh:
+            yield (
+                f"id: {min(feed_event['id'], cursor)}\n"
+                f"event: {feed_event['type']}\n"
+                f"data: {json.dumps(feed_event, ensure_ascii=False)}\n\n"
+            )
+            last_sent = time.monotonic()
+        
+        if not fresh or held:
+            if time.monotonic() - last_sent >= heartbeat:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(interval)
+
+
+def prune_events(older_than_hours=None):
+    """Delete feed events older than the retention window; returns rows deleted"""
+    hours = older_than_hours or current_app.config.get('KITCHEN_EVENTS_RETENTION_HOURS', 24)
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    deleted = KitchenEvent.query.filter(
+        KitchenEvent.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
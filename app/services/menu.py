@@ -0,0 +1,147 @@
+from sqlalchemy.orm import joinedload
+
+from app.extensions import cache
+from app.models import Dish, Menu, MenuItem
+from app.utils.http_cache import make_etag
+
+
+def get_active_menu(menu_date, meal_type):
+    """Load a menu together with its items and dishes in a single query"""
+    return Menu.query.options(
+        joinedload(Menu.menu_items).joinedload(MenuItem.dish)
+    ).filter_by(
+        menu_date=menu_date,
+        meal_type=meal_type,
+        is_active=True
+    ).first()
+
+
+def serialize_menu(menu):
+    """Build the menu dict with items and the matching dishes list.
+
+    Both ``menu['items'][i]['dish']`` and ``dishes`` share the same dish dicts,
+    so every dish is serialized once.
+    """
+    available = [
+        item for item in menu.menu_items
+        if item.dish and item.dish.is_available
+    ]
+    
+    dish_data_by_id = {}
+    items = []
+    for item in available:
+        dish_data = dish_data_by_id.get(item.dish_id)
+        if dish_data is None:
+            dish_data = item.dish.to_dict()
+            dish_data.update(item.dish.rating_dict())
+            dish_data_by_id[item.dish_id] = dish_data
+        
+        item_data = item.to_dict()
+        item_data['dish'] = dish_data
+        items.append(item_data)
+    
+    menu_data = menu.to_dict()
+    menu_data['items'] = items
+    
+    return menu_data, [item['dish'] for item in items]
+
+
+def build_menu(menu_date, meal_type):
+    menu = get_active_menu(menu_date, meal_type)
+    if not menu:
+        return None, [], make_etag('menu', menu_date, meal_type, None)
+    
+    menu_data, dishes = serialize_menu(menu)
+    return menu_data, dishes, make_etag('menu', menu_data)
+
+
+def load_menu(menu_date, meal_type):
+    """Return (menu_data, dishes, etag); menu_data is None if there is no menu.
+
+    Served from the in-process cache; callers must not mutate the result.
+    The ETag is a hash of the payload computed once per cache fill, so it is
+    identical across workers holding the same data.
+    """
+    key = ('menu', menu_date, meal_type, cache.catalog_version)
+    return cache.get_or_set(key, lambda: build_menu(menu_date, meal_type))
+
+
+def build_available_dishes():
+    dishes = Dish.query.filter_by(is_available=True).order_by(Dish.name).all()
+    
+    dishes_data = []
+    for dish in dishes:
+        dish_dict = dish.to_dict()
+        dish_dict.update(dish.rating_dict())
+        dishes_data.append(dish_dict)
+    
+    return dishes_data, make_etag('dishes', dishes_data)
+
+
+def load_available_dishes():
+    """Return (dishes_data, etag) for available dishes, cached per catalog version"""
+    key = ('dishes', cache.catalog_version)
+    return cache.get_or_set(key, build_available_dishes)
+
+
+def build_menu_range(start, end, meal_type):
+    query = Menu.query.options(
+        joinedload(Menu.menu_items)
+    ).filter(
+        Menu.menu_date.between(start, end),
+        Menu.is_active == True
+    )
+    if meal_type:
+        query = query.filter(Menu.meal_type == meal_type)
+    menus = query.order_by(Menu.menu_date, Menu.meal_type).all()
+    
+    dish_ids = {item.dish_id for menu in menus for item in menu.menu_items}
+    dishes = Dish.query.filter(
+        Dish.id.in_(dish_ids),
+        Dish.is_available == True
+    ).all() if dish_ids else []
+    
+    dishes_data = {}
+    for dish in dishes:
+        dish_dict = dish.to_dict()
+        dish_dict.update(dish.rating_dict())
+        dishes_data[str(dish.id)] = dish_dict
+    
+    menus_data = []
+    for menu in menus:
+        menu_dict = menu.to_dict()
+        menu_dict['dish_ids'] = [
+            item.dish_id for item in menu.menu_items
+            if str(item.dish_id) in dishes_data
+        ]
+        menus_data.append(menu_dict)
+    
+    payload = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'meal_type': meal_type,
+        'menus': menus_data,
+        'dishes': dishes_data
+    }
+    return payload, make_etag('menu_range', payload)
+
+
+def load_menu_range(start, end, meal_type=None):
+    """Return (payload, etag) with every active menu between start and end.
+
+    Menus reference dishes by id; each dish appears once in payload['dishes'].
+    Costs two queries (menus with items, then dishes) regardless of range size.
+    """
+    key = ('menu_range', start, end, meal_type, cache.catalog_version)
+    return cache.get_or_set(key, lambda: build_menu_range(start, end, meal_type))
+
+
+def invalidate_menu(menu_date, meal_type):
+    """Call after committing a change to the menu for (menu_date, meal_type)"""
+    cache.invalidate('menu', menu_date, meal_type)
+    cache.invalidate('menu_range')
+
+
+def invalidate_catalog():
+    """Call after committing a change to any dish or review"""
+    cache.bump_catalog_version()
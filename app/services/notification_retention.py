@@ -0,0 +1,150 @@
+"""Retention for personal notifications.
+
+Notifications carry the category they were created for (the outbox event
+type, or ``manual``). Once a day is over, high-volume categories are folded
+into one digest row per user and day, and rows older than their category's
+retention are deleted. Both jobs work in small batches, one short
+transaction each, and keep users.unread_notifications in step.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.extensions import db
+from app.models import Notification
+from app.services.notifications import decrement_unread
+
+DIGEST_SUFFIX = '_digest'
+DIGEST_TITLES = {
+    'meal_served': 'Питание выдано за день',
+    'meal_received': 'Питание получено за день',
+}
+DIGEST_MAX_LINES = 20
+
+
+def _digest_message(day, rows):
+    lines = [row.message for row in rows[:DIGEST_MAX_LINES]]
+    if len(rows) > DIGEST_MAX_LINES:
+        lines.append(f'и ещё {len(rows) - DIGEST_MAX_LINES}')
+    return f'{day:%d.%m.%Y}, всего {len(rows)}:\n' + '\n'.join(lines)
+
+
+def _release_unread(deleted, kept_unread=None):
+    """Lower unread counters by the unread rows deleted, less digests that stay unread"""
+    per_user = defaultdict(int)
+    for row in deleted:
+        if not row.is_read:
+            per_user[row.user_id] += 1
+    for user_id, count in (kept_unread or {}).items():
+        per_user[user_id] -= count
+    for user_id, count in per_user.items():
+        decrement_unread(user_id, count)
+
+
+def compact_digests(categories=None, batch_size=200, pause=0):
+    """Fold finished days of each digest category into one row per user and day.
+
+    The digest keeps the newest seq and created_at of its day and is unread
+    while any of its rows was. Returns the number of rows folded away.
+    """
+    if categories is None:
+        categories = current_app.config.get('NOTIFICATION_DIGEST_CATEGORIES', [])
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    day = db.func.date(Notification.created_at)
+    folded = 0
+
+    for category in categories:
+        while True:
+            groups = db.session.query(Notification.user_id, day).filter(
+                Notification.category == category,
+                Notification.created_at < today
+            ).group_by(Notification.user_id, day).having(
+                db.func.count(Notification.id) > 1
+            ).limit(batch_size).all()
+            if not groups:
+                break
+
+            wanted = {(user_id, str(group_day)) for user_id, group_day in groups}
+            rows = db.session.query(
+                Notification.id, Notification.user_id, Notification.message, Notification.is_read,
+                Notification.seq, Notification.created_at
+            ).filter(
+                Notification.category == category,
+                Notification.user_id.in_({user_id for user_id, _ in wanted}),
+                Notification.created_at < today
+            ).order_by(Notification.created_at, Notification.id)
+
+            buckets = defaultdict(list)
+            for row in rows:
+                key = (row.user_id, row.created_at.date().isoformat())
+                if key in wanted:
+                    buckets[key].append(row)
+
+            digests = []
+            unread_digests = defaultdict(int)
+            for (user_id, _), bucket in buckets.items():
+                is_read = all(row.is_read for row in bucket)
+                if not is_read:
+                    unread_digests[user_id] += 1
+                digests.append({
+                    'user_id': user_id,
+                    'category': category + DIGEST_SUFFIX,
+                    'title': DIGEST_TITLES.get(category, 'Уведомления за день'),
+                    'message': _digest_message(bucket[0].created_at, bucket),
+                    'is_read': is_read,
+                    'seq': max(row.seq or 0 for row in bucket),
+                    'created_at': bucket[-1].created_at
+                })
+
+            replaced = [row for bucket in buckets.values() for row in bucket]
+            db.session.execute(db.insert(Notification), digests)
+            Notification.query.filter(
+                Notification.id.in_([row.id for row in replaced])
+            ).delete(synchronize_session=False)
+            _release_unread(replaced, unread_digests)
+            db.session.commit()
+            folded += len(replaced) - len(digests)
+            if pause:
+                time.sleep(pause)
+
+    return folded
+
+
+def purge_expired(batch_size=1000, pause=0):
+    """Delete notifications older than their category's retention; returns rows deleted"""
+    overrides = current_app.config.get('NOTIFICATION_RETENTION_BY_CATEGORY', {})
+    now = datetime.utcnow()
+    policies = [
+        (Notification.category == category, now - timedelta(days=days))
+        for category, days in overrides.items()
+    ]
+    # Every other category, and rows from before categories existed
+    policies.append((
+        db.or_(Notification.category.is_(None), Notification.category.notin_(overrides)),
+        now - timedelta(days=current_app.config.get('NOTIFICATION_RETENTION_DAYS', 180))
+    ))
+
+    deleted = 0
+    for condition, cutoff in policies:
+        while True:
+            rows = db.session.query(
+                Notification.id, Notification.user_id, Notification.is_read
+            ).filter(
+                condition,
+                Notification.created_at < cutoff
+            ).order_by(Notification.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            Notification.query.filter(
+                Notification.id.in_([row.id for row in rows])
+            ).delete(synchronize_session=False)
+            _release_unread(rows)
+            db.session.commit()
+            deleted += len(rows)
+            if pause:
+                time.sleep(pause)
+
+    return deleted
@@ -0,0 +1,153 @@
+"""Server-sent notification feed for the navbar badge.
+
+An open stream costs no queries while nothing happens: one hub thread per
+process polls ``users.notification_seq`` of the users with an open stream
+and the count and newest id of broadcasts, and wakes only the streams whose
+position moved; the count also moves when a lower broadcast id commits
+late. A woken stream reads the new items after its cursor and sends them;
+EventSource resumes from the last one with Last-Event-ID. While the cursor
+is held before a broadcast that may still be committing, the stream reads
+again every poll interval and skips the broadcasts it has already sent.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+from app.extensions import db
+from app.models import User, Broadcast
+from app.services.notifications import FEED_SIZE, fetch_since
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+WATCH_CHUNK_SIZE = 500
+
+
+class NotificationHub:
+    """Wakes the notification streams of this process when their feed changes"""
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._watchers = {}
+        # user id -> (notification seq, broadcast version) their streams have been woken for
+        self._positions = {}
+        # (count, newest id) of broadcasts as of the last poll
+        self._broadcasts = None
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['notification_hub'] = self
+
+    @contextmanager
+    def watch(self, user_id, cursor):
+        """Register a stream at cursor; yields an Event set whenever the user's feed may have changed"""
+        wakeup = threading.Event()
+        seq, _ = cursor
+        with self._lock:
+            self._watchers.setdefault(user_id, set()).add(wakeup)
+            # Start from the older position, so nothing committed meanwhile is missed
+            known_seq, _ = self._positions.get(user_id, (seq, None))
+            self._positions[user_id] = (min(seq, known_seq), self._broadcasts)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-hub', daemon=True)
+                self._thread.start()
+        try:
+            yield wakeup
+        finally:
+            with self._lock:
+                streams = self._watchers.get(user_id)
+                streams.discard(wakeup)
+                if not streams:
+                    del self._watchers[user_id]
+                    self._positions.pop(user_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config.get('NOTIFICATION_STREAM_POLL_SECONDS', 2))
+            with self._lock:
+                user_ids = list(self._watchers)
+            if not user_ids:
+                continue
+            with self.app.app_context():
+                try:
+                    self._poll(user_ids)
+                except Exception:
+                    logger.exception('Notification hub poll failed')
+                finally:
+                    db.session.remove()
+
+    def _poll(self, user_ids):
+        seqs = {}
+        for start in range(0, len(user_ids), WATCH_CHUNK_SIZE):
+            seqs.update(db.session.query(User.id, User.notification_seq).filter(
+                User.id.in_(user_ids[start:start + WATCH_CHUNK_SIZE])
+            ))
+        broadcasts = tuple(db.session.query(
+            db.func.count(Broadcast.id), db.func.max(Broadcast.id)
+        ).one())
+
+        with self._lock:
+            self._broadcasts = broadcasts
+            for user_id, seq in seqs.items():
+                if user_id not in self._positions:
+                    continue
+                if self._positions[user_id] != (seq, broadcasts):
+                    self._positions[user_id] = (seq, broadcasts)
+                    for wakeup in self._watchers[user_id]:
+                        wakeup.set()
+
+
+def stream_notifications(user, cursor):
+    """Yield SSE frames with feed items after cursor until the stream lifetime runs out.
+
+    user must be detached from the session: each read ends its transaction
+    so the next one sees rows committed meanwhile.
+    """
+    lifetime = current_app.config.get('NOTIFICATION_STREAM_SECONDS', 120)
+    poll = current_app.config.get('NOTIFICATION_STREAM_POLL_SECONDS', 2)
+    deadline = time.monotonic() + lifetime
+    yield 'retry: 5000\n\n'
+
+    # Broadcast ids above the cursor this stream has already sent
+    sent = set()
+    held = False
+    with notification_hub.watch(user.id, cursor) as wakeup:
+        # The first pass catches up with whatever arrived before the stream opened
+        wakeup.set()
+        while time.monotonic() < deadline:
+            timeout = min(HEARTBEAT_SECONDS, max(deadline - time.monotonic(), 0))
+            if not wakeup.wait(min(timeout, poll) if held else timeout):
+                if not held:
+                    yield ': keep-alive\n\n'
+                    continue
+            wakeup.clear()
+
+            while True:
+                previous = cursor
+                items, cursor, held = fetch_since(user, cursor)
+                db.session.rollback()
+                fresh = [
+                    item for item in items
+                    if item['kind'] != 'broadcast' or item['id'] not in sent
+                ]
+                sent = {
+                    item['id'] for item in items
+                    if item['kind'] == 'broadcast' and item['id'] > cursor[1]
+                }
+                for item in fresh:
+                    yield (
+                        f"id: {item['cursor']}\n"
+                        f"event: notification\n"
+                        f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
+                    )
+                if len(items) < FEED_SIZE or cursor == previous:
+                    break
+
+
+notification_hub = NotificationHub()
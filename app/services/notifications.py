@@ -0,0 +1,342 @@
+"""Personal notifications and role broadcasts, read as one feed.
+
+A broadcast is a single row however many users it reaches. Whether a user
+has read it is kept on the reader's side: ``users.broadcast_read_id`` is a
+watermark below which every broadcast counts as read, and BroadcastRead
+rows mark single broadcasts above it. Marking everything read moves the
+watermark and drops those rows.
+
+Personal notifications are numbered per user from users.notification_seq,
+so ``<seq>.<broadcast id>`` is a cursor a client can resume the feed from.
+Broadcast ids are shared by every writer and may commit out of order, so
+the broadcast half stops before an id that may still be committing (see
+app.utils.feed_cursor) and broadcasts past it can be sent twice.
+``users.unread_notifications`` counts the unread ones; every insert and
+read goes through the functions below, which move it with conditional
+UPDATEs, and reconcile_unread_counts repairs any drift.
+"""
+from collections import Counter
+
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import Notification, Broadcast, BroadcastRead, User
+from app.models.notification import utc_isoformat
+from app.utils.feed_cursor import commit_safe_limit, grace_cutoff
+
+FEED_SIZE = 20
+FEED_MAX_SIZE = 100
+BROADCAST_ROLES = ('student', 'cook', 'admin')
+
+
+def visible_broadcasts(user):
+    """Broadcasts addressed to the user's role or to everyone, sent after they joined"""
+    condition = db.or_(Broadcast.role.is_(None), Broadcast.role == user.role)
+    if user.created_at:
+        condition = db.and_(condition, Broadcast.created_at >= user.created_at)
+    return condition
+
+
+def broadcast_is_read(user):
+    return db.or_(
+        Broadcast.id <= user.broadcast_read_id,
+        db.exists().where(
+            BroadcastRead.user_id == user.id,
+            BroadcastRead.broadcast_id == Broadcast.id
+        )
+    )
+
+
+def feed_state(user):
+    """Return (version, unread_count) of the user's feed with one query.
+
+    Personal notifications are described by the user's own counters, so only
+    broadcasts are aggregated. version changes whenever an item arrives or
+    is read, so it can key an ETag.
+    """
+    count, unread, latest = db.session.query(
+        db.func.count(Broadcast.id),
+        db.func.sum(db.case((broadcast_is_read(user), 0), else_=1)),
+        db.func.max(Broadcast.id)
+    ).filter(visible_broadcasts(user)).one()
+    version = (user.notification_seq, user.unread_notifications, count, unread, latest)
+    return version, user.unread_notifications + (unread or 0)
+
+
+def assign_sequence(rows):
+    """Give each pending notification row the next seq of its user.
+
+    One conditional UPDATE per distinct batch size bumps the counters and
+    locks the user rows until commit, so sequence numbers of a user become
+    visible in order.
+    """
+    counts = Counter(row['user_id'] for row in rows)
+    by_count = {}
+    for user_id, count in counts.items():
+        by_count.setdefault(count, []).append(user_id)
+    for count, user_ids in sorted(by_count.items()):
+        db.session.execute(
+            db.update(User).where(User.id.in_(sorted(user_ids))).values(
+                notification_seq=User.notification_seq + count,
+                unread_notifications=User.unread_notifications + count
+            ).execution_options(synchronize_session=False)
+        )
+
+    last = dict(db.session.query(User.id, User.notification_seq).filter(User.id.in_(counts)))
+    next_seq = {
+        user_id: last[user_id] - count + 1
+        for user_id, count in counts.items() if user_id in last
+    }
+    for row in rows:
+        seq = next_seq.get(row['user_id'])
+        row['seq'] = seq
+        if seq is not None:
+            next_seq[row['user_id']] = seq + 1
+
+
+def insert_notifications(rows):
+    """Bulk-insert unread personal notification rows (dicts) with their sequence numbers"""
+    if not rows:
+        return
+    assign_sequence(rows)
+    db.session.execute(db.insert(Notification), rows)
+
+
+def format_cursor(seq, broadcast_id):
+    return f'{seq}.{broadcast_id}'
+
+
+def parse_cursor(value):
+    """Split a ``<seq>.<broadcast id>`` cursor; raises ValueError when malformed"""
+    seq, _, broadcast_id = value.partition('.')
+    seq, broadcast_id = int(seq), int(broadcast_id or 0)
+    if seq < 0 or broadcast_id < 0:
+        raise ValueError(value)
+    return seq, broadcast_id
+
+
+def feed_cursor(user):
+    """Cursor of the newest item in the user's feed that no uncommitted broadcast can precede"""
+    latest = db.session.query(db.func.max(Broadcast.id)).filter(
+        visible_broadcasts(user),
+        Broadcast.created_at <= grace_cutoff()
+    ).scalar()
+    return user.notification_seq, latest or 0
+
+
+def _feed_item(user, row, kind, is_read):
+    return {
+        'id': row.id,
+        'kind': kind,
+        'user_id': user.id,
+        'title': row.title,
+        'message': row.message,
+        'is_read': bool(is_read),
+        'created_at': utc_isoformat(row.created_at)
+    }
+
+
+def fetch_since(user, cursor, limit=FEED_SIZE):
+    """Return (items, cursor, held) for feed items after cursor, oldest first.
+
+    Each item carries the cursor that resumes right after it. held is True
+    when the broadcast half stopped before an id that may still be
+    committing; broadcasts past it are returned again on the next read.
+    """
+    seq, broadcast_id = cursor
+    personal = db.session.query(
+        Notification.id, Notification.seq, Notification.title, Notification.message,
+        Notification.is_read, Notification.created_at
+    ).filter(
+        Notification.user_id == user.id,
+        Notification.seq > seq
+    ).order_by(Notification.seq).limit(limit).all()
+    broadcasts = db.session.query(
+        Broadcast.id, Broadcast.title, Broadcast.message, Broadcast.created_at
+    ).filter(
+        visible_broadcasts(user),
+        Broadcast.id > broadcast_id
+    ).order_by(Broadcast.id).limit(limit).all()
+    safe_limit = commit_safe_limit(Broadcast, broadcast_id) if broadcasts else None
+
+    merged = sorted(
+        [('personal', row) for row in personal] + [('broadcast', row) for row in broadcasts],
+        key=lambda item: item[1].created_at
+    )[:limit]
+    items = []
+    held = False
+    for kind, row in merged:
+        if kind == 'personal':
+            seq = row.seq
+            item = _feed_item(user, row, kind, row.is_read)
+        else:
+            if safe_limit is not None and row.id > safe_limit:
+                held = True
+                broadcast_id = max(broadcast_id, safe_limit)
+            else:
+                broadcast_id = row.id
+            item = _feed_item(user, row, kind, False)
+        item['cursor'] = format_cursor(seq, broadcast_id)
+        items.append(item)
+    return items, (seq, broadcast_id), held
+
+
+def _personal_branch(user, is_read, limit):
+    """Newest personal rows with one read state, a range scan of (user_id, is_read, created_at)"""
+    return db.select(
+        db.select(
+            Notification.id,
+            db.literal('personal').label('kind'),
+            Notification.title,
+            Notification.message,
+            Notification.is_read,
+            Notification.created_at
+        ).where(
+            Notification.user_id == user.id,
+            Notification.is_read == is_read
+        ).order_by(Notification.created_at.desc()).limit(limit).subquery()
+    )
+
+
+def load_feed(user, limit=FEED_SIZE):
+    """Unread items first, then the newest read ones, personal and broadcast merged.
+
+    At most FEED_MAX_SIZE items; every branch is limited before the merge, so
+    the cost does not grow with the user's history.
+    """
+    limit = min(limit, FEED_MAX_SIZE)
+    is_read = db.case((broadcast_is_read(user), True), else_=False)
+    broadcasts = db.select(
+        db.select(
+            Broadcast.id,
+            db.literal('broadcast').label('kind'),
+            Broadcast.title,
+            Broadcast.message,
+            is_read.label('is_read'),
+            Broadcast.created_at
+        ).where(visible_broadcasts(user)).order_by(
+            is_read, Broadcast.created_at.desc()
+        ).limit(limit).subquery()
+    )
+
+    feed = db.union_all(
+        _personal_branch(user, False, limit),
+        _personal_branch(user, True, limit),
+        broadcasts
+    ).subquery()
+    rows = db.session.execute(
+        db.select(feed).order_by(feed.c.is_read, feed.c.created_at.desc()).limit(limit)
+    )
+    return [_feed_item(user, row, row.kind, row.is_read) for row in rows]
+
+
+def decrement_unread(user_id, count):
+    if count:
+        db.session.execute(
+            db.update(User).where(User.id == user_id).values(
+                unread_notifications=db.case(
+                    (User.unread_notifications > count, User.unread_notifications - count),
+                    else_=0
+                )
+            ).execution_options(synchronize_session=False)
+        )
+
+
+def mark_read(user, notification_id):
+    """Mark one personal notification read; False if the user has no such notification"""
+    result = db.session.execute(
+        db.update(Notification).where(
+            Notification.id == notification_id,
+            Notification.user_id == user.id,
+            Notification.is_read == False
+        ).values(is_read=True).execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 1:
+        decrement_unread(user.id, 1)
+        return True
+    # Already read is still found
+    return db.session.query(Notification.query.filter_by(
+        id=notification_id, user_id=user.id
+    ).exists()).scalar()
+
+
+def mark_broadcast_read(user, broadcast_id):
+    """Mark one broadcast read for user; False if it is not addressed to them"""
+    visible = db.session.query(Broadcast.id).filter(
+        Broadcast.id == broadcast_id,
+        visible_broadcasts(user)
+    ).first()
+    if not visible:
+        return False
+    if broadcast_id > user.broadcast_read_id:
+        try:
+            with db.session.begin_nested():
+                db.session.add(BroadcastRead(user_id=user.id, broadcast_id=broadcast_id))
+        except IntegrityError:
+            # Marked read concurrently by another tab or click
+            pass
+    return True
+
+
+def mark_all_read(user):
+    marked = Notification.query.filter_by(
+        user_id=user.id,
+        is_read=False
+    ).update({'is_read': True}, synchronize_session=False)
+    # Subtract rather than zero, so a notification inserted meanwhile stays counted
+    decrement_unread(user.id, marked)
+
+    latest = db.session.query(db.func.max(Broadcast.id)).filter(visible_broadcasts(user)).scalar()
+    if latest and latest > user.broadcast_read_id:
+        db.session.execute(
+            db.update(User).where(User.id == user.id, User.broadcast_read_id < latest).values(
+                broadcast_read_id=latest
+            ).execution_options(synchronize_session=False)
+        )
+        # Reads at or under the watermark are implied by it now
+        BroadcastRead.query.filter(
+            BroadcastRead.user_id == user.id,
+            BroadcastRead.broadcast_id <= latest
+        ).delete(synchronize_session=False)
+
+
+def unread_count(user):
+    """Unread personal notifications plus unread broadcasts"""
+    unread_broadcasts = db.session.query(db.func.count(Broadcast.id)).filter(
+        visible_broadcasts(user),
+        Broadcast.id > user.broadcast_read_id,
+        ~db.exists().where(
+            BroadcastRead.user_id == user.id,
+            BroadcastRead.broadcast_id == Broadcast.id
+        )
+    ).scalar()
+    return user.unread_notifications + unread_broadcasts
+
+
+def reconcile_unread_counts(batch_size=1000):
+    """Reset users.unread_notifications from the notifications table where it drifted.
+
+    Works through users in id order, one statement and commit per batch;
+    each row is recounted inside its own UPDATE. Returns users corrected.
+    """
+    actual = db.select(db.func.count(Notification.id)).where(
+        Notification.user_id == User.id,
+        Notification.is_read == False
+    ).scalar_subquery()
+    fixed = 0
+    last_id = 0
+    while True:
+        user_ids = [
+            user_id for (user_id,) in
+            db.session.query(User.id).filter(User.id > last_id).order_by(User.id).limit(batch_size)
+        ]
+        if not user_ids:
+            return fixed
+        last_id = user_ids[-1]
+        fixed += db.session.execute(
+            db.update(User).where(
+                User.id.in_(user_ids),
+                User.unread_notifications != actual
+            ).values(unread_notifications=actual).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
@@ -0,0 +1,343 @@
+"""Transactional outbox for side-effect notifications.
+
+Write endpoints record a compact OutboxEvent (ids and amounts, no text) in
+the same transaction as the change it reports, so a request commits one
+small row instead of rendering and inserting notifications itself. Workers
+claim events in batches, render them with the templates below, bulk-insert
+the notifications and delete the events in one commit; an event is
+delivered once even when several processes poll the table.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import Dish, Ingredient, Notification, Broadcast, OutboxEvent
+from app.services.notifications import insert_notifications
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_WINDOW_SECONDS = 60
+
+_RENDERERS = {}
+
+
+def publish(event_type, **payload):
+    """Record an outbox event in the current transaction"""
+    db.session.add(OutboxEvent(event_type=event_type, payload=payload))
+
+
+def renders(event_type):
+    def register(fn):
+        _RENDERERS[event_type] = fn
+        return fn
+    return register
+
+
+def _personal(user_id, title, message):
+    return Notification, {'user_id': user_id, 'title': title, 'message': message}
+
+
+def _broadcast(role, title, message):
+    return Broadcast, {'role': role, 'title': title, 'message': message}
+
+
+def _dish_name(payload, names):
+    return names['dishes'].get(payload.get('dish_id')) or 'блюдо'
+
+
+@renders('payment_completed')
+def _payment_completed(payload, names):
+    return _personal(
+        payload['user_id'],
+        'Оплата успешна',
+        f"Ваш платеж на сумму {payload['amount']:.2f} ₽ успешно обработан."
+    )
+
+
+@renders('subscription_activated')
+def _subscription_activated(payload, names):
+    if payload['extended']:
+        message = f"Абонемент продлён до {payload['end_date']}. Всего обедов: {payload['meals_remaining']}"
+    else:
+        message = f"Ваш {payload['subscription_type']} абонемент активен до {payload['end_date']}."
+    return _personal(
+        payload['user_id'],
+        'Абонемент активирован',
+        f"{message} Списано с кошелька: {payload['amount']:.2f} ₽. Текущий баланс: {payload['balance']:.2f} ₽"
+    )
+
+
+@renders('wallet_topped_up')
+def _wallet_topped_up(payload, names):
+    return _personal(
+        payload['user_id'],
+        'Кошелек пополнен',
+        f"Ваш кошелек успешно пополнен на {payload['amount']:.2f} ₽. Текущий баланс: {payload['balance']:.2f} ₽"
+    )
+
+
+@renders('dish_purchased')
+def _dish_purchased(payload, names):
+    return _personal(
+        payload['user_id'],
+        'Блюдо приобретено',
+        f"Вы приобрели \"{_dish_name(payload, names)}\" за {payload['price']:.2f} ₽. "
+        f"Текущий баланс: {payload['balance']:.2f} ₽"
+    )
+
+
+@renders('meal_received')
+def _meal_received(payload, names):
+    return _personal(payload['user_id'], 'Питание получено', f'Вы получили "{_dish_name(payload, names)}"')
+
+
+@renders('meal_served')
+def _meal_served(payload, names):
+    return _personal(payload['user_id'], 'Питание выдано', f'Повар выдал вам "{_dish_name(payload, names)}"')
+
+
+@renders('purchase_request_created')
+def _purchase_request_created(payload, names):
+    return _broadcast(
+        'admin',
+        'Новая заявка на закупку',
+        f"Создана новая заявка на закупку. Предполагаемая стоимость: {payload['total_cost']:.2f} ₽"
+    )
+
+
+@renders('purchase_request_reviewed')
+def _purchase_request_reviewed(payload, names):
+    status = payload['status']
+    return _personal(payload['user_id'], f'Заявка {status}', f'Ваша заявка на закупку была {status}.')
+
+
+@renders('low_stock')
+def _low_stock(payload, names):
+    name, unit = names['ingredients'].get(payload['ingredient_id'], ('Ингредиент', ''))
+    return _broadcast(
+        'admin',
+        'Низкий запас',
+        f"{name} заканчивается. Текущий запас: {payload['quantity']} {unit}"
+    )
+
+
+def _load_names(events):
+    """Names the templates need for a whole batch, one query per table"""
+    dish_ids = {e.payload.get('dish_id') for e in events} - {None}
+    ingredient_ids = {e.payload.get('ingredient_id') for e in events} - {None}
+    return {
+        'dishes': dict(
+            db.session.query(Dish.id, Dish.name).filter(Dish.id.in_(dish_ids))
+        ) if dish_ids else {},
+        'ingredients': {
+            ingredient_id: (name, unit) for ingredient_id, name, unit in
+            db.session.query(Ingredient.id, Ingredient.name, Ingredient.unit).filter(
+                Ingredient.id.in_(ingredient_ids)
+            )
+        } if ingredient_ids else {}
+    }
+
+
+def claim_batch(batch_size, claim_timeout, max_attempts):
+    """Lease up to batch_size pending events; returns (claim id, events)"""
+    claim = uuid.uuid4().hex
+    now = datetime.utcnow()
+    claimable = db.and_(
+        OutboxEvent.attempts < max_attempts,
+        db.or_(
+            OutboxEvent.claimed_at.is_(None),
+            OutboxEvent.claimed_at < now - timedelta(seconds=claim_timeout)
+        )
+    )
+    candidates = [
+        event_id for (event_id,) in
+        db.session.query(OutboxEvent.id).filter(claimable).order_by(OutboxEvent.id).limit(batch_size)
+    ]
+    if not candidates:
+        db.session.rollback()
+        return claim, []
+
+    # The claimable condition is re-checked per row, so racing workers split the batch
+    db.session.execute(
+        db.update(OutboxEvent).where(OutboxEvent.id.in_(candidates), claimable).values(
+            claimed_by=claim, claimed_at=now
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    events = OutboxEvent.query.filter(
+        OutboxEvent.id.in_(candidates),
+        OutboxEvent.claimed_by == claim
+    ).order_by(OutboxEvent.id).all()
+    return claim, events
+
+
+def deliver(claim, events):
+    """Render and insert notifications for claimed events; returns (delivered, failed)"""
+    names = _load_names(events)
+    rows = {Notification: [], Broadcast: []}
+    failed = {}
+    now = datetime.utcnow()
+    for event in events:
+        try:
+            model, row = _RENDERERS[event.event_type](event.payload, names)
+        except Exception as e:
+            failed[event.id] = f'{type(e).__name__}: {e}'[:255]
+            continue
+        if model is Notification:
+            row['category'] = event.event_type
+        # Broadcast ids are a feed cursor, which needs the time of the insert
+        created_at = event.created_at if model is Notification else now
+        rows[model].append({**row, 'created_at': created_at})
+
+    delivered = [event.id for event in events if event.id not in failed]
+    insert_notifications(rows[Notification])
+    if rows[Broadcast]:
+        db.session.execute(db.insert(Broadcast), rows[Broadcast])
+
+    if delivered:
+        result = db.session.execute(
+            db.delete(OutboxEvent).where(
+                OutboxEvent.id.in_(delivered),
+                OutboxEvent.claimed_by == claim
+            ).execution_options(synchronize_session=False)
+        )
+        if result.rowcount != len(delivered):
+            # The lease ran out and another worker took some events over
+            db.session.rollback()
+            return 0, 0
+
+    # A failed event keeps its claim time, so it is retried after the claim timeout
+    for event_id, error in failed.items():
+        db.session.execute(
+            db.update(OutboxEvent).where(OutboxEvent.id == event_id).values(
+                attempts=OutboxEvent.attempts + 1,
+                last_error=error,
+                claimed_by=None
+            ).execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return len(delivered), len(failed)
+
+
+class OutboxWorker:
+    """Delivers outbox events from background threads of the current process.
+
+    With ``OUTBOX_WORKER=thread`` the threads start with the first request a
+    process serves, so CLI commands never start them. ``flask outbox-worker``
+    runs the same loop as a separate process.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.delivered = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_at = None
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['outbox_worker'] = self
+        if app.config.get('OUTBOX_WORKER', 'thread') == 'thread':
+            app.before_request(self._ensure_started)
+
+    def _ensure_started(self):
+        if not self._threads:
+            self.start()
+
+    def start(self, threads=None):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            count = threads or self.app.config.get('OUTBOX_WORKER_THREADS', 1)
+            self._threads = [
+                threading.Thread(target=self._run, name=f'outbox-{i}', daemon=True)
+                for i in range(count)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        poll = self.app.config.get('OUTBOX_POLL_SECONDS', 1)
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    handled = self.run_once()
+                except Exception:
+                    logger.exception('Outbox batch failed')
+                    db.session.rollback()
+                    handled = 0
+            if not handled:
+                self._stop.wait(poll)
+
+    def run_once(self):
+        """Claim and deliver one batch; returns the number of events handled"""
+        config = self.app.config
+        claim, events = claim_batch(
+            config.get('OUTBOX_BATCH_SIZE', 200),
+            config.get('OUTBOX_CLAIM_TIMEOUT', 60),
+            config.get('OUTBOX_MAX_ATTEMPTS', 5)
+        )
+        if not events:
+            return 0
+
+        delivered, failed = deliver(claim, events)
+        now = time.monotonic()
+        with self._lock:
+            self.delivered += delivered
+            self.failed += failed
+            self.batches += 1
+            self.last_batch_at = datetime.utcnow()
+            self._recent.append((now, delivered))
+            while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+                self._recent.popleft()
+        return delivered + failed
+
+    def stats(self):
+        with self._lock:
+            recent = sum(count for _, count in self._recent)
+            return {
+                'threads': sum(1 for thread in self._threads if thread.is_alive()),
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'batches': self.batches,
+                'events_per_second': round(recent / THROUGHPUT_WINDOW_SECONDS, 2),
+                'last_batch_at': self.last_batch_at.isoformat() if self.last_batch_at else None
+            }
+
+
+def outbox_metrics(max_attempts=5):
+    """Backlog of the shared outbox table plus this process's worker counters"""
+    pending, dead, oldest = db.session.query(
+        db.func.sum(db.case((OutboxEvent.attempts < max_attempts, 1), else_=0)),
+        db.func.sum(db.case((OutboxEvent.attempts >= max_attempts, 1), else_=0)),
+        db.func.min(db.case((OutboxEvent.attempts < max_attempts, OutboxEvent.created_at)))
+    ).one()
+    return {
+        'pending': pending or 0,
+        'dead': dead or 0,
+        'lag_seconds': round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0,
+        'oldest_pending_at': oldest.isoformat() if oldest else None,
+        'worker': outbox_worker.stats()
+    }
+
+
+outbox_worker = OutboxWorker()
@@ -0,0 +1,96 @@
+import threading
+
+import bcrypt
+from flask import current_app, has_app_context, jsonify
+
+DEFAULT_ROUNDS = 12
+
+
+def configured_rounds():
+    if has_app_context():
+        return current_app.config.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS)
+    return DEFAULT_ROUNDS
+
+
+def hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds=rounds or configured_rounds())
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def verify_password(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def hash_rounds(password_hash):
+    """Return the cost factor stored in a ``$2b$<rounds>$...`` hash"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Admission control for bcrypt in the request thread.
+    
+    At most ``workers`` hashes run at once per process, so a burst of logins
+    cannot take every CPU from the rest of the worker (bcrypt releases the
+    GIL while hashing). Up to ``max_pending`` more callers wait, each at most
+    ``queue_timeout`` seconds; anything beyond that raises PasswordHasherBusy
+    at once rather than piling up.
+    """
+
+    def __init__(self, app=None):
+        self._running = None
+        self._admitted = None
+        self.rounds = DEFAULT_ROUNDS
+        self.queue_timeout = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+        max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', 64)
+        self.rounds = app.config.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5)
+        
+        self._running = threading.BoundedSemaphore(workers)
+        self._admitted = threading.BoundedSemaphore(workers + max_pending)
+        
+        app.extensions['password_hasher'] = self
+        app.register_error_handler(PasswordHasherBusy, self._busy_response)
+
+    @staticmethod
+    def _busy_response(e):
+        return jsonify({'error': 'Сервер перегружен, повторите попытку позже'}), 503
+
+    def _run(self, fn, *args):
+        if self._running is None:
+            return fn(*args)
+        
+        if not self._admitted.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            if not self._running.acquire(timeout=self.queue_timeout):
+                raise PasswordHasherBusy()
+            try:
+                return fn(*args)
+            finally:
+                self._running.release()
+        finally:
+            self._admitted.release()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(verify_password, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        return hash_rounds(password_hash) != self.rounds
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,34 @@
+from app.extensions import db
+from app.models import Dish, Review
+
+
+def rebuild_dish_ratings():
+    """Recompute every dish's rating aggregates from the reviews table.
+
+    Returns the number of dishes updated.
+    """
+    rows = db.session.query(
+        Review.dish_id,
+        Review.rating,
+        db.func.count(Review.id)
+    ).group_by(Review.dish_id, Review.rating).all()
+    
+    histograms = {}
+    for dish_id, rating, count in rows:
+        histograms.setdefault(dish_id, {})[rating] = count
+    
+    updates = []
+    for dish_id, in db.session.query(Dish.id).all():
+        histogram = histograms.get(dish_id, {})
+        values = {'id': dish_id}
+        for star in range(1, 6):
+            values[f'rating_{star}'] = histogram.get(star, 0)
+        values['rating_count'] = sum(histogram.values())
+        values['rating_sum'] = sum(star * count for star, count in histogram.items())
+        updates.append(values)
+    
+    if updates:
+        db.session.execute(db.update(Dish), updates)
+    db.session.commit()
+    
+    return len(updates)
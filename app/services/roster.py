@@ -0,0 +1,233 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import User, WalletEntry
+from app.models.user import normalize_search_text, to_money
+from app.services.passwords import hash_password, configured_rounds
+from app.services.search import student_search
+
+ROSTER_FORMATS = ('csv', 'jsonl')
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_roster_format(explicit=None, filename=None, mimetype=None):
+    """Pick csv/jsonl from an explicit value, the file extension or the MIME type"""
+    if explicit:
+        return explicit if explicit in ROSTER_FORMATS else None
+    
+    if filename:
+        extension = os.path.splitext(filename)[1].lower().lstrip('.')
+        if extension in ('jsonl', 'ndjson'):
+            return 'jsonl'
+        if extension == 'csv':
+            return 'csv'
+    
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'jsonl'
+    if mimetype == 'text/csv':
+        return 'csv'
+    return None
+
+
+def iter_roster_rows(stream, fmt):
+    """Yield (line_number, record) from a text stream one row at a time.
+    
+    record is None when the line cannot be parsed.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+def parse_roster_row(record):
+    """Validate one roster record; return (data, error)"""
+    if record is None:
+        return None, 'Некорректная строка'
+    
+    email = str(record.get('email') or '').strip().lower()
+    full_name = str(record.get('full_name') or '').strip()
+    password = str(record.get('password') or '')
+    
+    if not email:
+        return None, 'Не указан email'
+    if '@' not in email or len(email) > 120:
+        return {'email': email}, 'Некорректный email'
+    if not full_name:
+        return {'email': email}, 'Не указано ФИО'
+    if len(full_name) > 100:
+        return {'email': email}, 'ФИО слишком длинное'
+    if not password:
+        return {'email': email}, 'Не указан пароль'
+    
+    try:
+        balance = to_money(record.get('balance'))
+    except (TypeError, ValueError, ArithmeticError):
+        return {'email': email}, 'Некорректный баланс'
+    if not balance.is_finite() or balance < 0:
+        return {'email': email}, 'Некорректный баланс'
+    
+    return {
+        'email': email,
+        'full_name': full_name,
+        'password': password,
+        'balance': balance
+    }, None
+
+
+class RosterImport:
+    """Streams a roster into the users table in chunked transactions.
+    
+    Each chunk costs one ``IN`` query to skip existing emails, one parallel
+    bcrypt pass over a process pool, one executemany INSERT and one
+    INSERT ... SELECT for the opening wallet entries.
+    """
+
+    def __init__(self, chunk_size=None, workers=None):
+        self.chunk_size = chunk_size or current_app.config.get('ROSTER_IMPORT_CHUNK_SIZE', 500)
+        self.workers = workers or current_app.config.get('ROSTER_IMPORT_WORKERS') or os.cpu_count()
+        self.rounds = configured_rounds()
+        self.rows = 0
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        self._seen = set()
+
+    def _error(self, line_number, data, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({
+                'line': line_number,
+                'email': data.get('email') if data else None,
+                'error': message
+            })
+
+    def run(self, stream, fmt):
+        started = time.monotonic()
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            chunk = []
+            for line_number, record in iter_roster_rows(stream, fmt):
+                self.rows += 1
+                data, error = parse_roster_row(record)
+                if error is None and data['email'] in self._seen:
+                    error = 'Повторяющийся email в файле'
+                if error:
+                    self._error(line_number, data, error)
+                    continue
+                
+                self._seen.add(data['email'])
+                chunk.append((line_number, data))
+                if len(chunk) >= self.chunk_size:
+                    self._import_chunk(chunk, pool)
+                    chunk = []
+            
+            if chunk:
+                self._import_chunk(chunk, pool)
+        
+        elapsed = time.monotonic() - started
+        self.errors.sort(key=lambda e: e['line'])
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'failed': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed, 1) if elapsed else None
+        }
+
+    def _import_chunk(self, chunk, pool):
+        emails = [data['email'] for _, data in chunk]
+        existing = {
+            email for (email,) in
+            db.session.query(User.email).filter(User.email.in_(emails))
+        }
+        
+        fresh = []
+        for line_number, data in chunk:
+            if data['email'] in existing:
+                self._error(line_number, data, 'Пользователь с таким email уже существует')
+            else:
+                fresh.append((line_number, data))
+        if not fresh:
+            return
+        
+        hashes = pool.map(
+            hash_password,
+            [data['password'] for _, data in fresh],
+            repeat(self.rounds),
+            chunksize=max(1, len(fresh) // (self.workers * 4))
+        )
+        
+        now = datetime.utcnow()
+        rows = [
+            {
+                'email': data['email'],
+                'full_name': data['full_name'],
+                'search_name': normalize_search_text(data['full_name']),
+                'search_email': data['email'],
+                'password_hash': password_hash,
+                'role': 'student',
+                'is_active': True,
+                'balance': data['balance'],
+                'created_at': now
+            }
+            for (_, data), password_hash in zip(fresh, hashes)
+        ]
+        
+        try:
+            self._insert(rows, now)
+            db.session.commit()
+            self.created += len(rows)
+        except IntegrityError:
+            # Someone else took one of the emails meanwhile; find it row by row
+            db.session.rollback()
+            for (line_number, data), row in zip(fresh, rows):
+                try:
+                    self._insert([row], now)
+                    db.session.commit()
+                    self.created += 1
+                except IntegrityError:
+                    db.session.rollback()
+                    self._error(line_number, data, 'Ошибка записи: email уже занят')
+        
+        # Core inserts bypass the mapper events that refresh the search index
+        student_search.invalidate()
+
+    @staticmethod
+    def _insert(rows, now):
+        db.session.execute(db.insert(User), rows)
+        # Imported balances open each student's wallet ledger
+        db.session.execute(db.insert(WalletEntry).from_select(
+            ['user_id', 'amount', 'balance_after', 'entry_type', 'description', 'created_at'],
+            db.select(
+                User.id, User.balance, User.balance,
+                db.literal('opening'), db.literal('Начальный баланс'), db.literal(now)
+            ).where(User.email.in_([row['email'] for row in rows]), User.balance > 0)
+        ))
+
+
+def import_roster(stream, fmt, chunk_size=None, workers=None):
+    """Import students from a CSV/JSONL text stream and return the report dict"""
+    return RosterImport(chunk_size=chunk_size, workers=workers).run(stream, fmt)
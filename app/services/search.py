@@ -0,0 +1,159 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+
+from app.extensions import db
+from app.models import User
+from app.models.user import normalize_search_text
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class StudentSearchIndex:
+    """In-memory prefix/trigram index over student names and emails.
+
+    Built from the casefolded ``search_name``/``search_email`` columns with one
+    narrow query. Queries of three or more characters match anywhere through
+    the trigram map; shorter ones match word prefixes through a sorted token
+    list. User writes in this process mark the index dirty; writes made by
+    other workers show up after ``SEARCH_INDEX_MAX_AGE`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._trigrams = {}
+        self._tokens = []
+        self._built_at = None
+        self._dirty = True
+        self.max_age = 60
+
+    def init_app(self, app):
+        self.max_age = app.config.get('SEARCH_INDEX_MAX_AGE', 60)
+        app.extensions['student_search'] = self
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _is_stale(self):
+        return self._dirty or time.monotonic() - self._built_at >= self.max_age
+
+    def _ensure_fresh(self):
+        if not self._is_stale():
+            return
+        with self._lock:
+            if self._is_stale():
+                self._rebuild()
+
+    def _rebuild(self):
+        # Clear the flag first so writes that land during the rebuild re-mark it
+        self._dirty = False
+        rows = db.session.query(
+            User.id, User.full_name, User.email, User.search_name, User.search_email
+        ).filter(User.role == 'student').all()
+
+        entries = {}
+        trigrams = defaultdict(set)
+        tokens = []
+        for user_id, full_name, email, search_name, search_email in rows:
+            name = search_name or normalize_search_text(full_name)
+            mail = search_email or normalize_search_text(email)
+            entries[user_id] = (name, mail)
+
+            for text in (name, mail):
+                for gram in _trigrams(text):
+                    trigrams[gram].add(user_id)
+            for token in name.split() + [mail]:
+                tokens.append((token, user_id))
+        tokens.sort()
+
+        self._entries, self._trigrams, self._tokens = entries, dict(trigrams), tokens
+        self._built_at = time.monotonic()
+
+    def search(self, query, limit=10):
+        """Return up to limit student ids whose name or email contains query"""
+        needle = normalize_search_text(query)
+        if not needle:
+            return []
+
+        self._ensure_fresh()
+        entries, trigrams, tokens = self._entries, self._trigrams, self._tokens
+
+        if len(needle) >= 3:
+            grams = sorted(_trigrams(needle), key=lambda g: len(trigrams.get(g, ())))
+            candidates = set(trigrams.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= trigrams.get(gram, set())
+            matches = [
+                user_id for user_id in candidates
+                if needle in entries[user_id][0] or needle in entries[user_id][1]
+            ]
+        else:
+            matches = set()
+            for token, user_id in tokens[bisect_left(tokens, (needle,)):]:
+                if not token.startswith(needle):
+                    break
+                matches.add(user_id)
+            matches = list(matches)
+
+        def rank(user_id):
+            name, mail = entries[user_id]
+            is_prefix = name.startswith(needle) or any(
+                word.startswith(needle) for word in name.split()
+            )
+            return (not is_prefix, name, user_id)
+
+        matches.sort(key=rank)
+        return matches[:limit]
+
+
+student_search = StudentSearchIndex()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def _user_written(mapper, connection, target):
+    student_search.invalidate()
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    for key in ('full_name', 'email', 'role'):
+        if get_history(target, key).has_changes():
+            student_search.invalidate()
+            return
+
+
+def rebuild_search_columns(chunk_size=1000):
+    """Backfill search_name/search_email for every user; returns rows updated"""
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(User.id, User.full_name, User.email).filter(
+            User.id > last_id
+        ).order_by(User.id).limit(chunk_size).all()
+        if not rows:
+            break
+
+        db.session.execute(db.update(User), [
+            {
+                'id': user_id,
+                'search_name': normalize_search_text(full_name),
+                'search_email': normalize_search_text(email)
+            }
+            for user_id, full_name, email in rows
+        ])
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+    student_search.invalidate()
+    return updated
@@ -0,0 +1,327 @@
+"""Serving-line operations shared by the single and batch cook endpoints.
+
+Every function stages its changes and flushes but never commits, so callers
+can run several of them in one transaction. Failures raise ServeError with
+the HTTP status the endpoint should answer with.
+"""
+from datetime import datetime, date, time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import (
+    User, Dish, Menu, MealRecord, Allergy,
+    DishPurchase, Subscription, Payment
+)
+from app.services.allergens import conflicts
+from app.services.menu import invalidate_menu
+from app.services.outbox import publish
+
+MEAL_TYPES = ('breakfast', 'lunch')
+
+
+class ServeError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _today_bounds():
+    today = date.today()
+    return today, datetime.combine(today, time.min), datetime.combine(today, time.max)
+
+
+def get_or_create_today_menu(meal_type):
+    """Return today's active menu for meal_type, creating an empty one if needed"""
+    today = date.today()
+    menu = Menu.query.filter_by(
+        menu_date=today,
+        meal_type=meal_type,
+        is_active=True
+    ).first()
+    if not menu:
+        menu = Menu(
+            menu_date=today,
+            meal_type=meal_type,
+            is_active=True
+        )
+        db.session.add(menu)
+        db.session.flush()
+        db.session.info.setdefault('created_menus', set()).add((today, meal_type))
+    return menu
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_created_menus(session):
+    for menu_date, meal_type in session.info.pop('created_menus', ()):
+        invalidate_menu(menu_date, meal_type)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_created_menus(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('created_menus', None)
+
+
+def confirm_meal_record(meal_id):
+    meal_record = db.session.get(MealRecord, meal_id)
+    if not meal_record:
+        raise ServeError('Запись о питании не найдена', 404)
+
+    if meal_record.is_confirmed:
+        raise ServeError('Питание уже выдано', 409)
+
+    meal_record.is_confirmed = True
+    meal_record.received_at = datetime.utcnow()
+    db.session.flush()
+
+    return {
+        'message': 'Питание отмечено как выданное',
+        'meal_record': meal_record.to_dict()
+    }, 200
+
+
+def serve_user_meal(user_id, meal_type='lunch', menu_id=None):
+    user = db.session.get(User, user_id)
+    if not user:
+        raise ServeError('Пользователь не найден', 404)
+
+    if menu_id:
+        menu = db.session.get(Menu, menu_id)
+        if not menu:
+            raise ServeError('Меню не найдено', 404)
+        meal_type = menu.meal_type
+    else:
+        menu = get_or_create_today_menu(meal_type)
+
+    # Multiple subscription meals per day are allowed on this path
+    meal_record = MealRecord(
+        user_id=user.id,
+        menu_id=menu.id,
+        meal_type=meal_type,
+        is_confirmed=True,
+        received_at=datetime.utcnow()
+    )
+    db.session.add(meal_record)
+    db.session.flush()
+
+    return {
+        'message': 'Питание успешно выдано',
+        'meal_record': meal_record.to_dict()
+    }, 201
+
+
+def serve_purchase(purchase_id=None, user_id=None):
+    if purchase_id:
+        purchase = db.session.get(DishPurchase, purchase_id)
+        if not purchase:
+            raise ServeError('Покупка не найдена', 404)
+
+        if purchase.is_used:
+            raise ServeError('Это блюдо уже было выдано', 409)
+    elif user_id:
+        _, today_start, today_end = _today_bounds()
+        purchase = DishPurchase.query.filter(
+            DishPurchase.user_id == user_id,
+            DishPurchase.is_used == False,
+            DishPurchase.purchase_date.between(today_start, today_end)
+        ).first()
+
+        if not purchase:
+            raise ServeError('Нет неиспользованных покупок для этого пользователя', 404)
+    else:
+        raise ServeError('Необходим purchase_id или user_id', 400)
+
+    purchase.mark_as_used()
+    meal_type = purchase.meal_type or 'lunch'
+    menu_id = purchase.menu_id or get_or_create_today_menu(meal_type).id
+
+    meal_record = MealRecord(
+        user_id=purchase.user_id,
+        menu_id=menu_id,
+        meal_type=meal_type,
+        is_confirmed=True,
+        received_at=datetime.utcnow()
+    )
+    db.session.add(meal_record)
+
+    dish = db.session.get(Dish, purchase.dish_id)
+    user = db.session.get(User, purchase.user_id)
+    publish('meal_served', user_id=purchase.user_id, dish_id=purchase.dish_id)
+    db.session.flush()
+
+    return {
+        'message': 'Блюдо успешно выдано',
+        'purchase': purchase.to_dict(),
+        'meal_record': meal_record.to_dict(),
+        'allergen_conflicts': conflicts(
+            user.allergen_mask if user else 0,
+            dish.allergen_mask if dish else 0
+        )
+    }, 200
+
+
+def serve_scan(student, meal_type='lunch'):
+    """Resolve a student's entitlement and serve one meal.
+
+    The student is given by id or email. Entitlements are tried in order:
+    unused dish purchase, valid subscription, today's single payment.
+    """
+    student = str(student or '').strip()
+    if not student:
+        raise ServeError('Укажите ID или email ученика', 400)
+
+    if meal_type not in MEAL_TYPES:
+        raise ServeError('Тип питания должен быть breakfast или lunch', 400)
+
+    # Locking the student row serializes concurrent scans of the same student
+    query = User.query.with_for_update()
+    if student.isdigit():
+        user = query.filter(User.id == int(student)).first()
+    else:
+        user = query.filter(User.email == student).first()
+
+    if not user or user.role != 'student':
+        raise ServeError('Ученик не найден', 404)
+
+    if not user.is_active:
+        raise ServeError('Аккаунт ученика неактивен', 403)
+
+    today, today_start, today_end = _today_bounds()
+
+    already_served = db.session.query(
+        MealRecord.query.filter(
+            MealRecord.user_id == user.id,
+            MealRecord.meal_type == meal_type,
+            MealRecord.is_confirmed == True,
+            MealRecord.received_at.between(today_start, today_end)
+        ).exists()
+    ).scalar()
+
+    if already_served:
+        meal_type_ru = 'завтрак' if meal_type == 'breakfast' else 'обед'
+        raise ServeError(f'Ученик уже получил {meal_type_ru} сегодня', 409)
+
+    entitlement = None
+    subscription = None
+
+    purchase_filter = DishPurchase.meal_type == meal_type
+    if meal_type == 'lunch':
+        # Purchases without a meal type count as lunch
+        purchase_filter = db.or_(purchase_filter, DishPurchase.meal_type.is_(None))
+
+    purchase = DishPurchase.query.filter(
+        DishPurchase.user_id == user.id,
+        DishPurchase.is_used == False,
+        DishPurchase.purchase_date.between(today_start, today_end),
+        purchase_filter
+    ).order_by(DishPurchase.purchase_date).first()
+
+    if purchase:
+        purchase.mark_as_used()
+        entitlement = 'purchase'
+    else:
+        subscription = Subscription.query.filter(
+            Subscription.user_id == user.id,
+            Subscription.is_active == True,
+            Subscription.start_date <= today,
+            Subscription.end_date >= today,
+            Subscription.meals_remaining > 0
+        ).first()
+
+        if subscription:
+            subscription.meals_remaining -= 1
+            if subscription.meals_remaining <= 0:
+                subscription.is_active = False
+            entitlement = 'subscription'
+        else:
+            has_payment = db.session.query(
+                Payment.query.filter(
+                    Payment.user_id == user.id,
+                    Payment.payment_type == 'single',
+                    Payment.status == 'completed',
+                    Payment.created_at.between(today_start, today_end)
+                ).exists()
+            ).scalar()
+            if has_payment:
+                entitlement = 'payment'
+
+    if not entitlement:
+        raise ServeError('Нет неиспользованной покупки, абонемента или оплаты', 403)
+
+    if purchase and purchase.menu_id:
+        menu_id = purchase.menu_id
+    else:
+        menu_id = get_or_create_today_menu(meal_type).id
+
+    allergies = [
+        allergy_type for (allergy_type,) in
+        db.session.query(Allergy.allergy_type).filter(Allergy.user_id == user.id)
+    ]
+
+    meal_record = MealRecord(
+        user_id=user.id,
+        menu_id=menu_id,
+        meal_type=meal_type,
+        is_confirmed=True,
+        received_at=datetime.utcnow()
+    )
+    db.session.add(meal_record)
+
+    dish = None
+    if purchase:
+        dish = db.session.get(Dish, purchase.dish_id)
+        publish('meal_served', user_id=user.id, dish_id=purchase.dish_id)
+
+    # Build the response before commit so nothing is reloaded afterwards
+    db.session.flush()
+
+    response = {
+        'message': 'Питание успешно выдано',
+        'entitlement': entitlement,
+        'meal_record': meal_record.to_dict(),
+        'student': {
+            'id': user.id,
+            'full_name': user.full_name,
+            'email': user.email
+        },
+        'allergies': allergies,
+        'has_allergies': bool(allergies)
+    }
+    if purchase:
+        response['purchase'] = purchase.to_dict()
+        response['dish'] = dish.to_dict() if dish else None
+        response['allergen_conflicts'] = conflicts(
+            user.allergen_mask, dish.allergen_mask if dish else 0
+        )
+    if subscription:
+        response['meals_remaining'] = subscription.meals_remaining
+
+    return response, 201
+
+
+def apply_serve_event(event_data):
+    """Dispatch one batch event to the matching serve operation"""
+    event_type = event_data.get('type', 'scan')
+
+    if event_type == 'scan':
+        return serve_scan(
+            event_data.get('student') or event_data.get('user_id'),
+            event_data.get('meal_type', 'lunch')
+        )
+    if event_type == 'meal':
+        if event_data.get('meal_id'):
+            return confirm_meal_record(event_data['meal_id'])
+        if not event_data.get('user_id'):
+            raise ServeError('user_id или meal_id обязательны', 400)
+        return serve_user_meal(
+            event_data['user_id'],
+            event_data.get('meal_type', 'lunch'),
+            event_data.get('menu_id')
+        )
+    if event_type == 'purchase':
+        return serve_purchase(event_data.get('purchase_id'), event_data.get('user_id'))
+
+    raise ServeError('Неизвестный тип события', 400)
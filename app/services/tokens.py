@@ -0,0 +1,100 @@
+import threading
+import time
+
+from flask import jsonify
+from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.extensions import db, jwt
+from app.models import User
+
+
+def user_claims(user):
+    """Claims that let role decorators authorize without loading the user"""
+    return {
+        'role': user.role,
+        'is_active': bool(user.is_active),
+        'ver': user.token_version or 0
+    }
+
+
+def issue_access_token(user):
+    return create_access_token(identity=str(user.id), additional_claims=user_claims(user))
+
+
+def issue_refresh_token(user):
+    return create_refresh_token(identity=str(user.id), additional_claims=user_claims(user))
+
+
+def revoked_token_response(jwt_header, jwt_payload):
+    return jsonify({'error': 'Токен отозван, войдите снова'}), 401
+
+
+class TokenVersionStore:
+    """Tracks users whose outstanding tokens were revoked.
+
+    Only users with token_version > 0 are kept, so the map stays tiny. The
+    worker that revokes a token updates its map as soon as the revoking
+    transaction commits (nothing changes if it rolls back); other workers
+    pick the change up on their next sync, at most TOKEN_VERSION_SYNC_SECONDS
+    later. Tokens whose 'ver' claim is older than the user's version are
+    rejected as revoked.
+    """
+
+    def __init__(self, sync_seconds=5):
+        self.sync_seconds = sync_seconds
+        self._versions = {}
+        self._next_sync = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.sync_seconds = app.config.get('TOKEN_VERSION_SYNC_SECONDS', self.sync_seconds)
+        jwt.token_in_blocklist_loader(self.is_revoked)
+        jwt.revoked_token_loader(revoked_token_response)
+        if not event.contains(Session, 'after_commit', self._apply_pending):
+            event.listen(Session, 'after_commit', self._apply_pending)
+            event.listen(Session, 'after_soft_rollback', self._drop_pending)
+
+    def _sync_if_due(self):
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        rows = db.session.query(User.id, User.token_version).filter(
+            User.token_version > 0
+        ).all()
+        versions = dict(rows)
+        with self._lock:
+            # Versions only grow; keep a revocation committed after the read above
+            for user_id, version in self._versions.items():
+                if version > versions.get(user_id, 0):
+                    versions[user_id] = version
+            self._versions = versions
+            self._next_sync = now + self.sync_seconds
+
+    def is_revoked(self, jwt_header, jwt_payload):
+        self._sync_if_due()
+        current = self._versions.get(int(jwt_payload['sub']), 0)
+        return jwt_payload.get('ver', 0) < current
+
+    def revoke(self, user):
+        """Invalidate every token issued to user so far; takes effect when the session commits"""
+        user.token_version = (user.token_version or 0) + 1
+        pending = db.session.info.setdefault('revoked_token_versions', {})
+        pending[user.id] = user.token_version
+
+    def _apply_pending(self, session):
+        pending = session.info.pop('revoked_token_versions', None)
+        if pending:
+            with self._lock:
+                for user_id, version in pending.items():
+                    if version > self._versions.get(user_id, 0):
+                        self._versions[user_id] = version
+
+    def _drop_pending(self, session, previous_transaction):
+        # A released savepoint leaves the outer transaction, and the revocation, alive
+        if not previous_transaction.nested:
+            session.info.pop('revoked_token_versions', None)
+
+
+token_versions = TokenVersionStore()
@@ -0,0 +1,70 @@
+"""One transaction per write request.
+
+Endpoints stage their domain rows and the side-effect records that go with
+them (notifications) on a UnitOfWork and commit once on leaving the block.
+A failure anywhere rolls back everything, so a payment can no longer be
+committed without its notification or the other way round.
+"""
+from contextlib import contextmanager
+
+from flask import g
+
+from app.extensions import db
+from app.models import Broadcast
+from app.services.notifications import insert_notifications
+from app.services.outbox import publish
+
+
+class UnitOfWork:
+    def __init__(self, session):
+        self.session = session
+        self._notifications = []
+
+    def add(self, *objects):
+        self.session.add_all(objects)
+
+    def notify(self, user_id, title, message):
+        """Stage a personal notification; all of them are inserted at commit"""
+        self._notifications.append({
+            'user_id': user_id,
+            'category': 'manual',
+            'title': title,
+            'message': message
+        })
+
+    def notify_role(self, role, title, message, created_by=None):
+        """Notify every user with role (everyone when None) with one broadcast row"""
+        self.session.add(Broadcast(role=role, title=title, message=message, created_by=created_by))
+
+    def publish(self, event_type, **payload):
+        """Record a side effect for the outbox worker to deliver after commit"""
+        publish(event_type, **payload)
+
+    def remember(self, body, status):
+        """Store the answer under the request's Idempotency-Key, if it sent one"""
+        pending = g.get('idempotency_key')
+        if pending is not None:
+            pending.status_code = status
+            pending.response = body
+            self.session.add(pending)
+
+    def flush(self):
+        """Assign ids so a response can be built before the commit expires the rows"""
+        self.session.flush()
+
+    def commit(self):
+        insert_notifications(self._notifications)
+        self._notifications = []
+        self.session.commit()
+
+
+@contextmanager
+def unit_of_work():
+    """Yield a UnitOfWork and commit it once when the block exits normally"""
+    uow = UnitOfWork(db.session)
+    try:
+        yield uow
+        uow.commit()
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,153 @@
+"""Wallet ledger reads and the one-off backfill from payments and purchases.
+
+Every balance change posts a WalletEntry (see User._apply_balance), so the
+history is a single indexed range scan over (user_id, created_at, id) and
+pages with a keyset cursor instead of an OFFSET.
+"""
+from datetime import datetime
+
+from app.extensions import db
+from app.models import User, Dish, Payment, DishPurchase, WalletEntry
+from app.models.user import to_money
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Payment types that moved money in or out of the wallet, with their sign
+_PAYMENT_ENTRIES = {
+    'topup': (1, 'Пополнение кошелька'),
+    'subscription': (-1, 'Покупка абонемента'),
+}
+
+
+def parse_cursor(value):
+    """Split a ``<created_at>_<id>`` cursor; raises ValueError when malformed"""
+    created_at, _, entry_id = value.rpartition('_')
+    return datetime.fromisoformat(created_at), int(entry_id)
+
+
+def wallet_history(user_id, limit=HISTORY_PAGE_SIZE, before=None):
+    """Return (entries, next_cursor), newest first, for entries older than before"""
+    query = WalletEntry.query.filter(WalletEntry.user_id == user_id)
+    if before:
+        created_at, entry_id = before
+        query = query.filter(db.or_(
+            WalletEntry.created_at < created_at,
+            db.and_(WalletEntry.created_at == created_at, WalletEntry.id < entry_id)
+        ))
+
+    # One extra row tells whether another page exists
+    entries = query.order_by(
+        WalletEntry.created_at.desc(), WalletEntry.id.desc()
+    ).limit(limit + 1).all()
+
+    if len(entries) > limit:
+        entries = entries[:limit]
+        return entries, entries[-1].cursor
+    return entries, None
+
+
+def backfill_ledger(batch_size=500):
+    """Post ledger entries for payments and purchases that have none.
+
+    Works through users in id order, one transaction per batch, and is safe
+    to re-run: already posted payments and purchases are skipped. The
+    balance before the missing history is recovered from the current
+    balance, and whatever the history does not explain (seeded or imported
+    balances) becomes an ``opening`` entry.
+    Returns counts of users and entries written.
+    """
+    counts = {'users': 0, 'entries': 0}
+    last_id = 0
+
+    while True:
+        users = db.session.query(User.id, User.balance, User.created_at).filter(
+            User.id > last_id
+        ).order_by(User.id).limit(batch_size).all()
+        if not users:
+            break
+        last_id = users[-1].id
+        user_ids = [user.id for user in users]
+
+        posted = {
+            user_id: (to_money(total), has_opening)
+            for user_id, total, has_opening in db.session.query(
+                WalletEntry.user_id,
+                db.func.sum(WalletEntry.amount),
+                db.func.max(db.case((WalletEntry.entry_type == 'opening', 1), else_=0))
+            ).filter(WalletEntry.user_id.in_(user_ids)).group_by(WalletEntry.user_id)
+        }
+
+        missing = {user_id: [] for user_id in user_ids}
+        payments = db.session.query(
+            Payment.id, Payment.user_id, Payment.amount, Payment.payment_type, Payment.created_at
+        ).filter(
+            Payment.user_id.in_(user_ids),
+            Payment.payment_type.in_(_PAYMENT_ENTRIES),
+            Payment.status == 'completed',
+            ~db.exists().where(WalletEntry.payment_id == Payment.id)
+        )
+        for payment_id, user_id, amount, payment_type, created_at in payments:
+            sign, description = _PAYMENT_ENTRIES[payment_type]
+            missing[user_id].append({
+                'amount': sign * to_money(amount),
+                'entry_type': payment_type,
+                'description': description,
+                'payment_id': payment_id,
+                'created_at': created_at
+            })
+
+        purchases = db.session.query(
+            DishPurchase.id, DishPurchase.user_id, DishPurchase.price_paid,
+            DishPurchase.purchase_date, Dish.name
+        ).outerjoin(
+            Dish, Dish.id == DishPurchase.dish_id
+        ).filter(
+            DishPurchase.user_id.in_(user_ids),
+            ~db.exists().where(WalletEntry.dish_purchase_id == DishPurchase.id)
+        )
+        for purchase_id, user_id, price_paid, purchase_date, dish_name in purchases:
+            missing[user_id].append({
+                'amount': -to_money(price_paid),
+                'entry_type': 'dish_purchase',
+                'description': f'Покупка: {dish_name or "Блюдо"}',
+                'dish_purchase_id': purchase_id,
+                'created_at': purchase_date
+            })
+
+        rows = []
+        for user_id, balance, user_created_at in users:
+            entries = sorted(missing[user_id], key=lambda entry: entry['created_at'] or datetime.min)
+            posted_total, has_opening = posted.get(user_id, (to_money(0), 0))
+            # Balance before the first posted entry, minus what the missing history added
+            opening = to_money(balance) - posted_total - sum(entry['amount'] for entry in entries)
+
+            if opening and not has_opening:
+                first_date = entries[0]['created_at'] if entries else None
+                entries.insert(0, {
+                    'amount': opening,
+                    'entry_type': 'opening',
+                    'description': 'Начальный баланс',
+                    'created_at': min(filter(None, (user_created_at, first_date)), default=datetime.utcnow())
+                })
+                running = to_money(0)
+            else:
+                running = opening
+
+            for entry in entries:
+                running += entry['amount']
+                entry['created_at'] = entry['created_at'] or datetime.utcnow()
+                rows.append({'user_id': user_id, 'balance_after': running, **entry})
+            if entries:
+                counts['users'] += 1
+
+        if rows:
+            # Bulk rows must share keys, so fill the unused reference columns
+            for row in rows:
+                row.setdefault('payment_id', None)
+                row.setdefault('dish_purchase_id', None)
+            db.session.execute(db.insert(WalletEntry), rows)
+            counts['entries'] += len(rows)
+        db.session.commit()
+
+    return counts
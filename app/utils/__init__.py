@@ -1,4 +1,8 @@
 """Utility functions and decorators for the application."""
 from app.utils.decorators import student_required, cook_required, admin_required
+from app.utils.current_user import load_current_user, load_active_subscription
 
-__all__ = ['student_required', 'cook_required', 'admin_required']
+__all__ = [
+    'student_required', 'cook_required', 'admin_required',
+    'load_current_user', 'load_active_subscription'
+]
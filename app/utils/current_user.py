@@ -0,0 +1,59 @@
+from flask import g, request
+from flask_jwt_extended import get_jwt_identity
+
+from app.extensions import db
+from app.models import User, Subscription
+
+
+def _identity():
+    user_id = get_jwt_identity()
+    return int(user_id) if user_id else None
+
+
+def load_current_user(with_subscription=False):
+    """Return the authenticated User, loading it at most once per request.
+
+    With ``with_subscription=True`` the active subscription is fetched in the
+    same query, so a later ``load_active_subscription()`` costs nothing.
+    Returns None when the request carries no identity or the user is gone.
+    """
+    # g outlives the request when an app context is already pushed (CLI, tests)
+    current_request = request._get_current_object()
+    if g.get('current_user_request') is not current_request:
+        g.pop('current_user', None)
+        g.pop('active_subscription', None)
+        g.current_user_request = current_request
+
+    if 'current_user' in g and not (with_subscription and 'active_subscription' not in g):
+        return g.current_user
+
+    user_id = _identity()
+    if user_id is None:
+        g.current_user = None
+        g.active_subscription = None
+        return None
+
+    if with_subscription:
+        row = db.session.query(User, Subscription).outerjoin(
+            Subscription,
+            db.and_(
+                Subscription.user_id == User.id,
+                Subscription.is_active == True
+            )
+        ).filter(User.id == user_id).first()
+        g.current_user, g.active_subscription = row if row else (None, None)
+    else:
+        g.current_user = db.session.get(User, user_id)
+
+    return g.current_user
+
+
+def load_active_subscription():
+    """Return the current user's active subscription, loaded at most once per request"""
+    user = load_current_user()
+    if 'active_subscription' not in g:
+        g.active_subscription = Subscription.query.filter_by(
+            user_id=user.id,
+            is_active=True
+        ).first() if user else None
+    return g.active_subscription
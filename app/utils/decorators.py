@@ -1,64 +1,34 @@
 from functools import wraps
 from flask import jsonify
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-from app.models import User
+from flask_jwt_extended import verify_jwt_in_request, get_jwt
+from app.utils.current_user import load_current_user
 
 
-def student_required(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        user = User.query.get(int(user_id))
-        
-        if not user:
-            return jsonify({'error': 'Пользователь не найден'}), 404
-        
-        if not user.is_active:
-            return jsonify({'error': 'Аккаунт неактивен'}), 403
-        
-        if user.role != 'student':
-            return jsonify({'error': 'Требуется роль ученика'}), 403
-        
-        return fn(*args, **kwargs)
-    return wrapper
+def _role_required(role, role_error):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            verify_jwt_in_request()
+            claims = get_jwt()
+            
+            # Tokens issued before role claims existed still need a lookup
+            if 'role' not in claims:
+                user = load_current_user()
+                if not user:
+                    return jsonify({'error': 'Пользователь не найден'}), 404
+                claims = {'role': user.role, 'is_active': user.is_active}
+            
+            if not claims.get('is_active'):
+                return jsonify({'error': 'Аккаунт неактивен'}), 403
+            
+            if claims['role'] != role:
+                return jsonify({'error': role_error}), 403
+            
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
 
 
-def cook_required(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        user = User.query.get(int(user_id))
-        
-        if not user:
-            return jsonify({'error': 'Пользователь не найден'}), 404
-        
-        if not user.is_active:
-            return jsonify({'error': 'Аккаунт неактивен'}), 403
-        
-        if user.role != 'cook':
-            return jsonify({'error': 'Требуется роль повара'}), 403
-        
-        return fn(*args, **kwargs)
-    return wrapper
-
-
-def admin_required(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        user = User.query.get(int(user_id))
-        
-        if not user:
-            return jsonify({'error': 'Пользователь не найден'}), 404
-        
-        if not user.is_active:
-            return jsonify({'error': 'Аккаунт неактивен'}), 403
-        
-        if user.role != 'admin':
-            return jsonify({'error': 'Требуется роль администратора'}), 403
-        
-        return fn(*args, **kwargs)
-    return wrapper
+student_required = _role_required('student', 'Требуется роль ученика')
+cook_required = _role_required('cook', 'Требуется роль повара')
+admin_required = _role_required('admin', 'Требуется роль администратора')
@@ -0,0 +1,61 @@
+"""Id cursors over append-only tables that tolerate out-of-order commits.
+
+Autoincrement ids are handed out at insert but become visible at commit, so
+a reader can see id 11 while id 10 is still being committed. A cursor built
+here never moves past a missing id while the row after it is younger than
+FEED_COMMIT_GRACE_SECONDS; rows after such a gap are read again on the next
+poll, so readers drop the duplicates by id. A gap that outlives the grace
+period is a rolled-back insert and is skipped.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.extensions import db
+
+
+def grace_cutoff():
+    """Rows created after this may still sit next to an uncommitted id"""
+    seconds = current_app.config.get('FEED_COMMIT_GRACE_SECONDS', 10)
+    return datetime.utcnow() - timedelta(seconds=seconds)
+
+
+def commit_safe_cursor(after, rows):
+    """Return (cursor, held) for rows of (id, created_at) ordered by id, all above after.
+
+    held is True when a gap younger than the grace period stopped the cursor.
+    """
+    cutoff = grace_cutoff()
+    cursor = after
+    for row_id, created_at in rows:
+        if row_id != cursor + 1 and created_at is not None and created_at > cutoff:
+            return cursor, True
+        cursor = row_id
+    return cursor, False
+
+
+def starting_cursor(model):
+    """Cursor for a new reader: the newest id old enough to have no uncommitted neighbours"""
+    return db.session.query(db.func.max(model.id)).filter(
+        model.created_at <= grace_cutoff()
+    ).scalar() or 0
+
+
+def commit_safe_limit(model, after):
+    """Highest id a cursor past after may reach, or None when no gap holds it back.
+
+    Only rows younger than the grace period can follow an uncommitted id, so
+    just those and the newest id below them are read.
+    """
+    young = db.session.query(model.id, model.created_at).filter(
+        model.id > after,
+        model.created_at > grace_cutoff()
+    ).order_by(model.id).all()
+    if not young:
+        return None
+    below = db.session.query(db.func.max(model.id)).filter(
+        model.id > after,
+        model.id < young[0].id
+    ).scalar()
+    cursor, held = commit_safe_cursor(below or after, young)
+    return cursor if held else None
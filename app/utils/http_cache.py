@@ -0,0 +1,26 @@
+import hashlib
+import json
+
+from flask import jsonify, make_response, request
+
+
+def make_etag(*parts):
+    """Build a strong ETag value from JSON-compatible version parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def conditional_json(etag, build_body):
+    """Return 304 if the client already has etag, otherwise jsonify(build_body()).
+
+    build_body is only called when the client's copy is stale, so unchanged
+    resources are never serialized.
+    """
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(build_body())
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,99 @@
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import IdempotencyKey
+
+MAX_KEY_LENGTH = 64
+
+
+def request_fingerprint():
+    digest = hashlib.sha1()
+    digest.update(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        return jsonify({'error': 'Idempotency-Key уже использован для другого запроса'}), 422
+    response = jsonify(stored.response)
+    response.status_code = stored.status_code
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _find(user_id, key):
+    return IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+
+
+def idempotent(fn):
+    """Replay the stored answer when a request repeats its Idempotency-Key.
+
+    The key is written by UnitOfWork.remember in the same commit as the
+    charge, so a concurrent duplicate fails on the unique (user_id, key)
+    index, rolls back and is answered with the winner's response. Only
+    successful answers are stored; a rejected request can be retried.
+    Requests without the header run as before.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return fn(*args, **kwargs)
+
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': 'Некорректный Idempotency-Key'}), 400
+
+        user_id = int(get_jwt_identity())
+        fingerprint = request_fingerprint()
+        stored = _find(user_id, key)
+        if stored is not None:
+            if stored.created_at >= key_cutoff():
+                return _replay(stored, fingerprint)
+            # Expired but not purged yet: free the key in the same transaction.
+            # Flushed now, as the unit of work would otherwise INSERT before DELETE
+            db.session.delete(stored)
+            db.session.flush()
+
+        g.idempotency_key = IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint)
+        try:
+            return fn(*args, **kwargs)
+        except IntegrityError:
+            stored = _find(user_id, key)
+            if stored is None:
+                raise
+            return _replay(stored, fingerprint)
+        finally:
+            g.pop('idempotency_key', None)
+    return wrapper
+
+
+def key_cutoff(hours=None):
+    hours = hours or current_app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', 24)
+    return datetime.utcnow() - timedelta(hours=hours)
+
+
+def prune_idempotency_keys(older_than_hours=None, batch_size=1000):
+    """Delete keys past their TTL in batches; returns rows deleted"""
+    cutoff = key_cutoff(older_than_hours)
+    deleted = 0
+    while True:
+        ids = [
+            key_id for (key_id,) in
+            db.session.query(IdempotencyKey.id).filter(
+                IdempotencyKey.created_at < cutoff
+            ).limit(batch_size)
+        ]
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.query.filter(
+            IdempotencyKey.id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.session.commit()
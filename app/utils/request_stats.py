@@ -0,0 +1,52 @@
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+
+
+class RequestStats:
+    """Counts SQL statements and commits per request.
+
+    Enabled with ``REQUEST_STATS``; every response then carries
+    ``X-Query-Count`` and ``X-Commit-Count`` so write paths can be checked
+    for extra round trips from a shell or a test client.
+    """
+
+    def init_app(self, app):
+        if not app.config.get('REQUEST_STATS'):
+            return
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._count_query)
+        if not event.contains(Session, 'after_commit', self._count_commit):
+            event.listen(Session, 'after_commit', self._count_commit)
+
+        app.before_request(self._start)
+        app.after_request(self._report)
+        app.extensions['request_stats'] = self
+
+    @staticmethod
+    def _start():
+        g.request_stats = {'queries': 0, 'commits': 0}
+
+    @staticmethod
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context() and 'request_stats' in g:
+            g.request_stats['queries'] += 1
+
+    @staticmethod
+    def _count_commit(session):
+        if has_app_context() and 'request_stats' in g:
+            g.request_stats['commits'] += 1
+
+    @staticmethod
+    def _report(response):
+        stats = g.pop('request_stats', None)
+        if stats is not None:
+            response.headers['X-Query-Count'] = str(stats['queries'])
+            response.headers['X-Commit-Count'] = str(stats['commits'])
+        return response
+
+
+request_stats = RequestStats()
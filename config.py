@@ -34,9 +34,64 @@ class Config:
     JWT_COOKIE_CSRF_PROTECT = False
     JWT_COOKIE_SECURE = False
     JWT_COOKIE_SAMESITE = 'Lax'
+    TOKEN_VERSION_SYNC_SECONDS = int(os.getenv('TOKEN_VERSION_SYNC_SECONDS', 5))
+    
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 64))
+    PASSWORD_HASH_QUEUE_TIMEOUT = int(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+    ROSTER_IMPORT_CHUNK_SIZE = int(os.getenv('ROSTER_IMPORT_CHUNK_SIZE', 500))
+    ROSTER_IMPORT_WORKERS = int(os.getenv('ROSTER_IMPORT_WORKERS', 0)) or None
     
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:5000').split(',')
     
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 512))
+    CACHE_TTL = int(os.getenv('CACHE_TTL', 30))
+    SEARCH_INDEX_MAX_AGE = int(os.getenv('SEARCH_INDEX_MAX_AGE', 60))
+    
+    KITCHEN_FEED_POLL_SECONDS = float(os.getenv('KITCHEN_FEED_POLL_SECONDS', 1))
+    KITCHEN_FEED_STREAM_SECONDS = int(os.getenv('KITCHEN_FEED_STREAM_SECONDS', 55))
+    KITCHEN_EVENTS_RETENTION_HOURS = int(os.getenv('KITCHEN_EVENTS_RETENTION_HOURS', 24))
+    # How long a feed cursor waits for a missing id to commit before skipping it
+    FEED_COMMIT_GRACE_SECONDS = int(os.getenv('FEED_COMMIT_GRACE_SECONDS', 10))
+    
+    NOTIFICATION_STREAM_POLL_SECONDS = float(os.getenv('NOTIFICATION_STREAM_POLL_SECONDS', 2))
+    NOTIFICATION_STREAM_SECONDS = int(os.getenv('NOTIFICATION_STREAM_SECONDS', 120))
+    
+    # Days a notification is kept: per category ("category=days,..."), otherwise
+    # NOTIFICATION_RETENTION_DAYS. Digest categories are folded into one row per
+    # user and finished day, stored as '<category>_digest'.
+    NOTIFICATION_RETENTION_DAYS = int(os.getenv('NOTIFICATION_RETENTION_DAYS', 180))
+    NOTIFICATION_RETENTION_BY_CATEGORY = {
+        category.strip(): int(days)
+        for category, _, days in (
+            item.partition('=') for item in os.getenv(
+                'NOTIFICATION_RETENTION_BY_CATEGORY',
+                'meal_served=30,meal_received=30,meal_served_digest=90,meal_received_digest=90'
+            ).split(',') if item.strip()
+        )
+    }
+    NOTIFICATION_DIGEST_CATEGORIES = [
+        category.strip() for category in
+        os.getenv('NOTIFICATION_DIGEST_CATEGORIES', 'meal_served,meal_received').split(',') if category.strip()
+    ]
+    
+    # How long a money-moving request can be replayed by its Idempotency-Key
+    IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    
+    # Notification outbox: 'thread' delivers from each app process,
+    # 'off' leaves it to a separate `flask outbox-worker` process
+    OUTBOX_WORKER = os.getenv('OUTBOX_WORKER', 'thread')
+    OUTBOX_WORKER_THREADS = int(os.getenv('OUTBOX_WORKER_THREADS', 1))
+    OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 1))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 200))
+    OUTBOX_CLAIM_TIMEOUT = int(os.getenv('OUTBOX_CLAIM_TIMEOUT', 60))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+    
+    # X-Query-Count / X-Commit-Count response headers
+    REQUEST_STATS = os.getenv('REQUEST_STATS', 'false').lower() == 'true'
+    
     APP_HOST = os.getenv('APP_HOST', '0.0.0.0')
     APP_PORT = int(os.getenv('APP_PORT', 5000))
 
@@ -45,6 +100,8 @@ class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{BASE_DIR}/instance/cafeteria.db'
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 10))
+    REQUEST_STATS = True
 
 class ProductionConfig(Config):
     DEBUG = False
@@ -55,6 +112,9 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    BCRYPT_ROUNDS = 4
+    REQUEST_STATS = True
+    OUTBOX_WORKER = 'off'
 
 
 config_by_name = {
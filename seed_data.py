@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 from app import create_app, db
+from app.services.passwords import hash_password
 from app.models import (
     User, Dish, Ingredient, Inventory, DishIngredient,
     Menu, MenuItem
 )
 from datetime import date, datetime, timedelta
-import bcrypt
 
 
 def create_admin_user():
@@ -17,8 +17,7 @@ def create_admin_user():
             role='admin',
             is_active=True
         )
-        salt = bcrypt.gensalt()
-        admin.password_hash = bcrypt.hashpw('admin123'.encode('utf-8'), salt).decode('utf-8')
+        admin.password_hash = hash_password('admin123')
         db.session.add(admin)
     return admin
 
@@ -32,8 +31,7 @@ def create_cook_user():
             role='cook',
             is_active=True
         )
-        salt = bcrypt.gensalt()
-        cook.password_hash = bcrypt.hashpw('cook123'.encode('utf-8'), salt).decode('utf-8')
+        cook.password_hash = hash_password('cook123')
         db.session.add(cook)
     return cook
 
@@ -48,8 +46,7 @@ def create_sample_student():
             is_active=True,
             balance=1000.00  # Give initial balance for testing
         )
-        salt = bcrypt.gensalt()
-        student.password_hash = bcrypt.hashpw('student123'.encode('utf-8'), salt).decode('utf-8')
+        student.password_hash = hash_password('student123')
         db.session.add(student)
     else:
         # Update balance if user exists
@@ -75,8 +72,7 @@ def create_additional_students():
                 is_active=True,
                 balance=balance
             )
-            salt = bcrypt.gensalt()
-            student.password_hash = bcrypt.hashpw('student123'.encode('utf-8'), salt).decode('utf-8')
+            student.password_hash = hash_password('student123')
             db.session.add(student)
 
 
@@ -266,6 +262,45 @@ def create_dishes():
             db.session.add(dish)
 
 
+# Recipes link dishes to ingredients; dish allergens are derived from them
+DISH_RECIPES = {
+    'Овсяная каша': [('Молоко', 0.2), ('Сахар', 0.01)],
+    'Омлет с сыром': [('Яйца', 2), ('Молоко', 0.05), ('Сыр', 0.03)],
+    'Сырники': [('Мука', 0.05), ('Яйца', 1), ('Сахар', 0.02), ('Сливочное масло', 0.01)],
+    'Блины с маслом': [('Мука', 0.08), ('Молоко', 0.15), ('Яйца', 1), ('Сливочное масло', 0.02)],
+    'Бутерброд с сыром': [('Хлеб', 1), ('Сыр', 0.03), ('Сливочное масло', 0.01)],
+    'Йогурт с мюсли': [('Молоко', 0.2), ('Бананы', 0.05)],
+    'Курица с рисом': [('Куриная грудка', 0.15), ('Рис', 0.1), ('Морковь', 0.03)],
+    'Говяжье рагу': [('Говядина', 0.15), ('Картофель', 0.15), ('Морковь', 0.05), ('Лук', 0.03)],
+    'Рыба с картофелем фри': [('Филе рыбы', 0.15), ('Картофель', 0.2), ('Мука', 0.02)],
+    'Паста Карбонара': [('Макароны', 0.12), ('Яйца', 1), ('Сыр', 0.03)],
+    'Овощной суп': [('Картофель', 0.1), ('Морковь', 0.05), ('Капуста', 0.05), ('Лук', 0.02)],
+    'Куриный суп': [('Куриная грудка', 0.08), ('Картофель', 0.1), ('Морковь', 0.03), ('Макароны', 0.03)],
+    'Свежий салат': [('Помидоры', 0.08), ('Огурцы', 0.08)],
+    'Салат из капусты': [('Капуста', 0.1), ('Морковь', 0.03)],
+    'Яблочный пирог': [('Мука', 0.06), ('Яблоки', 0.1), ('Яйца', 1), ('Сахар', 0.03), ('Сливочное масло', 0.02)],
+    'Фруктовый салат': [('Яблоки', 0.08), ('Бананы', 0.08)],
+    'Молоко': [('Молоко', 0.2)],
+    'Фруктовый сок': [('Яблоки', 0.2)],
+}
+
+
+def create_dish_ingredients():
+    dishes = {dish.name: dish for dish in Dish.query.all()}
+    ingredients = {ingredient.name: ingredient for ingredient in Ingredient.query.all()}
+    
+    for dish_name, recipe in DISH_RECIPES.items():
+        dish = dishes.get(dish_name)
+        if not dish or dish.dish_ingredients:
+            continue
+        for ingredient_name, quantity in recipe:
+            db.session.add(DishIngredient(
+                dish_id=dish.id,
+                ingredient_id=ingredients[ingredient_name].id,
+                quantity_required=quantity
+            ))
+
+
 def create_weekly_menu():
     today = date.today()
     
@@ -355,6 +390,9 @@ def seed_all():
         create_dishes()
         db.session.commit()
         
+        create_dish_ingredients()
+        db.session.commit()
+        
         create_breakfast_menu()
         create_weekly_menu()
         db.session.commit()
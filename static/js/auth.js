@@ -37,6 +37,7 @@ const Auth = {
             localStorage.removeItem('access_token');
             localStorage.removeItem('refresh_token');
             localStorage.removeItem('user');
+            this.clearCachedResponses();
             
             // Redirect to login
             window.location.href = '/login';
@@ -81,6 +82,57 @@ const Auth = {
         };
     },
     
+    // Cached GET bodies keyed by user and URL, revalidated with If-None-Match
+    cacheKey(url) {
+        const user = this.getUser();
+        return `api_cache:${user ? user.id : 'anonymous'}:${url}`;
+    },
+    
+    getCachedResponse(url) {
+        const cached = sessionStorage.getItem(this.cacheKey(url));
+        return cached ? JSON.parse(cached) : null;
+    },
+    
+    storeCachedResponse(url, etag, body) {
+        try {
+            sessionStorage.setItem(this.cacheKey(url), JSON.stringify({ etag, body }));
+        } catch (error) {
+            // Storage full or disabled - just skip caching
+        }
+    },
+    
+    clearCachedResponses() {
+        Object.keys(sessionStorage)
+            .filter(key => key.startsWith('api_cache:'))
+            .forEach(key => sessionStorage.removeItem(key));
+    },
+    
+    // Idempotency-Key per pending action: a retry after a network error reuses
+    // it, so the server replays the first answer instead of charging twice
+    pendingIdempotencyKeys: {},
+    
+    newIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
+            const r = Math.random() * 16 | 0;
+            return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+        });
+    },
+    
+    async idempotentCall(action, url, options = {}) {
+        const key = this.pendingIdempotencyKeys[action] || this.newIdempotencyKey();
+        this.pendingIdempotencyKeys[action] = key;
+        
+        const response = await this.apiCall(url, {
+            ...options,
+            headers: { ...options.headers, 'Idempotency-Key': key }
+        });
+        delete this.pendingIdempotencyKeys[action];
+        return response;
+    },
+    
     // Make authenticated API call
     async apiCall(url, options = {}) {
         const headers = this.getHeaders();
@@ -93,6 +145,12 @@ const Auth = {
             }
         };
         
+        const isGet = !config.method || config.method.toUpperCase() === 'GET';
+        const cached = isGet ? this.getCachedResponse(url) : null;
+        if (cached) {
+            config.headers['If-None-Match'] = cached.etag;
+        }
+        
         let response = await fetch(url, config);
         
         // If token expired, try to refresh
@@ -104,6 +162,22 @@ const Auth = {
             }
         }
         
+        // Unchanged on the server - answer from the cached body
+        if (response.status === 304 && cached) {
+            return new Response(cached.body, {
+                status: 200,
+                headers: {
+                    'Content-Type': 'application/json',
+                    'ETag': cached.etag
+                }
+            });
+        }
+        
+        const etag = response.headers.get('ETag');
+        if (isGet && response.ok && etag) {
+            this.storeCachedResponse(url, etag, await response.clone().text());
+        }
+        
         return response;
     }
 };
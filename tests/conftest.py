@@ -0,0 +1,60 @@
+import itertools
+
+import pytest
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Dish
+from app.services.tokens import issue_access_token
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client(use_cookies=False)
+
+
+@pytest.fixture
+def make_user(app):
+    counter = itertools.count(1)
+
+    def make_user(role='student', balance=0):
+        number = next(counter)
+        user = User(
+            email=f'{role}{number}@test.local',
+            full_name=f'{role.title()} {number}',
+            password_hash='!',
+            role=role,
+            balance=balance
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture
+def make_dish(app):
+    def make_dish(price=100, name='Тестовое блюдо'):
+        dish = Dish(name=name, price=price, category='Тест', is_available=True)
+        db.session.add(dish)
+        db.session.commit()
+        return dish
+    return make_dish
+
+
+@pytest.fixture
+def auth(app):
+    """Authorization headers for a user"""
+    def auth(user):
+        return {'Authorization': f'Bearer {issue_access_token(user)}'}
+    return auth
@@ -0,0 +1,45 @@
+from app.extensions import db
+from app.models import Ingredient
+from app.models.allergen import allergen_codes, allergen_mask, mask_from_codes
+
+
+def test_celery_is_not_fish():
+    assert allergen_codes(allergen_mask('сельдерей')) == ['celery']
+    assert allergen_codes(allergen_mask('Стебли сельдерея')) == ['celery']
+
+
+def test_herring_is_fish():
+    assert allergen_codes(allergen_mask('сельдь')) == ['fish']
+    assert allergen_codes(allergen_mask('Сельдь под шубой')) == ['fish']
+
+
+def test_codes_and_several_allergens():
+    assert allergen_codes(allergen_mask('fish, celery')) == ['fish', 'celery']
+    assert allergen_codes(allergen_mask('Омлет с сыром')) == ['milk', 'eggs']
+
+
+def test_honey_matches_whole_words_only():
+    assert allergen_codes(allergen_mask('мед')) == ['honey']
+    assert allergen_mask('медленно') == 0
+
+
+def test_new_ingredient_is_guessed_from_its_name(app):
+    guessed = Ingredient(name='Сельдь', unit='кг')
+    explicit = Ingredient(allergen_mask=mask_from_codes(['milk']), name='Сельдь в сливках', unit='кг')
+    assert allergen_codes(guessed.allergen_mask) == ['fish']
+    assert allergen_codes(explicit.allergen_mask) == ['milk']
+
+
+def test_rename_keeps_cleared_allergens(app):
+    ingredient = Ingredient(name='Молоко', unit='л')
+    db.session.add(ingredient)
+    db.session.commit()
+    assert allergen_codes(ingredient.allergen_mask) == ['milk']
+
+    ingredient.allergen_mask = 0
+    db.session.commit()
+    ingredient.name = 'Молоко 3,2%'
+    db.session.commit()
+
+    db.session.expire_all()
+    assert db.session.get(Ingredient, ingredient.id).allergen_mask == 0
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from flask import jsonify
+from flask_jwt_extended import jwt_required
+
+from app.extensions import db
+from app.models import User, Payment, IdempotencyKey
+from app.services.unit_of_work import unit_of_work
+from app.utils.idempotency import idempotent, request_fingerprint
+
+
+@pytest.fixture
+def student(make_user):
+    return make_user(balance=0)
+
+
+def topup(client, headers, key, amount=200, path='/api/wallet/topup'):
+    return client.post(path, json={'amount': amount}, headers={**headers, 'Idempotency-Key': key})
+
+
+def test_replay_returns_stored_answer(client, auth, student):
+    headers = auth(student)
+    first = topup(client, headers, 'topup-1')
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+
+    second = topup(client, headers, 'topup-1')
+    assert second.status_code == 201
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json() == first.get_json()
+
+    db.session.expire_all()
+    assert db.session.get(User, student.id).balance == Decimal('200')
+    assert Payment.query.count() == 1
+
+
+def test_same_key_for_another_request_is_rejected(client, auth, student):
+    headers = auth(student)
+    assert topup(client, headers, 'topup-1').status_code == 201
+
+    assert topup(client, headers, 'topup-1', amount=300).status_code == 422
+    assert topup(client, headers, 'topup-1', path='/api/payment').status_code == 422
+    assert Payment.query.count() == 1
+
+
+def test_rejected_request_does_not_store_key(client, auth, student):
+    headers = auth(student)
+    assert topup(client, headers, 'topup-1', amount=50).status_code == 400
+    assert IdempotencyKey.query.count() == 0
+
+    retry = topup(client, headers, 'topup-1', amount=50)
+    assert retry.status_code == 400
+    assert 'Idempotent-Replayed' not in retry.headers
+
+    assert topup(client, headers, 'topup-1').status_code == 201
+    assert IdempotencyKey.query.count() == 1
+
+
+def test_expired_key_is_reused(app, client, auth, student):
+    @app.route('/test/idempotent', methods=['POST'])
+    @jwt_required()
+    @idempotent
+    def remember_only():
+        # No query between the decorator's DELETE and this INSERT to autoflush it
+        with unit_of_work() as uow:
+            uow.remember({'fresh': True}, 201)
+        return jsonify({'fresh': True}), 201
+
+    with app.test_request_context('/test/idempotent', method='POST', json={}):
+        fingerprint = request_fingerprint()
+    db.session.add(IdempotencyKey(
+        user_id=student.id,
+        key='old-key',
+        fingerprint=fingerprint,
+        status_code=201,
+        response={'fresh': False},
+        created_at=datetime.utcnow() - timedelta(hours=48)
+    ))
+    db.session.commit()
+
+    response = client.post('/test/idempotent', json={}, headers={**auth(student), 'Idempotency-Key': 'old-key'})
+    assert response.status_code == 201
+    assert response.get_json() == {'fresh': True}
+    assert 'Idempotent-Replayed' not in response.headers
+
+    db.session.expire_all()
+    stored = IdempotencyKey.query.filter_by(user_id=student.id, key='old-key').one()
+    assert stored.response == {'fresh': True}
+    assert stored.created_at > datetime.utcnow() - timedelta(hours=1)
@@ -0,0 +1,169 @@
+from decimal import Decimal
+
+import pytest
+
+from app.extensions import db
+from app.models import (
+    User, Payment, DishPurchase, Notification, OutboxEvent, WalletEntry,
+    Ingredient, Inventory, PurchaseRequest
+)
+from app.services import unit_of_work as unit_of_work_module
+from app.services.unit_of_work import unit_of_work
+
+
+def commits(response):
+    return response.headers['X-Commit-Count']
+
+
+@pytest.fixture
+def student(make_user):
+    return make_user(balance=1000)
+
+
+@pytest.fixture
+def ingredient(app):
+    ingredient = Ingredient(name='Картофель', unit='кг')
+    db.session.add(ingredient)
+    db.session.flush()
+    db.session.add(Inventory(ingredient_id=ingredient.id, quantity=10))
+    db.session.commit()
+    return ingredient
+
+
+def test_payment(client, auth, student):
+    response = client.post('/api/payment', json={'amount': 150}, headers=auth(student))
+    assert response.status_code == 201
+    assert commits(response) == '1'
+
+    response = client.post('/api/payment', json={'amount': -5}, headers=auth(student))
+    assert response.status_code == 400
+    assert commits(response) == '0'
+
+
+def test_subscription(client, auth, student, make_user):
+    response = client.post('/api/subscription', json={'subscription_type': 'weekly'}, headers=auth(student))
+    assert response.status_code == 201
+    assert commits(response) == '1'
+
+    poor = make_user(balance=10)
+    response = client.post('/api/subscription', json={'subscription_type': 'weekly'}, headers=auth(poor))
+    assert response.status_code == 402
+    assert commits(response) == '0'
+
+
+def test_wallet_topup(client, auth, student):
+    response = client.post('/api/wallet/topup', json={'amount': 200}, headers=auth(student))
+    assert response.status_code == 201
+    assert commits(response) == '1'
+
+    response = client.post('/api/wallet/topup', json={'amount': 50}, headers=auth(student))
+    assert response.status_code == 400
+    assert commits(response) == '0'
+
+
+def test_dish_purchase(client, auth, student, make_user, make_dish):
+    dish = make_dish(price=120)
+    response = client.post(f'/api/dishes/{dish.id}/purchase', json={}, headers=auth(student))
+    assert response.status_code == 201
+    assert commits(response) == '1'
+
+    poor = make_user(balance=10)
+    response = client.post(f'/api/dishes/{dish.id}/purchase', json={}, headers=auth(poor))
+    assert response.status_code == 402
+    assert commits(response) == '0'
+
+
+def test_purchase_use(client, auth, student, make_dish):
+    dish = make_dish()
+    headers = auth(student)
+    purchase_id = client.post(f'/api/dishes/{dish.id}/purchase', json={}, headers=headers).get_json()['purchase']['id']
+
+    response = client.post(f'/api/purchases/{purchase_id}/use', headers=headers)
+    assert response.status_code == 200
+    assert commits(response) == '1'
+
+    response = client.post(f'/api/purchases/{purchase_id}/use', headers=headers)
+    assert response.status_code == 409
+    assert commits(response) == '0'
+
+
+def test_purchase_request_and_review(client, auth, make_user, ingredient):
+    cook, admin = make_user('cook'), make_user('admin')
+    response = client.post('/api/cook/purchase-requests', json={
+        'items': [{'ingredient_id': ingredient.id, 'quantity': 5}]
+    }, headers=auth(cook))
+    assert response.status_code == 201
+    assert commits(response) == '1'
+    request_id = response.get_json()['purchase_request']['id']
+
+    response = client.post('/api/cook/purchase-requests', json={
+        'items': [{'ingredient_id': ingredient.id, 'quantity': 0}]
+    }, headers=auth(cook))
+    assert response.status_code == 400
+    assert commits(response) == '0'
+
+    response = client.put(f'/api/admin/purchase-requests/{request_id}', json={'status': 'approved'}, headers=auth(admin))
+    assert response.status_code == 200
+    assert commits(response) == '1'
+    assert Inventory.query.filter_by(ingredient_id=ingredient.id).one().quantity == Decimal('15')
+
+    response = client.put(f'/api/admin/purchase-requests/{request_id}', json={'status': 'rejected'}, headers=auth(admin))
+    assert response.status_code == 400
+    assert commits(response) == '0'
+    assert PurchaseRequest.query.count() == 1
+
+
+@pytest.fixture
+def failing_commit(monkeypatch):
+    """Make UnitOfWork.commit fail after its notifications are inserted"""
+    real_insert = unit_of_work_module.insert_notifications
+
+    def insert_then_fail(rows):
+        real_insert(rows)
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(unit_of_work_module, 'insert_notifications', insert_then_fail)
+
+
+def test_failure_inside_block_rolls_back_everything(app, student):
+    with pytest.raises(RuntimeError):
+        with unit_of_work() as uow:
+            uow.add(Payment(user_id=student.id, amount=100, payment_type='single', status='completed'))
+            uow.notify(student.id, 'Оплата', 'Оплата прошла')
+            uow.publish('payment_completed', user_id=student.id, amount=100.0)
+            uow.flush()
+            raise RuntimeError('boom')
+
+    assert Payment.query.count() == 0
+    assert Notification.query.count() == 0
+    assert OutboxEvent.query.count() == 0
+
+
+def test_failure_at_commit_rolls_back_staged_notifications(app, student, failing_commit):
+    with pytest.raises(RuntimeError):
+        with unit_of_work() as uow:
+            uow.add(Payment(user_id=student.id, amount=100, payment_type='single', status='completed'))
+            uow.notify(student.id, 'Оплата', 'Оплата прошла')
+            uow.publish('payment_completed', user_id=student.id, amount=100.0)
+
+    db.session.expire_all()
+    user = db.session.get(User, student.id)
+    assert user.notification_seq == 0
+    assert user.unread_notifications == 0
+    assert Payment.query.count() == 0
+    assert Notification.query.count() == 0
+    assert OutboxEvent.query.count() == 0
+
+
+def test_failure_at_commit_rolls_back_the_request(client, auth, student, make_dish, failing_commit):
+    dish = make_dish(price=120)
+    response = client.post(f'/api/dishes/{dish.id}/purchase', json={}, headers=auth(student))
+    assert response.status_code == 500
+
+    db.session.expire_all()
+    user = db.session.get(User, student.id)
+    assert user.balance == Decimal('1000')
+    assert user.balance_version == 0
+    assert DishPurchase.query.count() == 0
+    assert WalletEntry.query.count() == 0
+    assert OutboxEvent.query.count() == 0
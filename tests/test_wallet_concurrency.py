@@ -0,0 +1,95 @@
+import threading
+from decimal import Decimal
+
+import pytest
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Payment, DishPurchase, WalletEntry
+from app.models.user import to_money
+from config import TestingConfig
+
+STUDENTS = 6
+REQUESTS = 300
+THREADS = 12
+OPENING_BALANCE = Decimal('300.00')
+PRICE = Decimal('70.00')
+TOPUP = Decimal('100.00')
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Threads cannot share an in-memory database
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path / "wallet.db"}')
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_parallel_purchases_and_topups_keep_balances_exact(app, make_user, make_dish, auth):
+    dish_id = make_dish(price=PRICE).id
+    students = [make_user(balance=OPENING_BALANCE) for _ in range(STUDENTS)]
+    headers = [(student.id, auth(student)) for student in students]
+
+    statuses = []
+    jobs = iter(range(REQUESTS))
+    lock = threading.Lock()
+
+    def run():
+        client = app.test_client(use_cookies=False)
+        while True:
+            with lock:
+                job = next(jobs, None)
+            if job is None:
+                return
+            _, student_headers = headers[job % STUDENTS]
+            if job // STUDENTS % 4 == 3:
+                response = client.post('/api/wallet/topup', json={'amount': float(TOPUP)}, headers=student_headers)
+            else:
+                response = client.post(f'/api/dishes/{dish_id}/purchase', json={}, headers=student_headers)
+            with lock:
+                statuses.append(response.status_code)
+
+    workers = [threading.Thread(target=run) for _ in range(THREADS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert set(statuses) <= {201, 402}
+    assert 402 in statuses
+
+    db.session.expire_all()
+    for user_id, _ in headers:
+        user = db.session.get(User, user_id)
+        credited = db.session.query(db.func.coalesce(db.func.sum(Payment.amount), 0)).filter(
+            Payment.user_id == user_id, Payment.payment_type == 'topup'
+        ).scalar()
+        spent = db.session.query(db.func.coalesce(db.func.sum(DishPurchase.price_paid), 0)).filter(
+            DishPurchase.user_id == user_id
+        ).scalar()
+        last_entry = WalletEntry.query.filter_by(user_id=user_id).order_by(WalletEntry.id.desc()).first()
+
+        expected = OPENING_BALANCE + to_money(credited) - to_money(spent)
+        assert to_money(user.balance) >= 0
+        assert to_money(user.balance) == expected
+        assert to_money(last_entry.balance_after) == expected
+        assert user.balance_version == WalletEntry.query.filter_by(user_id=user_id).count()
+
+
+def test_debit_larger_than_balance_changes_nothing(client, make_user, make_dish, auth):
+    dish = make_dish(price=PRICE)
+    student = make_user(balance=Decimal('69.99'))
+
+    response = client.post(f'/api/dishes/{dish.id}/purchase', json={}, headers=auth(student))
+    assert response.status_code == 402
+
+    db.session.expire_all()
+    user = db.session.get(User, student.id)
+    assert user.balance == Decimal('69.99')
+    assert user.balance_version == 0
+    assert WalletEntry.query.count() == 0
+    assert DishPurchase.query.count() == 0